@@ -4,22 +4,56 @@ import json
 import hashlib
 import hmac
 import urllib.parse
-import requests
 import logging
 import os
-import statistics
 import math
+import heapq
+import threading
 
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from .common import val_arg, val_run
+from .series import parse_series, iter_series, build_candles
+from .stats import build_stats, build_stats_approx, build_indicators
+from .transport import RetryPolicy, HedgePolicy, RateLimiter, CircuitBreaker, remaining_time, check_deadline, submit
+from .cache import DiskCache
+from .orderbook import OrderBook
+from .exception import DeadlineExceededException
 
 logger = logging.getLogger(__name__)
 
+# Default (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5.0, 30.0)
+
+# Chunk size for streamed response bodies
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Reference indices that price history scans can rank coins by
+SCAN_INDICES = ("avg_price_diff_pct", "med_price_diff_pct", "max_price_diff_pct", "pstdev_index",
+    "quartile_index", "ten_quantile_index", "width_index")
+
+def as_text(response):
+    """
+    Convert a requestor response body to str
+    """
+
+    if isinstance(response, bytes):
+        return response.decode("utf-8")
+
+    return response
+
 class CoinSpotApi:
-    def __init__(self, base_url=None, requestor=None):
+    def __init__(self, base_url=None, requestor=None, retry_policy=None, hedge_policy=None, cache=None, breaker=None,
+                 timeout=DEFAULT_TIMEOUT):
         val_arg(isinstance(base_url, (str, type(None))), "Invalid base_url passed to CoinSpotApi")
         val_arg(requestor is None or callable(requestor), "Invalid requestor passed to CoinSpotApi")
+        val_arg(isinstance(retry_policy, (RetryPolicy, type(None))), "Invalid retry_policy passed to CoinSpotApi")
+        val_arg(isinstance(hedge_policy, (HedgePolicy, type(None))), "Invalid hedge_policy passed to CoinSpotApi")
+        val_arg(isinstance(cache, (DiskCache, type(None))), "Invalid cache passed to CoinSpotApi")
+        val_arg(isinstance(breaker, (CircuitBreaker, type(None))), "Invalid breaker passed to CoinSpotApi")
+        val_arg(timeout is None or (isinstance(timeout, tuple) and len(timeout) == 2 and all(isinstance(x, (int, float)) and x > 0 for x in timeout)),
+            "Invalid timeout passed to CoinSpotApi")
 
         # Default base url
         if base_url is None:
@@ -27,17 +61,177 @@ class CoinSpotApi:
 
         self.base_url = base_url
 
+        # Retry and hedging only apply to (idempotent) get requests
+        self.retry_policy = retry_policy
+        self.hedge_policy = hedge_policy
+
+        # Optional response cache for public get requests
+        self.cache = cache
+
+        # Connect and read timeouts (seconds) for the default requestors
+        self.timeout = timeout
+
+        # Optional circuit breaker, failing requests fast while an endpoint
+        # family is failing
+        self.breaker = breaker
+
+        # Nonces must increase across requests, even when generated within the
+        # same clock tick
+        self.nonce_lock = threading.Lock()
+        self.last_nonce = 0
+
+        # Signed requests are sent one at a time, from signing through to the
+        # response, so concurrent callers sharing the api can't have nonces
+        # arrive at the api out of order
+        self.post_lock = threading.RLock()
+
+        # Requestors may return the body as str or bytes. The default returns
+        # bytes, which are parsed directly, without decoding to a str first
         def default_requestor(method, url, headers, payload):
-            response = requests.request(method, url, headers=headers, data=payload)
-            response.raise_for_status()
-            return response.text
+            response = self.session_request(method, url, headers, payload)
+            return response.content
+
+        # Streaming requestors make the request and return an iterator over the
+        # body in chunks, for responses parsed incrementally
+        def default_stream_requestor(method, url, headers, payload):
+            response = self.session_request(method, url, headers, payload, stream=True)
+
+            # Each read is only bounded by the read timeout, so a slowly
+            # trickling body is checked against the deadline between chunks
+            def chunks():
+                with response:
+                    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                        check_deadline(f"reading the rest of {urllib.parse.urlparse(url).path}")
+                        yield chunk
+
+            return chunks()
 
         # This can be overridden for testing
+        self.session = None
+        self.stream_requestor = None
         if requestor is None:
+            # requests is imported here, rather than at module level, so commands
+            # forwarded to the daemon don't pay for the import
+            import requests # pylint: disable=import-outside-toplevel
+
+            # Pooled connections for requests to the API
+            self.session = requests.Session()
             requestor = default_requestor
+            self.stream_requestor = default_stream_requestor
 
         self.requestor = requestor
 
+    def session_request(self, method, url, headers, payload, stream=False):
+        """
+        Make a request with the pooled session, within the timeouts, raising for
+        error responses. A timeout cut short by the deadline is reported as
+        the deadline being exceeded.
+        """
+
+        import requests # pylint: disable=import-outside-toplevel
+
+        try:
+            response = self.session.request(method, url, headers=headers, data=payload, stream=stream,
+                timeout=self.request_timeout())
+        except requests.Timeout as e:
+            if remaining_time() == 0:
+                raise DeadlineExceededException(f"Deadline exceeded during {method} {urllib.parse.urlparse(url).path}") from e
+            raise
+
+        try:
+            response.raise_for_status()
+        except BaseException:
+            response.close()
+            raise
+
+        return response
+
+    def request_timeout(self):
+        """
+        Connect and read timeouts for a request, limited to the time remaining
+        before the current deadline
+        """
+
+        timeout = self.timeout
+        remaining = remaining_time()
+
+        if remaining is None:
+            return timeout
+
+        # Allow a moment, so an expired deadline still gives a valid timeout
+        remaining = max(remaining, 0.001)
+        if timeout is None:
+            return (remaining, remaining)
+
+        return (min(timeout[0], remaining), min(timeout[1], remaining))
+
+    def request(self, method, url, headers, payload=None):
+        """
+        Make a request through the requestor, applying the cache, retry and hedge
+        policies to get requests. Signed post requests are only passed through
+        the circuit breaker.
+        """
+
+        check_deadline(f"{method} {urllib.parse.urlparse(url).path}")
+
+        def call():
+            return self.requestor(method, url, headers, payload)
+
+        if method != "get":
+            if self.breaker is not None:
+                return self.breaker.call(url, call)
+
+            return call()
+
+        hedged = call
+        if self.hedge_policy is not None:
+            def hedged():
+                return self.hedge_policy.call(call)
+
+        # The breaker sees each attempt, so retries stop once the circuit opens
+        func = hedged
+        if self.breaker is not None:
+            def func():
+                return self.breaker.call(url, hedged)
+
+        fetch = func
+        if self.retry_policy is not None:
+            def fetch():
+                return self.retry_policy.call(func)
+
+        # Only unsigned requests are eligible for caching
+        if self.cache is not None and "Sign" not in headers:
+            return self.cache.fetch(url, fetch)
+
+        return fetch()
+
+    def stream(self, url, headers):
+        """
+        Make a get request, returning an iterator over the response body in
+        chunks. Requests that may be served from the cache, or made without a
+        streaming requestor, are made through request and returned as a single
+        chunk. Streamed requests are retried if they fail before the body is
+        read, but aren't hedged.
+        """
+
+        check_deadline(f"get {urllib.parse.urlparse(url).path}")
+
+        if self.stream_requestor is None or (self.cache is not None and self.cache.ttl(url) is not None):
+            return iter((self.request("get", url, headers),))
+
+        def stream_call():
+            return self.stream_requestor("get", url, headers, None)
+
+        call = stream_call
+        if self.breaker is not None:
+            def call():
+                return self.breaker.call(url, stream_call)
+
+        if self.retry_policy is not None:
+            return self.retry_policy.call(call)
+
+        return call()
+
     def get(self, url, raw_output=False):
 
         # Process incoming arguments
@@ -54,14 +248,14 @@ class CoinSpotApi:
         # Make request to the endpoint
         logger.debug("url: %s", url)
         logger.debug("headers: %s", headers)
-        response = self.requestor("get", url, headers, payload=None)
+        response = self.request("get", url, headers)
 
         logger.debug("Response: %s", response)
 
         if not raw_output:
-            response = self.process_response(response)
+            return self.process_response(response)
 
-        return response
+        return as_text(response)
 
     def post(self, url, payload, raw_payload=False, raw_output=False):
 
@@ -71,6 +265,33 @@ class CoinSpotApi:
         val_arg(isinstance(raw_payload, bool), "Invalid raw_payload argument to CoinSpotApi.post")
         val_arg(isinstance(raw_output, bool), "Invalid raw_output value supplied to CoinSpotApi.post")
 
+        with self.post_lock:
+            prepared = self.prepare_post(url, payload, raw_payload=raw_payload)
+
+            return self.send_prepared(prepared, raw_output=raw_output)
+
+    def next_nonce(self):
+        """
+        Generate a nonce, strictly increasing across calls on this instance
+        """
+
+        with self.nonce_lock:
+            nonce = max(time.time_ns(), self.last_nonce + 1)
+            self.last_nonce = nonce
+
+        return str(nonce)
+
+    def prepare_post(self, url, payload, raw_payload=False):
+        """
+        Build and sign a post request, returning a (url, headers, payload) tuple
+        for send_prepared. Requests prepared in order carry ascending nonces.
+        """
+
+        # Process incoming arguments
+        val_arg(isinstance(url, str), "Invalid url provided to CoinSpotApi.prepare_post")
+        val_arg(url != "", "Empty url provided to CoinSpotApi.prepare_post")
+        val_arg(isinstance(raw_payload, bool), "Invalid raw_payload argument to CoinSpotApi.prepare_post")
+
         # Convert payload, if required
         if not isinstance(payload, str):
             payload = json.dumps(payload)
@@ -81,31 +302,47 @@ class CoinSpotApi:
         # Parse the payload input and add the nonce, if required
         if not raw_payload:
             parsed = json.loads(payload)
-            parsed["nonce"] = str(time.time_ns())
+            parsed["nonce"] = self.next_nonce()
             payload = json.dumps(parsed, separators=(",", ":"))
 
         # Headers for request
         headers = self.build_headers(payload=payload)
 
+        return url, headers, payload
+
+    def send_prepared(self, prepared, raw_output=False):
+        """
+        Send a post request built by prepare_post. Sends are serialised with
+        other signed requests, but requests prepared ahead must still be sent
+        in the order they were prepared.
+        """
+
+        # Process incoming arguments
+        val_arg(isinstance(prepared, tuple) and len(prepared) == 3, "Invalid prepared request supplied to CoinSpotApi.send_prepared")
+        val_arg(isinstance(raw_output, bool), "Invalid raw_output value supplied to CoinSpotApi.send_prepared")
+
+        url, headers, payload = prepared
+
         # Make request to the endpoint
         logger.debug("url: %s", url)
         logger.debug("headers: %s", headers)
         logger.debug("payload: %s", payload)
-        response = self.requestor("post", url, headers, payload)
+        with self.post_lock:
+            response = self.request("post", url, headers, payload)
 
         logger.debug("Response: %s", response)
 
         if not raw_output:
-            response = self.process_response(response)
+            return self.process_response(response)
 
-        return response
+        return as_text(response)
 
     def process_response(self, response):
 
         # Validate incoming args
-        val_arg(isinstance(response, str), "Invalid type for response")
+        val_arg(isinstance(response, (str, bytes)), "Invalid type for response")
 
-        # Deserialise response
+        # Deserialise response, directly from bytes where possible
         content = json.loads(response)
 
         # Check for status messages
@@ -147,7 +384,8 @@ class CoinSpotApi:
 
         return headers
 
-    def get_price_history(self, coin, age_hours=7, stats=False, reference_price=None):
+    def get_price_history(self, coin, age_hours=7, stats=False, reference_price=None, chunk_hours=None, workers=4, approx=False,
+                          indicators=None, quantiles=None):
         """
         Retrieve the coin price for the last x hours
         """
@@ -161,18 +399,39 @@ class CoinSpotApi:
         start_date = (now - timedelta(hours=age_hours))
 
         # Call get_price_history_range to make the request
-        return self.get_price_history_range(coin, start_date, end_date, stats=stats, reference_price=reference_price)
+        return self.get_price_history_range(coin, start_date, end_date, stats=stats, reference_price=reference_price,
+            chunk_hours=chunk_hours, workers=workers, approx=approx, indicators=indicators, quantiles=quantiles)
 
-    def get_price_history_range(self, coin, start_date, end_date, stats=False, reference_price=None):
+    def get_price_history_range(self, coin, start_date, end_date, stats=False, reference_price=None, chunk_hours=None, workers=4,
+                                approx=False, indicators=None, quantiles=None):
         """
         Retrieve the coin price for the specified range
+
+        If chunk_hours is supplied, a range longer than chunk_hours is split in to
+        chunks that are retrieved concurrently (and retried individually), then
+        merged back in to a single series
+
+        If approx is set, stats are calculated in a single pass with bounded memory,
+        with median and quantiles estimated by a streaming sketch
+
+        indicators is a list of (name, period) technical indicators to add to the
+        stats, as returned by stats.parse_indicators
+
+        reference_price may be a list of prices, which are all evaluated against
+        the same sorted series, and quantiles is a list of fractions (0 to 1) to
+        add to the stats
         """
 
         # Process incoming arguments
         val_arg(isinstance(coin, str) and coin != "", "Invalid coin type passed to get_history")
         val_arg(isinstance(start_date, datetime), "Invalid start_date passed to get_price_history_range")
         val_arg(isinstance(end_date, datetime), "Invalid end_date passed to get_price_history_range")
-        val_arg(isinstance(reference_price, (int, float, type(None))), "Invalid reference price passed to get_price_history_range")
+        val_arg(isinstance(reference_price, (int, float, list, type(None))), "Invalid reference price passed to get_price_history_range")
+        val_arg(chunk_hours is None or (isinstance(chunk_hours, int) and chunk_hours > 0), "Invalid chunk_hours passed to get_price_history_range")
+        val_arg(isinstance(workers, int) and workers > 0, "Invalid workers passed to get_price_history_range")
+        val_arg(isinstance(approx, bool), "Invalid approx passed to get_price_history_range")
+        val_arg(isinstance(indicators, (list, type(None))), "Invalid indicators passed to get_price_history_range")
+        val_arg(isinstance(quantiles, (list, type(None))), "Invalid quantiles passed to get_price_history_range")
 
         # Calculate start and end times
         start = int(start_date.timestamp() * 1000)
@@ -181,8 +440,88 @@ class CoinSpotApi:
         # Coinspot only recognises upper case coin types
         coin = coin.upper()
 
+        chunk_ms = None
+        if chunk_hours is not None:
+            chunk_ms = chunk_hours * 60 * 60 * 1000
+
+        chunked = chunk_ms is not None and end - start > chunk_ms
+
+        if not stats:
+            if chunked:
+                return self.fetch_price_history_chunked(coin, start, end, chunk_ms, workers)
+
+            return as_text(self.fetch_price_history(coin, start, end))
+
+        # The series is parsed incrementally, from the streamed body where possible
+        if chunked:
+            items = iter_series((self.fetch_price_history_chunked(coin, start, end, chunk_ms, workers),))
+        else:
+            items = self.iter_price_history(coin, start, end)
+
+        # A list of reference prices is reported alongside the default reference
+        # (the last price)
+        reference_prices = None
+        if isinstance(reference_price, list):
+            reference_prices = reference_price
+            reference_price = None
+
+        options = {"reference_price": reference_price, "reference_prices": reference_prices, "quantiles": quantiles}
+
+        prices = None
+        if approx and not indicators:
+            # Prices are streamed in to the sketch, rather than copied to a list
+            stats_values = build_stats_approx((x[1] for x in items), **options)
+        else:
+            prices = [x[1] for x in items]
+            val_run(len(prices) > 0, "Invalid response from endpoint - Empty array")
+            val_run(all(not math.isnan(x) for x in prices), "Invalid response from endpoint - NaN values")
+
+            if approx:
+                stats_values = build_stats_approx(prices, **options)
+            else:
+                stats_values = build_stats(prices, **options)
+
+        stats_response = {
+            "start_date": start_date.astimezone().isoformat(),
+            "end_date": end_date.astimezone().isoformat(),
+            "coin": coin,
+            **stats_values
+        }
+
+        if indicators:
+            stats_response["indicators"] = build_indicators(prices, indicators)
+
+        return json.dumps(stats_response)
+
+    def price_history_url(self, coin, start, end):
+        """
+        Absolute history_basic url for a coin between start and end (epoch
+        milliseconds)
+        """
+
+        return urllib.parse.urljoin(self.base_url, f"/charts/history_basic?symbol={coin}&from={start}&to={end}")
+
+    def iter_price_history(self, coin, start, end):
+        """
+        Retrieve the history_basic series for a coin between start and end (epoch
+        milliseconds), yielding (ts, price) tuples parsed incrementally from the
+        streamed response
+        """
+
+        url = self.price_history_url(coin, start, end)
+
+        logger.debug("url: %s", url)
+
+        return iter_series(self.stream(url, self.build_headers()))
+
+    def fetch_price_history(self, coin, start, end):
+        """
+        Retrieve the raw history_basic response for a coin between start and end
+        (epoch milliseconds)
+        """
+
         # Build the query url
-        url = urllib.parse.urljoin(self.base_url, f"/charts/history_basic?symbol={coin}&from={start}&to={end}")
+        url = self.price_history_url(coin, start, end)
 
         # Headers for request
         headers = self.build_headers()
@@ -190,79 +529,236 @@ class CoinSpotApi:
         # Make request to the endpoint
         logger.debug("url: %s", url)
         logger.debug("headers: %s", headers)
-        response = self.requestor("get", url, headers, payload=None)
+        response = self.request("get", url, headers)
 
         logger.debug("Response: %s", response)
 
-        if stats:
-            parsed = json.loads(response)
+        return response
+
+    def fetch_price_history_chunked(self, coin, start, end, chunk_ms, workers=4):
+        """
+        Retrieve the history_basic series for a coin between start and end (epoch
+        milliseconds) as concurrent chunk requests, merged in timestamp order with
+        duplicate boundary samples removed
+        """
 
+        # Chunk boundaries, each chunk ending where the next starts
+        bounds = []
+        chunk_start = start
+        while chunk_start < end:
+            chunk_end = min(end, chunk_start + chunk_ms)
+            bounds.append((chunk_start, chunk_end))
+            chunk_start = chunk_end
+
+        # Each chunk is retried on its own, so one failure doesn't refetch the
+        # range. Requests already retry when the api has a retry policy.
+        retry_policy = RetryPolicy(attempts=1)
+        if self.retry_policy is None:
+            retry_policy = RetryPolicy()
+
+        def fetch(bound):
+            response = retry_policy.call(lambda: self.fetch_price_history(coin, bound[0], bound[1]))
+            parsed = json.loads(response)
             val_run(isinstance(parsed, list), "Invalid response from endpoint - not a list")
-            val_run(all(isinstance(x, list) for x in parsed), "Invalid response from endpoint - Some items are not lists")
-            val_run(all(len(x) == 2 for x in parsed), "Invalid response from endpoint - Elements should have two items")
-            val_run(len(parsed) > 0, "Invalid response from endpoint - Empty array")
+            return parsed
 
-            prices = [x[1] for x in parsed]
-            val_run(all(not math.isnan(x) for x in prices), "Invalid response from endpoint - NaN values")
+        logger.debug("Retrieving price history in %s chunks", len(bounds))
 
-            price_first = prices[0]
-            price_last = prices[-1]
-
-            price_min = min(prices)
-            price_max = max(prices)
-
-            avg = statistics.mean(prices)
-
-            quartiles = statistics.quantiles(prices)
-
-            ten_quantiles = statistics.quantiles(prices, n=10)
-
-            width = price_max - price_min
-
-            median = statistics.median(prices)
-            pstdev = statistics.pstdev(prices)
-
-            growth = price_last - price_first
-            growth_pct = growth / price_first * 100
-
-            # Indexes
-            if reference_price is None:
-                reference_price = price_last
-
-            ten_quantile_index = sum(1 for x in ten_quantiles if reference_price > x)
-            quartile_index = sum(1 for x in quartiles if reference_price > x)
-            pstdev_index = (reference_price - median) / pstdev
-            width_index = (reference_price - price_min) / width
-
-            stats_response = {
-                "start_date": start_date.astimezone().isoformat(),
-                "end_date": end_date.astimezone().isoformat(),
-                "coin": coin,
-                "first": price_first,
-                "last": price_last,
-                "min": price_min,
-                "max": price_max,
-                "avg": avg,
-                "med": median,
-                "width": width,
-                "growth": price_last - price_first,
-                "growth_pct": growth_pct,
-                "quartiles": quartiles,
-                "ten_quantiles": ten_quantiles,
-                "pstdev": statistics.pstdev(prices),
-                "reference": {
-                    "reference_price": reference_price,
-                    "quartile_index": quartile_index,
-                    "ten_quantile_index": ten_quantile_index,
-                    "width_index": width_index,
-                    "pstdev_index": pstdev_index,
-                    "avg_price_diff_pct": (avg / reference_price - 1)*100,
-                    "med_price_diff_pct": (median / reference_price - 1)*100,
-                    "max_price_diff_pct": (price_max / reference_price - 1)*100
-                }
-            }
+        with ThreadPoolExecutor(max_workers=min(workers, len(bounds))) as executor:
+            chunks = [x.result() for x in [submit(executor, fetch, bound) for bound in bounds]]
 
-            response = json.dumps(stats_response)
+        merged = []
+        last_ts = None
+        for item in heapq.merge(*chunks, key=lambda x: x[0]):
+            if item[0] == last_ts:
+                continue
 
-        return response
+            merged.append(item)
+            last_ts = item[0]
+
+        return json.dumps(merged, separators=(",", ":"))
+
+    def scan_price_history(self, age_hours=24, index="avg_price_diff_pct", top=10, lowest=False, workers=8, rate=10.0):
+        """
+        Calculate price history stats for every coin in the latest prices snapshot,
+        referenced against each coin's last price, keeping the top coins by a
+        reference index
+
+        Histories are retrieved concurrently, with requests started no faster than
+        rate per second, and only the best top results are held (in a bounded heap)
+        while the scan runs. Coins whose history can't be retrieved are reported as
+        skipped.
+        """
+
+        # Process incoming arguments
+        val_arg(isinstance(age_hours, int) and age_hours > 0, "Invalid age_hours passed to scan_price_history")
+        val_arg(index in SCAN_INDICES, "Invalid index passed to scan_price_history")
+        val_arg(isinstance(top, int) and top > 0, "Invalid top passed to scan_price_history")
+        val_arg(isinstance(workers, int) and workers > 0, "Invalid workers passed to scan_price_history")
+        val_arg(isinstance(rate, (int, float)) and rate > 0, "Invalid rate passed to scan_price_history")
+
+        latest = json.loads(self.get("/pubapi/v2/latest"))
+        val_run(isinstance(latest.get("prices"), dict), "API response missing 'prices' key")
+
+        # Only coins with a usable last price can be referenced
+        coins = {}
+        for coin, price in latest["prices"].items():
+            try:
+                last = float(price["last"])
+            except (KeyError, TypeError, ValueError):
+                continue
+
+            if last > 0:
+                coins[coin.upper()] = last
+
+        limiter = RateLimiter(rate)
+
+        def fetch(coin):
+            limiter.acquire()
+            return json.loads(self.get_price_history(coin, age_hours=age_hours, stats=True, reference_price=coins[coin]))
+
+        # Heap of (key, coin, stats), with the worst kept result at the top
+        sign = -1 if lowest else 1
+        heap = []
+        skipped = []
+
+        logger.debug("Scanning price history for %s coins", len(coins))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {submit(executor, fetch, coin): coin for coin in coins}
+
+            for future in as_completed(futures):
+                coin = futures[future]
+
+                try:
+                    stats = future.result()
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    logger.debug("Skipping %s: %s", coin, e)
+                    skipped.append(coin)
+                    continue
+
+                item = (sign * stats["reference"][index], coin, stats)
+                if len(heap) < top:
+                    heapq.heappush(heap, item)
+                elif item[0] > heap[0][0]:
+                    heapq.heapreplace(heap, item)
+
+        results = [{"coin": coin, "value": stats["reference"][index], "stats": stats}
+            for _, coin, stats in sorted(heap, reverse=True)]
+
+        return json.dumps({
+            "age_hours": age_hours,
+            "index": index,
+            "lowest": lowest,
+            "scanned": len(coins) - len(skipped),
+            "skipped": sorted(skipped),
+            "results": results
+        })
+
+    def get_price_candles(self, coin, age_hours=7, interval_secs=3600):
+        """
+        Retrieve open/high/low/close candles for the coin price for the last x hours
+        """
+
+        # Validate incoming parameters
+        val_arg(isinstance(age_hours, int) and age_hours > 0, "Invalid age_hours specified")
+
+        # Calculate range
+        now = datetime.now()
+        end_date = now
+        start_date = (now - timedelta(hours=age_hours))
+
+        # Call get_price_candles_range to make the request
+        return self.get_price_candles_range(coin, start_date, end_date, interval_secs=interval_secs)
+
+    def get_price_candles_range(self, coin, start_date, end_date, interval_secs=3600):
+        """
+        Retrieve open/high/low/close candles for the coin price for the specified range
+        """
+
+        # Validate incoming parameters
+        val_arg(isinstance(interval_secs, int) and interval_secs > 0, "Invalid interval_secs specified")
+
+        response = self.get_price_history_range(coin, start_date, end_date)
+
+        timestamps, prices = parse_series(response)
+        candles = build_candles(timestamps, prices, interval_secs * 1000)
+
+        return json.dumps(candles)
+
+    def get_order_book(self, coin):
+        """
+        Retrieve the open order book for a coin, with depth prefix sums for
+        estimating fills
+        """
+
+        val_arg(isinstance(coin, str) and coin != "", "Invalid coin passed to get_order_book")
+
+        coin = coin.upper()
+        response = self.get(f"/pubapi/v2/orders/open/{coin}")
+
+        return OrderBook.from_response(coin, response)
+
+    def get_portfolio(self):
+        """
+        Value the account balances at the current prices, using a single balances
+        request and a single all coins price snapshot, made concurrently
+        """
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            balances_future = submit(executor, self.post, "/api/v2/ro/my/balances", {})
+            latest_future = submit(executor, self.get, "/pubapi/v2/latest")
+
+            balances = json.loads(balances_future.result())
+            latest = json.loads(latest_future.result())
+
+        val_run(isinstance(balances.get("balances"), list), "API response missing 'balances' list")
+        val_run(isinstance(latest.get("prices"), dict), "API response missing 'prices' key")
+
+        # Latest prices are keyed on lower case coin
+        prices = latest["prices"]
+
+        coins = {}
+        missing = []
+        totals = {
+            "value_last": 0.0,
+            "value_bid": 0.0,
+            "value_ask": 0.0
+        }
+
+        for entry in balances["balances"]:
+            for coin, balance in entry.items():
+                coin = coin.upper()
+                amount = float(balance.get("balance", 0))
+
+                if coin == "AUD":
+                    bid = ask = last = 1.0
+                elif coin.lower() in prices:
+                    price = prices[coin.lower()]
+                    bid = float(price["bid"])
+                    ask = float(price["ask"])
+                    last = float(price["last"])
+                else:
+                    missing.append(coin)
+                    continue
+
+                holding = {
+                    "balance": amount,
+                    "available": float(balance.get("available", amount)),
+                    "bid": bid,
+                    "ask": ask,
+                    "last": last,
+                    "value_last": amount * last,
+                    "value_bid": amount * bid,
+                    "value_ask": amount * ask
+                }
+
+                coins[coin] = holding
+                for key in totals:
+                    totals[key] += holding[key]
 
+        return json.dumps({
+            "coins": coins,
+            "totals": totals,
+            "missing": missing
+        })
@@ -0,0 +1,247 @@
+"""
+Backtesting for the simple_buy_sell strategy against a historical price series
+"""
+
+import heapq
+import logging
+import itertools
+import os
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from .common import val_arg, val_run
+from .stats import RollingStats
+
+logger = logging.getLogger(__name__)
+
+def backtest_simple_buy_sell(timestamps, prices, amount, age_hours, buy_pct, sell_pct,
+                             limit=50, interval_secs=3600, capital=None, fee_pct=0.0, trades=False):
+    """
+    Replay a price series through the simple_buy_sell buy and sell criteria
+
+    A buy decision is made every interval_secs, using the average price over the
+    preceding age_hours as simple_buy_sell does. Each buy places a sell at
+    sell_pct above the buy rate, which is filled once the price reaches it.
+    """
+
+    # Validate incoming arguments
+    val_arg(len(timestamps) == len(prices), "Mismatched timestamps and prices passed to backtest")
+    val_arg(len(prices) > 0, "Empty price series passed to backtest")
+    val_arg(isinstance(amount, (int, float)) and amount > 0, "Invalid amount passed to backtest")
+    val_arg(isinstance(age_hours, int) and age_hours > 0, "Invalid age_hours passed to backtest")
+    val_arg(isinstance(buy_pct, (int, float)), "Invalid buy_pct passed to backtest")
+    val_arg(isinstance(sell_pct, (int, float)), "Invalid sell_pct passed to backtest")
+    val_arg(isinstance(limit, int) and limit > 0, "Invalid limit passed to backtest")
+    val_arg(isinstance(interval_secs, int) and interval_secs > 0, "Invalid interval passed to backtest")
+    val_arg(capital is None or (isinstance(capital, (int, float)) and capital >= 0), "Invalid capital passed to backtest")
+    val_arg(isinstance(fee_pct, (int, float)) and fee_pct >= 0, "Invalid fee_pct passed to backtest")
+
+    age_ms = age_hours * 60 * 60 * 1000
+    interval_ms = interval_secs * 1000
+    fee = fee_pct / 100
+    sell_mult = sell_pct / 100 + 1
+
+    window = RollingStats(width_ms=age_ms, ordered=False)
+
+    # Open sell orders, as a min heap on sell rate, so fills are found by
+    # inspecting the cheapest order only
+    open_sells = []
+
+    available = capital
+    trade_log = []
+    buys = 0
+    sells = 0
+    realised = 0.0
+
+    start = timestamps[0]
+    warm = start + age_ms
+    next_decision = warm
+    last_ts = None
+
+    for timestamp, price in zip(timestamps, prices):
+        val_run(last_ts is None or timestamp >= last_ts, "Price series is not in timestamp order")
+        last_ts = timestamp
+
+        window.push(price, timestamp)
+
+        # Fill any open sell orders that the current price reaches
+        while open_sells and open_sells[0][0] <= price:
+            sell_rate, buy_ts, buy_rate, coin_amount = heapq.heappop(open_sells)
+            proceeds = coin_amount * sell_rate * (1 - fee)
+            cost = coin_amount * buy_rate * (1 + fee)
+            realised += proceeds - cost
+            sells += 1
+
+            if available is not None:
+                available += proceeds
+
+            if trades:
+                trade_log.append({
+                    "buy_ts": buy_ts,
+                    "buy_rate": buy_rate,
+                    "sell_ts": timestamp,
+                    "sell_rate": sell_rate,
+                    "amount": coin_amount,
+                    "profit": proceeds - cost
+                })
+
+        # Only consider buying on the decision interval, once the window covers
+        # the full age
+        if timestamp < next_decision:
+            continue
+
+        next_decision = timestamp + interval_ms
+
+        if len(open_sells) >= limit:
+            continue
+
+        if available is not None and available < amount:
+            continue
+
+        avg_price_diff = (window.mean() / price - 1) * 100
+        if avg_price_diff < buy_pct:
+            continue
+
+        coin_amount = amount / price / (1 + fee)
+        heapq.heappush(open_sells, (price * sell_mult, timestamp, price, coin_amount))
+        buys += 1
+
+        if available is not None:
+            available -= amount
+
+    # Value the remaining open positions at the last price
+    last_price = prices[-1]
+    unrealised = sum(x[3] * (last_price * (1 - fee) - x[2] * (1 + fee)) for x in open_sells)
+
+    result = {
+        "start_ts": timestamps[0],
+        "end_ts": timestamps[-1],
+        "samples": len(prices),
+        "params": {
+            "amount": amount,
+            "age_hours": age_hours,
+            "buy_pct": buy_pct,
+            "sell_pct": sell_pct,
+            "limit": limit,
+            "interval_secs": interval_secs,
+            "capital": capital,
+            "fee_pct": fee_pct
+        },
+        "buys": buys,
+        "sells": sells,
+        "open": len(open_sells),
+        "hit_rate": sells / buys if buys > 0 else 0.0,
+        "realised_pnl": realised,
+        "unrealised_pnl": unrealised,
+        "pnl": realised + unrealised
+    }
+
+    if available is not None:
+        result["available"] = available
+
+    if trades:
+        result["trades"] = trade_log
+
+    return result
+
+# Price series shared with sweep worker processes
+_sweep_state = {}
+
+def _attach_shared(name):
+    """
+    Attach to an existing shared memory block without taking ownership of it
+    """
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always registers the block, but workers share the
+        # resource tracker of the parent, which owns the block and unlinks it
+        return shared_memory.SharedMemory(name=name)
+
+def _sweep_init(name, count, options):
+    """
+    Sweep worker initialiser - Maps the shared price series in to the worker
+    """
+
+    shm = _attach_shared(name)
+
+    _sweep_state["shm"] = shm
+    _sweep_state["timestamps"] = shm.buf[:count * 8].cast("q")
+    _sweep_state["prices"] = shm.buf[count * 8:count * 16].cast("d")
+    _sweep_state["options"] = options
+
+def _sweep_run(params):
+    """
+    Sweep worker task - Backtest a single parameter combination
+    """
+
+    buy_pct, sell_pct, age_hours = params
+    options = _sweep_state["options"]
+
+    result = backtest_simple_buy_sell(_sweep_state["timestamps"], _sweep_state["prices"],
+        options["amount"], age_hours, buy_pct, sell_pct, limit=options["limit"],
+        interval_secs=options["interval_secs"], capital=options["capital"], fee_pct=options["fee_pct"])
+
+    return result
+
+def sweep_simple_buy_sell(timestamps, prices, amount, buy_pcts, sell_pcts, ages, limit=50,
+                          interval_secs=3600, capital=None, fee_pct=0.0, workers=None, rank="pnl", top=None):
+    """
+    Backtest every combination of buy_pct, sell_pct and age across a process pool
+
+    The price series is copied once in to shared memory and mapped by each worker,
+    rather than being pickled for every task. Results are returned ranked by the
+    'rank' field, highest first.
+    """
+
+    # Validate incoming arguments
+    val_arg(len(timestamps) == len(prices), "Mismatched timestamps and prices passed to sweep")
+    val_arg(len(prices) > 0, "Empty price series passed to sweep")
+    val_arg(len(buy_pcts) > 0 and len(sell_pcts) > 0 and len(ages) > 0, "Empty parameter grid passed to sweep")
+    val_arg(workers is None or (isinstance(workers, int) and workers > 0), "Invalid workers passed to sweep")
+    val_arg(rank in ("pnl", "realised_pnl", "hit_rate", "sells"), "Invalid rank passed to sweep")
+    val_arg(top is None or (isinstance(top, int) and top > 0), "Invalid top passed to sweep")
+
+    grid = list(itertools.product(buy_pcts, sell_pcts, ages))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(grid))
+
+    options = {
+        "amount": amount,
+        "limit": limit,
+        "interval_secs": interval_secs,
+        "capital": capital,
+        "fee_pct": fee_pct
+    }
+
+    count = len(prices)
+    shm = shared_memory.SharedMemory(create=True, size=count * 16)
+
+    try:
+        shm.buf[:count * 8] = memoryview(array("q", timestamps)).cast("B")
+        shm.buf[count * 8:count * 16] = memoryview(array("d", prices)).cast("B")
+
+        logger.info("Sweeping %s combinations across %s workers", len(grid), workers)
+
+        # Batch tasks so each worker picks up several combinations per round trip
+        chunksize = max(1, len(grid) // (workers * 4))
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_sweep_init,
+                                 initargs=(shm.name, count, options)) as executor:
+            results = list(executor.map(_sweep_run, grid, chunksize=chunksize))
+
+    finally:
+        shm.close()
+        shm.unlink()
+
+    results.sort(key=lambda x: x[rank], reverse=True)
+
+    if top is not None:
+        results = results[:top]
+
+    return results
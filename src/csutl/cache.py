@@ -0,0 +1,218 @@
+"""
+On disk response cache for public get requests, shared between processes
+"""
+
+import os
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import tempfile
+import urllib.parse
+
+from contextlib import contextmanager
+
+from .common import val_arg
+
+logger = logging.getLogger(__name__)
+
+# Time to live (seconds) for cached responses, by url path prefix
+DEFAULT_TTLS = {
+    "/pubapi/v2/latest": 10,
+    "/pubapi/v2/": 30,
+    "/charts/history_basic": 60
+}
+
+def default_cache_dir():
+    """
+    Default location for the response cache
+    """
+
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+
+    return os.path.join(base, "csutl", "responses")
+
+@contextmanager
+def locked(path):
+    """
+    Hold a flock on the file at path for the duration of the context
+    """
+
+    with open(path, "a+b") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield file
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+class DiskCache:
+    """
+    Response cache keyed by absolute url, with a ttl per endpoint prefix
+
+    Entries are written atomically (temp file and rename), so readers never see
+    a partial entry. Concurrent processes missing on the same url serialise on a
+    lock, so only one of them makes the request. The cache is bounded
+    to max_bytes, evicting the least recently used entries.
+    """
+
+    def __init__(self, path=None, ttls=None, max_bytes=32 * 1024 * 1024):
+        val_arg(isinstance(path, (str, type(None))), "Invalid path passed to DiskCache")
+        val_arg(isinstance(ttls, (dict, type(None))), "Invalid ttls passed to DiskCache")
+        val_arg(isinstance(max_bytes, int) and max_bytes > 0, "Invalid max_bytes passed to DiskCache")
+
+        if path is None:
+            path = default_cache_dir()
+
+        if ttls is None:
+            ttls = DEFAULT_TTLS
+
+        self.path = path
+        self.max_bytes = max_bytes
+
+        # Longest prefix first, so the most specific ttl is found first
+        self.ttls = sorted(ttls.items(), key=lambda x: len(x[0]), reverse=True)
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def ttl(self, url):
+        """
+        Time to live for the url, or None if the url shouldn't be cached
+        """
+
+        path = urllib.parse.urlparse(url).path
+
+        # Never cache authenticated endpoints
+        if path.startswith("/api/"):
+            return None
+
+        for prefix, ttl in self.ttls:
+            if path.startswith(prefix):
+                return ttl
+
+        return None
+
+    def entry_path(self, url):
+        """
+        Location of the cache entry for the url
+        """
+
+        return os.path.join(self.path, hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def get(self, url):
+        """
+        Retrieve a cached response body (bytes) for the url, or None if missing
+        or expired
+        """
+
+        path = self.entry_path(url)
+
+        try:
+            with open(path, "rb") as file:
+                header = json.loads(file.readline())
+                body = file.read()
+        except (OSError, ValueError):
+            return None
+
+        if header.get("url") != url or header.get("expires", 0) < time.time():
+            return None
+
+        # Refresh the modification time, which orders entries for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return body
+
+    def put(self, url, body, ttl):
+        """
+        Store a response body (str or bytes) for the url
+        """
+
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        header = json.dumps({"url": url, "expires": time.time() + ttl}).encode("utf-8")
+
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(header)
+                file.write(b"\n")
+                file.write(body)
+
+            os.replace(temp_path, self.entry_path(url))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is within max_bytes
+        """
+
+        with locked(os.path.join(self.path, ".evict.lock")):
+            entries = []
+            total = 0
+
+            with os.scandir(self.path) as iterator:
+                for entry in iterator:
+                    if entry.name.startswith("."):
+                        continue
+
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            if total <= self.max_bytes:
+                return
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+                total -= size
+
+    def fetch(self, url, func):
+        """
+        Return the cached response for the url, calling func to retrieve and
+        store it on a miss
+        """
+
+        ttl = self.ttl(url)
+        if ttl is None:
+            return func()
+
+        response = self.get(url)
+        if response is not None:
+            logger.debug("Cache hit: %s", url)
+            return response
+
+        # Serialise misses on the same url across processes, then check again
+        # in case another process populated the entry while we waited. Locks
+        # are striped over a fixed set of files, keyed on the entry name
+        name = os.path.basename(self.entry_path(url))
+        with locked(os.path.join(self.path, f".lock-{name[:2]}")):
+            response = self.get(url)
+            if response is not None:
+                logger.debug("Cache hit: %s", url)
+                return response
+
+            logger.debug("Cache miss: %s", url)
+            response = func()
+            self.put(url, response, ttl)
+
+        return response
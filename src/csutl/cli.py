@@ -3,14 +3,43 @@ import argparse
 import logging
 import sys
 import json
-
-from .common import val_arg, val_run
-from .api import CoinSpotApi
+import os
+import io
+import time
+
+from datetime import datetime, timedelta
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import val_arg, val_run, parse_age, parse_interval
+from .api import CoinSpotApi, SCAN_INDICES
+from .transport import RetryPolicy, HedgePolicy, CircuitBreaker, default_breaker_path, deadline_scope, check_deadline, remaining_time, submit
+from .cache import DiskCache
+from .daemon import serve, forward, default_socket_path
+from .profiler import Profiler
+from .exception import ArgumentException, DeadlineExceededException, DaemonDeclinedException
+from .stats import parse_indicators
+from .series import parse_series, load_series, write_series_bin, write_series_csv, write_series_ndjson
+from .backtest import backtest_simple_buy_sell, sweep_simple_buy_sell
+from .correlate import build_correlation, write_correlation_csv
+from .orders import OrderStore, parse_date_ms, account_id
+from .tracker import OpenOrderTracker
+from .ticks import TickStore, parse_latest
 
 logger = logging.getLogger(__name__)
 
 debug = False
 
+# Default output path for --profile
+DEFAULT_PROFILE_PATH = "csutl.prof"
+
+# Subcommands that can be forwarded to a running daemon
+DAEMON_SUBCOMMANDS = ("get", "balance", "portfolio", "price_history", "scan", "market")
+
+# Daemon subcommands making signed requests, which the daemon only runs for
+# clients with the same api key
+DAEMON_SIGNED_SUBCOMMANDS = ("balance", "portfolio", "market")
+
 def process_get(args):
     """
     Handle get type requests for the public api
@@ -21,7 +50,7 @@ def process_get(args):
     val_arg(args.url != "", "Empty URL provided")
 
     # Api for coinspot access
-    api = CoinSpotApi()
+    api = build_api(args)
 
     # Make request against the API
     response = api.get(args.url, raw_output=args.raw_output)
@@ -39,7 +68,7 @@ def process_post(args):
     val_arg(args.url != "", "Empty URL provided")
 
     # Api for coinspot access
-    api = CoinSpotApi()
+    api = build_api(args)
 
     # Read payload from stdin
     payload = sys.stdin.read()
@@ -56,7 +85,7 @@ def process_balance(args):
     """
 
     # Api for coinspot access
-    api = CoinSpotApi()
+    api = build_api(args)
 
     url = "/api/v2/ro/my/balances"
 
@@ -71,6 +100,18 @@ def process_balance(args):
 
     print_output(args, response)
 
+def process_portfolio(args):
+    """
+    Process request to display the account holdings valued at current prices
+    """
+
+    # Api for coinspot access
+    api = build_api(args)
+
+    response = api.get_portfolio()
+
+    print_output(args, response)
+
 def process_price_history(args):
     """
     Process request to display price history for a coin type
@@ -78,30 +119,94 @@ def process_price_history(args):
 
     # Validate incoming arguments
     val_arg(isinstance(args.cointype, str) and args.cointype != "", "Invalid cointype supplied")
-    val_arg(isinstance(args.reference_price, (float, int, type(None))), "Invalid reference price supplied")
+    val_arg(isinstance(args.reference_price, (str, type(None))), "Invalid reference price supplied")
     val_arg(args.age != "", "Invalid age supplied")
 
     # Parse age
-    age = args.age
-    mod = 1
+    age = parse_age(args.age)
 
-    if age.endswith("h"):
-        age = age[:-1]
-    elif age.endswith("d"):
-        age = age[:-1]
-        mod = 24
-    elif age.endswith("w"):
-        age = age[:-1]
-        mod = 24 * 7
+    # Several reference prices are evaluated together against the one series
+    reference_price = None
+    if args.reference_price is not None:
+        reference_price = parse_list(args.reference_price, float)
+        if len(reference_price) == 1:
+            reference_price = reference_price[0]
 
-    val_arg(age.isdigit(), f"Age is not a valid format: {age}")
-    age = int(age) * mod
+    quantiles = None
+    if args.quantiles is not None:
+        val_arg(args.stats, "Quantiles require stats (-s)")
+        quantiles = parse_list(args.quantiles, float)
 
     # Api for coinspot access
-    api = CoinSpotApi()
+    api = build_api(args)
 
-    # Request balance info
-    response = api.get_price_history(args.cointype, age_hours=age, stats=args.stats, reference_price=args.reference_price)
+    # Request price history, bucketed in to candles if requested
+    if args.candles is not None:
+        val_arg(not args.stats, "Stats can't be combined with candles")
+
+        response = api.get_price_candles(args.cointype, age_hours=age, interval_secs=parse_interval(args.candles))
+    else:
+        chunk_hours = None
+        if args.chunk is not None:
+            chunk_hours = parse_age(args.chunk)
+
+        indicators = None
+        if args.indicators is not None:
+            val_arg(args.stats, "Indicators require stats (-s)")
+            indicators = parse_indicators(args.indicators)
+
+        response = api.get_price_history(args.cointype, age_hours=age, stats=args.stats, reference_price=reference_price,
+            chunk_hours=chunk_hours, workers=args.workers, approx=args.approx, indicators=indicators, quantiles=quantiles)
+
+    # Json output goes through the usual formatting
+    if args.format == "json":
+        if args.output_file is None:
+            print_output(args, response)
+        else:
+            with open(args.output_file, "w", encoding="utf-8") as file:
+                print_output(argparse.Namespace(raw_output=args.raw_output, output=file), response)
+
+        return
+
+    val_arg(not args.stats and args.candles is None, f"Format {args.format} only applies to the raw price series")
+
+    timestamps, prices = parse_series(response)
+
+    if args.format == "bin":
+        val_arg(args.output_file is not None or not sys.stdout.isatty(), "Refusing to write binary output to a terminal")
+
+        if args.output_file is None:
+            write_series_bin(sys.stdout.buffer, timestamps, prices, coin=args.cointype.upper())
+        else:
+            with open(args.output_file, "wb") as file:
+                write_series_bin(file, timestamps, prices, coin=args.cointype.upper())
+
+        return
+
+    writer = write_series_csv if args.format == "csv" else write_series_ndjson
+
+    if args.output_file is None:
+        writer(args.output or sys.stdout, timestamps, prices)
+    else:
+        with open(args.output_file, "w", encoding="utf-8", newline="") as file:
+            writer(file, timestamps, prices)
+
+def process_scan(args):
+    """
+    Rank all coins by a price history stats index
+    """
+
+    # Validate incoming arguments
+    val_arg(isinstance(args.top, int) and args.top > 0, "Invalid top supplied")
+    val_arg(isinstance(args.workers, int) and args.workers > 0, "Invalid workers supplied")
+    val_arg(isinstance(args.rate, float) and args.rate > 0, "Invalid rate supplied")
+
+    age = parse_age(args.age)
+
+    api = build_api(args)
+
+    response = api.scan_price_history(age_hours=age, index=args.index, top=args.top, lowest=args.lowest,
+        workers=args.workers, rate=args.rate)
 
     print_output(args, response)
 
@@ -110,8 +215,13 @@ def process_order_history(args):
     Process request to display order history for the account
     """
 
+    # Serve from the local order store, if requested
+    if args.local or args.sync:
+        process_order_store(args, "orders")
+        return
+
     # Api for coinspot access
-    api = CoinSpotApi()
+    api = build_api(args)
 
     url = "/api/v2/ro/my/orders/completed"
 
@@ -149,24 +259,61 @@ def process_order_history(args):
 
     print_output(args, response)
 
+def process_order_store(args, source):
+    """
+    Display completed orders from the local order store, syncing new orders
+    from the api first if requested
+    """
+
+    store = OrderStore()
+
+    try:
+        if args.sync:
+            added = store.sync(build_api(args), source)
+            logger.info("Added %s orders to the local order store", added)
+
+        start = None
+        if args.start_date is not None:
+            start = parse_date_ms(args.start_date)
+
+        end = None
+        if args.end_date is not None:
+            end = parse_date_ms(args.end_date)
+
+        response = store.query(source, coin=args.cointype, start=start, end=end, limit=args.limit)
+    finally:
+        store.close()
+
+    print_output(args, response)
+
 def process_market_buy(args):
     """
     Place market buy order
     """
 
+    # Place orders from file, if requested
+    if args.orders_file is not None:
+        process_market_bulk(args, "buy")
+        return
+
     # Validate incoming parameters
+    val_arg(isinstance(args.cointype, str) and args.cointype != "", "Missing cointype")
+    val_arg(args.amount_type in ("aud", "coin"), "Missing amount type")
     val_arg(isinstance(args.rate, (float, type(None))), "Invalid type for rate")
     val_arg(isinstance(args.amount, float), "Invalid type for amount")
 
     # Coinspot api
-    api = CoinSpotApi()
+    api = build_api(args)
 
     url = "/api/v2/my/buy"
 
     # Determine the rate - If there is no rate supplied, then use the asking
-    # price from the API to determine the buy price
+    # price from the API to determine the buy price, or the order book depth
+    # for the order size, if requested
     rate = args.rate
-    if rate is None:
+    if rate is None and args.depth:
+        rate = depth_rate(api, args.cointype, "buy", args.amount_type, args.amount)
+    elif rate is None:
         prices = json.loads(api.get(f"/pubapi/v2/latest/{args.cointype}"))
         logger.info("Current prices: %s", prices["prices"])
         rate = prices["prices"]["ask"]
@@ -196,19 +343,29 @@ def process_market_sell(args):
     Place market sell order
     """
 
+    # Place orders from file, if requested
+    if args.orders_file is not None:
+        process_market_bulk(args, "sell")
+        return
+
     # Validate incoming parameters
+    val_arg(isinstance(args.cointype, str) and args.cointype != "", "Missing cointype")
+    val_arg(args.amount_type in ("aud", "coin"), "Missing amount type")
     val_arg(isinstance(args.rate, (float, type(None))), "Invalid type for rate")
     val_arg(isinstance(args.amount, float), "Invalid type for amount")
 
     # Coinspot api
-    api = CoinSpotApi()
+    api = build_api(args)
 
     url = "/api/v2/my/sell"
 
     # Determine the rate - If there is no rate supplied, then use the bidding
-    # price from the API to determine the sell price
+    # price from the API to determine the sell price, or the order book depth
+    # for the order size, if requested
     rate = args.rate
-    if rate is None:
+    if rate is None and args.depth:
+        rate = depth_rate(api, args.cointype, "sell", args.amount_type, args.amount)
+    elif rate is None:
         prices = json.loads(api.get(f"/pubapi/v2/latest/{args.cointype}"))
         logger.info("Current prices: %s", prices["prices"])
         rate = prices["prices"]["bid"]
@@ -234,13 +391,162 @@ def process_market_sell(args):
 
     print_output(args, response)
 
+def depth_rate(api, cointype, side, amount_type, amount):
+    """
+    Determine the rate needed to fill an order completely from the order book
+    """
+
+    book = api.get_order_book(cointype)
+
+    if amount_type == "aud":
+        fill = book.fill(side, aud=amount)
+    else:
+        fill = book.fill(side, amount=amount)
+
+    val_run(fill["complete"], f"Order book depth can't fill the order: {json.dumps(fill)}")
+    logger.info("Order book fill - vwap: %s, worst rate: %s, levels: %s", fill["vwap"], fill["worst_rate"], fill["levels"])
+
+    return fill["worst_rate"]
+
+def process_market_quote(args):
+    """
+    Estimate the fill of a market order from the order book depth
+    """
+
+    # Validate incoming parameters
+    val_arg(isinstance(args.cointype, str) and args.cointype != "", "Invalid cointype supplied")
+    val_arg(isinstance(args.amount, float) and args.amount > 0, "Invalid amount supplied")
+
+    # Coinspot api
+    api = build_api(args)
+
+    book = api.get_order_book(args.cointype)
+
+    if args.amount_type == "aud":
+        fill = book.fill(args.side, aud=args.amount)
+    else:
+        fill = book.fill(args.side, amount=args.amount)
+
+    fill["cointype"] = args.cointype.upper()
+    fill["side"] = args.side
+
+    print_output(args, json.dumps(fill))
+
+def process_market_bulk(args, side):
+    """
+    Place a batch of market orders from a file of json lines
+
+    Rates are resolved from a single all coins price snapshot and the requests are
+    signed up front and sent in file order, so nonces ascend. Failures are reported per
+    order without aborting the batch.
+    """
+
+    # Validate incoming parameters
+    val_arg(side in ("buy", "sell"), "Invalid side for bulk orders")
+
+    # Coinspot api
+    api = build_api(args)
+
+    url = f"/api/v2/my/{side}"
+
+    # Read the order file
+    orders = []
+    with open(args.orders_file, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if line != "":
+                orders.append((line_number, line))
+
+    # Buy orders are priced at the asking price, sell orders at the bidding price
+    prices = None
+    price_key = "ask" if side == "buy" else "bid"
+
+    results = [None] * len(orders)
+    prepared = []
+
+    for index, (line_number, line) in enumerate(orders):
+        result = {"line": line_number}
+        results[index] = result
+
+        try:
+            order = json.loads(line)
+            val_arg(isinstance(order, dict), "Order is not an object")
+            val_arg(isinstance(order.get("cointype"), str) and order["cointype"] != "", "Invalid cointype in order")
+            val_arg(order.get("amount_type", "coin") in ("aud", "coin"), "Invalid amount_type in order")
+            val_arg(isinstance(order.get("amount"), (int, float)) and order["amount"] > 0, "Invalid amount in order")
+            val_arg(isinstance(order.get("rate"), (int, float, type(None))), "Invalid rate in order")
+
+            coin = order["cointype"].upper()
+            result["cointype"] = coin
+
+            rate = order.get("rate")
+            if rate is None:
+                # Retrieve the price snapshot on first use only
+                if prices is None:
+                    prices = json.loads(api.get("/pubapi/v2/latest"))["prices"]
+
+                val_run(coin.lower() in prices, f"No price available for {coin}")
+                rate = prices[coin.lower()][price_key]
+
+            rate = float(rate)
+
+            amount = float(order["amount"])
+            if order.get("amount_type", "coin") == "aud":
+                amount = amount/rate
+
+            if side == "sell":
+                amount = round(amount, 8)
+
+            request = {
+                "cointype": coin,
+                "amount": amount,
+                "rate": rate
+            }
+
+            result["request"] = request
+            prepared.append((index, api.prepare_post(url, request)))
+
+        except Exception as e: # pylint: disable=broad-exception-caught
+            result["status"] = "error"
+            result["error"] = str(e)
+
+    logger.info("Submitting %s %s orders", len(prepared), side)
+
+    # Signed requests are sent one at a time anyway, and must be sent in the
+    # order they were signed, so orders are submitted in file order
+    for index, request in prepared:
+        result = results[index]
+
+        try:
+            result["response"] = json.loads(api.send_prepared(request))
+            result["status"] = "ok"
+        except Exception as e: # pylint: disable=broad-exception-caught
+            result["status"] = "error"
+            result["error"] = str(e)
+
+    failed = sum(1 for x in results if x["status"] != "ok")
+    if failed > 0:
+        logger.error("%s of %s orders failed", failed, len(results))
+
+    print_output(args, json.dumps({
+        "submitted": len(results) - failed,
+        "failed": failed,
+        "results": results
+    }))
+
 def process_market_orders(args):
     """
     Display open market orders
     """
 
+    # Serve completed orders from the local order store, if requested
+    if args.local or args.sync:
+        val_arg(args.completed, "Only completed orders (-c) are kept in the local order store")
+        process_order_store(args, "market")
+        return
+
     # Coinspot api
-    api = CoinSpotApi()
+    api = build_api(args)
 
     url = "/api/v2/ro/my/orders/market/open"
     if args.completed:
@@ -297,28 +603,33 @@ def process_simple_buy_sell(args):
     val_arg(args.limit > 0, "Invalid limit supplied")
 
     # Coinspot api
-    api = CoinSpotApi()
+    api = build_api(args)
 
     # Parse age
-    age = args.age
-    mod = 1
-
-    if age.endswith("h"):
-        age = age[:-1]
-    elif age.endswith("d"):
-        age = age[:-1]
-        mod = 24
-    elif age.endswith("w"):
-        age = age[:-1]
-        mod = 24 * 7
-
-    val_arg(age.isdigit(), f"Age is not a valid format: {age}")
-    age = int(age) * mod
+    age = parse_age(args.age)
     logger.info("Price history for last %s hours", age)
 
     # Coin should be uppercase
     coin = args.cointype.upper()
 
+    # Refresh the open orders for the coin while the other requests are made,
+    # so the limit check doesn't wait on another round trip
+    tracker = OpenOrderTracker(api)
+    try:
+        tracker.start_refresh(coin)
+        return simple_buy_sell(args, api, tracker, coin, age)
+    except DeadlineExceededException as e:
+        # Only raised before the buy order, so no orders have been placed
+        logger.warning("Skipping buy, no orders placed: %s", e)
+        return None
+    finally:
+        tracker.close()
+
+def simple_buy_sell(args, api, tracker, coin, age):
+    """
+    Place a buy order, and a matching sell order, when the buy criteria are met
+    """
+
     # Retrieve amount available from balance
     response = json.loads(api.post("/api/v2/ro/my/balance/aud?available=yes", {}))
     val_run("balance" in response, "Missing balance key in coinspot API response")
@@ -354,6 +665,24 @@ def process_simple_buy_sell(args):
         logger.info("Buy criteria not met. Buy Pct: %s. Avg Price Diff: %s", args.buy_pct, avg_price_diff)
         return
 
+    # Enforce the limit on open orders
+    open_orders = tracker.count(coin)
+    if open_orders >= args.limit:
+        logger.info("Open order limit reached. Limit: %s. Open orders: %s", args.limit, open_orders)
+        return
+
+    # The deadline only gates starting the orders. Once the buy is sent, the buy
+    # and sell are made with the usual timeouts, as an order cut short has an
+    # unknown outcome, and a buy without its sell is left unmanaged
+    check_deadline("buy order")
+    with deadline_scope(None):
+        return place_buy_sell(args, api, tracker, coin, ask_price)
+
+def place_buy_sell(args, api, tracker, coin, ask_price):
+    """
+    Place the buy order, and a sell order at the sell pct above the buy rate
+    """
+
     # Buy the coin at bid price
     coin_amount = args.amount / ask_price
     request = {
@@ -383,6 +712,14 @@ def process_simple_buy_sell(args):
     logger.debug("Sell Order Response: %s", response)
     sell_response = json.loads(response)
 
+    # Orders are only recorded once both are placed, and a failure to record
+    # them only leaves the tracker to catch up on its next refresh
+    for side, order_response in (("buy", buy_response), ("sell", sell_response)):
+        try:
+            tracker.record(side, coin, order_response)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            logger.warning("Failed to record %s order for %s: %s", side, coin, e)
+
     # Display summary information
     buy_amount_aud = buy_response["amount"] * buy_response["rate"]
     sell_amount_aud = sell_response["amount"] * sell_response["rate"]
@@ -403,6 +740,374 @@ def process_simple_buy_sell(args):
         "profit_on_sale": sell_amount_aud - buy_amount_aud
     }))
 
+def process_backtest(args):
+    """
+    Replay a price series through the simple buy sell criteria
+    """
+
+    # Validate incoming parameters
+    val_arg(isinstance(args.cointype, str) and args.cointype != "", "Invalid cointype supplied")
+    val_arg(isinstance(args.amount, float) and args.amount > 0, "Invalid amount supplied")
+    val_arg(isinstance(args.buy_pct, float), "Invalid buy pct supplied")
+    val_arg(isinstance(args.sell_pct, float), "Invalid sell pct supplied")
+    val_arg(isinstance(args.limit, int) and args.limit > 0, "Invalid limit supplied")
+
+    age = parse_age(args.age)
+    interval = parse_interval(args.interval)
+
+    # Load the price series from file, if supplied, otherwise retrieve it from the API
+    if args.file is not None:
+        logger.info("Loading price series from %s", args.file)
+        timestamps, prices = load_series(args.file)
+    else:
+        period = parse_age(args.period)
+        logger.info("Price history for last %s hours", period)
+
+        api = build_api(args)
+        timestamps, prices = parse_series(api.get_price_history(args.cointype, age_hours=period))
+
+    val_run(len(prices) > 0, "Empty price series for backtest")
+
+    result = backtest_simple_buy_sell(timestamps, prices, args.amount, age, args.buy_pct, args.sell_pct,
+        limit=args.limit, interval_secs=interval, capital=args.capital, fee_pct=args.fee_pct, trades=args.trades)
+
+    result["coin"] = args.cointype.upper()
+
+    print_output(args, json.dumps(result))
+
+def process_sweep(args):
+    """
+    Backtest a grid of simple buy sell parameters and rank the results
+    """
+
+    # Validate incoming parameters
+    val_arg(isinstance(args.cointype, str) and args.cointype != "", "Invalid cointype supplied")
+    val_arg(isinstance(args.amount, float) and args.amount > 0, "Invalid amount supplied")
+    val_arg(isinstance(args.limit, int) and args.limit > 0, "Invalid limit supplied")
+    val_arg(args.workers is None or args.workers > 0, "Invalid workers supplied")
+
+    buy_pcts = parse_list(args.buy_pct, float)
+    sell_pcts = parse_list(args.sell_pct, float)
+    ages = [parse_age(x) for x in parse_list(args.age, str)]
+    interval = parse_interval(args.interval)
+
+    # Load the price series from file, if supplied, otherwise retrieve it from the API
+    if args.file is not None:
+        logger.info("Loading price series from %s", args.file)
+        timestamps, prices = load_series(args.file)
+    else:
+        period = parse_age(args.period)
+        logger.info("Price history for last %s hours", period)
+
+        api = build_api(args)
+        timestamps, prices = parse_series(api.get_price_history(args.cointype, age_hours=period))
+
+    val_run(len(prices) > 0, "Empty price series for sweep")
+
+    results = sweep_simple_buy_sell(timestamps, prices, args.amount, buy_pcts, sell_pcts, ages,
+        limit=args.limit, interval_secs=interval, capital=args.capital, fee_pct=args.fee_pct,
+        workers=args.workers, rank=args.rank, top=args.top)
+
+    print_output(args, json.dumps({
+        "coin": args.cointype.upper(),
+        "rank": args.rank,
+        "results": results
+    }))
+
+def process_correlate(args):
+    """
+    Correlation matrix of returns across coins, on a common time grid
+    """
+
+    # Validate incoming parameters
+    val_arg(isinstance(args.workers, int) and args.workers > 0, "Invalid workers supplied")
+
+    coins = [x.upper() for x in parse_list(args.coins, str)]
+    val_arg(len(coins) >= 2, "At least two coins are required for correlation")
+    val_arg(len(set(coins)) == len(coins), "Duplicate coins supplied")
+
+    age = parse_age(args.age)
+    interval_ms = parse_interval(args.interval) * 1000
+
+    api = build_api(args)
+
+    # Retrieve each coin's history concurrently
+    def fetch(coin):
+        timestamps, prices = parse_series(api.get_price_history(coin, age_hours=age))
+        val_run(len(prices) > 0, f"Empty price history for {coin}")
+        return timestamps, prices
+
+    logger.info("Price history for %s coins over last %s hours", len(coins), age)
+    with ThreadPoolExecutor(max_workers=min(args.workers, len(coins))) as executor:
+        series = [x.result() for x in [submit(executor, fetch, coin) for coin in coins]]
+
+    correlation = build_correlation(coins, series, interval_ms)
+
+    if args.format == "csv":
+        write_correlation_csv(args.output or sys.stdout, correlation)
+    else:
+        print_output(args, json.dumps(correlation))
+
+def process_record(args):
+    """
+    Record latest price snapshots for all coins to the local tick store, on an
+    interval, until interrupted, the count is reached or the deadline passes
+    """
+
+    # Validate incoming parameters
+    val_arg(isinstance(args.count, (int, type(None))) and (args.count is None or args.count > 0), "Invalid count supplied")
+    val_arg(isinstance(args.max_size, int) and args.max_size > 0, "Invalid max size supplied")
+    val_arg(args.keep is None or args.keep > 0, "Invalid keep supplied")
+
+    interval = parse_interval(args.interval)
+
+    api = build_api(args)
+    store = TickStore(args.tick_dir, segment_bytes=args.max_size * 1024 * 1024, keep=args.keep)
+
+    recorded = 0
+    next_time = time.monotonic()
+
+    try:
+        while args.count is None or recorded < args.count:
+            # A failed snapshot is skipped, rather than ending the recording
+            try:
+                ticks = parse_latest(api.get("/pubapi/v2/latest"))
+            except DeadlineExceededException:
+                break
+            except Exception as e: # pylint: disable=broad-exception-caught
+                logger.warning("Failed to retrieve latest prices: %s", e)
+            else:
+                changed = store.append(int(time.time() * 1000), ticks)
+                recorded += 1
+                logger.debug("Recorded snapshot of %s coins, %s changed", len(ticks), changed)
+
+            if args.count is not None and recorded >= args.count:
+                break
+
+            # Snapshots are scheduled from the start time, so slow requests
+            # don't cause drift
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                next_time = time.monotonic()
+                delay = 0
+
+            remaining = remaining_time()
+            if remaining is not None and remaining <= delay:
+                break
+
+            time.sleep(delay)
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        store.close()
+
+    logger.info("Recorded %s snapshots to %s", recorded, store.path)
+
+def process_ticks(args):
+    """
+    Display recorded ticks for a coin from the local tick store
+    """
+
+    # Validate incoming parameters
+    val_arg(isinstance(args.cointype, str) and args.cointype != "", "Invalid cointype supplied")
+
+    start = None
+    if args.start_date is not None:
+        start = parse_date_ms(args.start_date)
+
+    end = None
+    if args.end_date is not None:
+        end = parse_date_ms(args.end_date)
+
+    store = TickStore(args.tick_dir)
+    ticks = store.query(args.cointype, start=start, end=end)
+
+    print_output(args, json.dumps({
+        "coin": args.cointype.upper(),
+        "ticks": [list(x) for x in ticks]
+    }))
+
+def process_loadtest(args):
+    """
+    Drive CoinSpotApi from concurrent callers against a local stand-in server
+    and report throughput, latency, errors and nonce ordering
+    """
+
+    # The stand-in server is only needed here, so other commands don't pay for
+    # importing http.server
+    from .loadtest import StandInServer, run_load # pylint: disable=import-outside-toplevel
+
+    # Validate incoming parameters
+    val_arg(isinstance(args.callers, int) and args.callers > 0, "Invalid callers supplied")
+    val_arg(isinstance(args.requests, int) and args.requests > 0, "Invalid requests supplied")
+    val_arg(args.latency >= 0 and args.jitter >= 0, "Invalid latency supplied")
+
+    # The stand-in server doesn't check signatures, so any credentials will do
+    if args.op == "post":
+        os.environ.setdefault("COINSPOT_API_KEY", "loadtest")
+        os.environ.setdefault("COINSPOT_API_SECRET", "loadtest")
+
+    output = args.output or sys.stdout
+
+    with StandInServer(latency=args.latency / 1000, jitter=args.jitter / 1000, rate_429=args.rate_429,
+                       rate_5xx=args.rate_5xx) as server:
+        api = build_api(args, base_url=server.base_url)
+
+        if args.op == "get":
+            def func():
+                api.get("/pubapi/v2/latest")
+        elif args.op == "post":
+            def func():
+                api.post("/api/v2/ro/my/balances", {})
+        else:
+            end_date = datetime.now()
+            start_date = end_date - timedelta(hours=1)
+
+            def func():
+                api.get_price_history_range("btc", start_date, end_date)
+
+        logger.info("Running %s %s requests from %s callers", args.callers * args.requests, args.op, args.callers)
+        result = run_load(func, args.callers, args.requests)
+
+        nonces = server.nonce_stats()
+        statuses = dict(server.statuses)
+
+    histogram = result["histogram"]
+    total = args.callers * args.requests
+    failed = sum(result["errors"].values())
+
+    histogram.report(output)
+
+    print("", file=output)
+    print(f"Requests: {total} from {args.callers} callers in {result['elapsed']:.3f}s "
+        f"({total / result['elapsed']:.1f} requests/s)", file=output)
+    print(f"Latency (ms): p50 {histogram.value_at(50) / 1000:.3f}, p90 {histogram.value_at(90) / 1000:.3f}, "
+        f"p99 {histogram.value_at(99) / 1000:.3f}, p99.9 {histogram.value_at(99.9) / 1000:.3f}, "
+        f"max {histogram.max / 1000:.3f}", file=output)
+    print(f"Errors: {failed} ({failed / total * 100:.2f}%) {dict(result['errors'])}", file=output)
+    print(f"Server responses: {statuses}", file=output)
+
+    if args.op == "post":
+        print(f"Nonces: {nonces['received']} received, {nonces['out_of_order']} out of order, "
+            f"{nonces['duplicates']} duplicates", file=output)
+
+def parse_list(value, item_type):
+    """
+    Parse a comma separated list of values
+    """
+
+    val_arg(isinstance(value, str) and value != "", "Invalid list supplied")
+
+    try:
+        return [item_type(x.strip()) for x in value.split(",") if x.strip() != ""]
+    except ValueError as e:
+        raise ArgumentException(f"Invalid list value: {value}") from e
+
+def process_serve(args):
+    """
+    Run the daemon, serving commands over a unix socket with a shared, warm api
+    """
+
+    path = args.socket
+    if path is None:
+        path = default_socket_path()
+
+    # The api is shared by all requests, keeping pooled connections and caches warm
+    api = build_api(args)
+    parser = build_parser()
+    context = daemon_context(args)
+
+    def handle(argv, client_context):
+        try:
+            request_args = parser.parse_args(argv)
+        except SystemExit as e:
+            raise ArgumentException(f"Invalid arguments: {' '.join(argv)}") from e
+
+        val_arg(request_args.subcommand in DAEMON_SUBCOMMANDS, f"Subcommand not supported by daemon: {request_args.subcommand}")
+        val_arg(request_args.call_func is not None, "Missing subcommand")
+
+        # The shared api only stands in for one the client would build itself
+        if client_context is None or client_context.get("transport") != context["transport"]:
+            raise DaemonDeclinedException("Transport options differ from the daemon")
+
+        if request_args.subcommand in DAEMON_SIGNED_SUBCOMMANDS and client_context.get("account") != context["account"]:
+            raise DaemonDeclinedException("Api credentials differ from the daemon")
+
+        request_args.api = api
+        request_args.output = io.StringIO()
+
+        with deadline_scope(request_args.deadline):
+            status = request_args.call_func(request_args)
+
+        return status or 0, request_args.output.getvalue()
+
+    serve(path, handle)
+
+def daemon_context(args):
+    """
+    Transport options and account for a command, which must match the daemon's
+    for the daemon to run the command with its shared api
+    """
+
+    account = None
+    if os.environ.get("COINSPOT_API_KEY", "") != "":
+        account = account_id()
+
+    return {
+        "transport": {
+            "retries": args.retries,
+            "hedge": args.hedge,
+            "cache": os.environ.get("CSUTL_CACHE_DIR", "") if args.cache else None,
+            "breaker": default_breaker_path() if args.breaker else None,
+            "connect_timeout": args.connect_timeout,
+            "read_timeout": args.read_timeout
+        },
+        "account": account
+    }
+
+def build_api(args, base_url=None):
+    """
+    Create a CoinSpotApi instance configured from the common arguments
+    """
+
+    # Use the warm api instance when running within the daemon
+    if args.api is not None:
+        return args.api
+
+    val_arg(isinstance(args.retries, int) and args.retries >= 0, "Invalid retries supplied")
+
+    retry_policy = None
+    if args.retries > 0:
+        retry_policy = RetryPolicy(attempts=args.retries + 1)
+
+    hedge_policy = None
+    if args.hedge:
+        hedge_policy = HedgePolicy()
+
+    cache = None
+    if args.cache:
+        cache = DiskCache(path=os.environ.get("CSUTL_CACHE_DIR"))
+
+    breaker = None
+    if args.breaker:
+        breaker = CircuitBreaker(path=default_breaker_path())
+
+    val_arg(args.connect_timeout > 0 and args.read_timeout > 0, "Invalid timeout supplied")
+
+    api = CoinSpotApi(base_url=base_url, retry_policy=retry_policy, hedge_policy=hedge_policy, cache=cache, breaker=breaker,
+        timeout=(args.connect_timeout, args.read_timeout))
+
+    # Attribute time waiting on requests separately when profiling
+    if args.profiler is not None:
+        api.requestor = args.profiler.wrap_requestor(api.requestor)
+        if api.stream_requestor is not None:
+            api.stream_requestor = args.profiler.wrap_stream_requestor(api.stream_requestor)
+
+    return api
+
 def add_common_args(parser):
     """
     Common arguments for all subcommands
@@ -419,6 +1124,24 @@ def add_common_args(parser):
     # Json formatting options
     parser.add_argument("--raw-output", action="store_true", dest="raw_output", help="Raw (unpretty) json output")
 
+    # Request policy options
+    parser.add_argument("--retries", action="store", dest="retries", type=int, default=0,
+        help="Retries for get requests on connection errors or 5xx responses (default 0)")
+    parser.add_argument("--hedge", action="store_true", dest="hedge",
+        help="Hedge slow get requests with a second request")
+    parser.add_argument("--no-daemon", action="store_true", dest="no_daemon",
+        help="Don't forward the command to a running daemon")
+    parser.add_argument("--cache", action="store_true", dest="cache",
+        help="Cache public get responses on disk, shared between processes (location from CSUTL_CACHE_DIR)")
+    parser.add_argument("--connect-timeout", action="store", dest="connect_timeout", type=float, default=5.0,
+        help="Connect timeout for requests in seconds (default 5)")
+    parser.add_argument("--read-timeout", action="store", dest="read_timeout", type=float, default=30.0,
+        help="Read timeout for requests in seconds (default 30)")
+    parser.add_argument("--deadline", action="store", dest="deadline", type=float, default=None,
+        help="Overall time budget for the command in seconds. Requests are cut short, and later requests skipped, once it passes")
+    parser.add_argument("--breaker", action="store_true", dest="breaker",
+        help="Fail fast while an endpoint family is failing, sharing breaker state between processes (location from CSUTL_BREAKER_FILE)")
+
 def print_output(args, output):
     """
     Display the response output, with option to display raw or pretty formatted
@@ -430,13 +1153,13 @@ def print_output(args, output):
 
     # Display output raw or pretty
     if args.raw_output:
-        print(output)
+        print(output, file=args.output)
     else:
-        print(json.dumps(json.loads(output), indent=4))
+        print(json.dumps(json.loads(output), indent=4), file=args.output)
 
-def process_args():
+def build_parser():
     """
-    Processes csutl command line arguments
+    Create the parser for csutl command line arguments
     """
 
     # Create parser for command line arguments
@@ -446,6 +1169,16 @@ def process_args():
 
     parser.set_defaults(debug=False)
 
+    # Shared api and output stream, supplied when running within the daemon
+    parser.set_defaults(api=None, output=None)
+
+    # Profiling options
+    parser.set_defaults(profiler=None)
+    parser.add_argument("--profile", action="store", dest="profile", nargs="?", const=DEFAULT_PROFILE_PATH, default=None,
+        metavar="PATH", help=f"Profile the subcommand, writing pstats to PATH, given as --profile=PATH (default {DEFAULT_PROFILE_PATH})")
+    parser.add_argument("--profile-collapsed", action="store", dest="profile_collapsed", default=None,
+        metavar="PATH", help="Also sample stacks, writing collapsed stacks for flamegraphs to PATH")
+
     # Parser configuration
     #parser.add_argument(
     #    "-d", action="store_true", dest="debug", help="Enable debug output"
@@ -485,6 +1218,14 @@ def process_args():
 
     subcommand_balance.add_argument("-t", action="store", dest="cointype", help="Coin type", default=None)
 
+    # Portfolio
+    subcommand_portfolio = subparsers.add_parser(
+        "portfolio",
+        help="Value account holdings at current prices"
+    )
+    subcommand_portfolio.set_defaults(call_func=process_portfolio)
+    add_common_args(subcommand_portfolio)
+
     # Price history
     subcommand_price_history = subparsers.add_parser(
         "price_history",
@@ -494,10 +1235,37 @@ def process_args():
     add_common_args(subcommand_price_history)
 
     subcommand_price_history.add_argument("-s", action="store_true", dest="stats", help="Display stats")
+    subcommand_price_history.add_argument("--approx", action="store_true", dest="approx", help="Approximate stats quantiles with bounded memory")
+    subcommand_price_history.add_argument("--indicators", action="store", dest="indicators", default=None,
+        help="Technical indicators to add to stats, with optional period (e.g. sma,ema:50,rsi,bbands,roc)")
     subcommand_price_history.add_argument("-a", action="store", dest="age", help="Age (e.g. 4h or 3d) (default 1d)", default="1d")
-    subcommand_price_history.add_argument("-r", action="store", dest="reference_price", type=float, help="Reference price", default=None)
+    subcommand_price_history.add_argument("-r", action="store", dest="reference_price", help="Reference price, or comma separated reference prices", default=None)
+    subcommand_price_history.add_argument("-q", action="store", dest="quantiles", help="Comma separated quantiles to add to stats (e.g. 0.05,0.95)", default=None)
+    subcommand_price_history.add_argument("--candles", action="store", dest="candles", help="Candle interval for open/high/low/close output (e.g. 5m, 1h or 1d)", default=None)
+    subcommand_price_history.add_argument("--chunk", action="store", dest="chunk", help="Retrieve long ranges in concurrent chunks of this age (e.g. 1w)", default=None)
+    subcommand_price_history.add_argument("-j", action="store", dest="workers", help="Concurrent chunk requests (default 4)", type=int, default=4)
+    subcommand_price_history.add_argument("--format", action="store", dest="format", help="Output format for the price series (default json)",
+        choices=("json", "bin", "csv", "ndjson"), default="json")
+    subcommand_price_history.add_argument("-o", action="store", dest="output_file", help="Write output to file", default=None)
     subcommand_price_history.add_argument("cointype", action="store", help="Coin type")
 
+    # Scan
+    subcommand_scan = subparsers.add_parser(
+        "scan",
+        help="Rank all coins by a price history stats index"
+    )
+    subcommand_scan.set_defaults(call_func=process_scan)
+    add_common_args(subcommand_scan)
+
+    subcommand_scan.add_argument("-a", action="store", dest="age", help="Age (e.g. 4h or 3d) (default 1d)", default="1d")
+    subcommand_scan.add_argument("-i", action="store", dest="index", help="Reference index to rank by (default avg_price_diff_pct)",
+        choices=SCAN_INDICES, default="avg_price_diff_pct")
+    subcommand_scan.add_argument("-k", action="store", dest="top", help="Number of coins to display (default 10)", type=int, default=10)
+    subcommand_scan.add_argument("--lowest", action="store_true", dest="lowest", help="Rank the lowest index values first")
+    subcommand_scan.add_argument("-j", action="store", dest="workers", help="Concurrent price history requests (default 8)", type=int, default=8)
+    subcommand_scan.add_argument("--rate", action="store", dest="rate", help="Maximum price history requests per second (default 10)",
+        type=float, default=10.0)
+
     # order history
     subcommand_order_history = subparsers.add_parser(
         "order_history",
@@ -510,6 +1278,10 @@ def process_args():
     subcommand_order_history.add_argument("-e", action="store", dest="end_date", help="End date", default=None)
     subcommand_order_history.add_argument("-l", action="store", dest="limit", help="Result limit (default 200, max 500)", type=int, default=None)
     subcommand_order_history.add_argument("-t", action="store", dest="cointype", help="coin type", default=None)
+    subcommand_order_history.add_argument("--local", action="store_true", dest="local",
+        help="Query completed orders from the local order store (location from CSUTL_ORDER_STORE)")
+    subcommand_order_history.add_argument("--sync", action="store_true", dest="sync",
+        help="Sync new completed orders in to the local order store, then query it")
 
     # simple buy sell
     subcommand_simple_buy_sell = subparsers.add_parser(
@@ -522,10 +1294,123 @@ def process_args():
     subcommand_simple_buy_sell.add_argument("cointype", action="store", help="Coin type")
     subcommand_simple_buy_sell.add_argument("amount", action="store", help="Amount to buy (aud)", type=float)
     subcommand_simple_buy_sell.add_argument("-a", action="store", dest="age", help="Age for price history (e.g. 4h or 3d) (default 1d)", default="1d")
-    subcommand_simple_buy_sell.add_argument("-b", action="store", dest="buy_pct", help="Pct drop to allow buy (e.g. 2 is a 2 pct drop)", type=float, default=3)
-    subcommand_simple_buy_sell.add_argument("-s", action="store", dest="sell_pct", help="Pct profit to sell for (e.g. 5 is 5 pct increase)", type=float, default=2)
+    subcommand_simple_buy_sell.add_argument("-b", action="store", dest="buy_pct", help="Pct drop to allow buy (e.g. 2 is a 2 pct drop)", type=float, default=3.0)
+    subcommand_simple_buy_sell.add_argument("-s", action="store", dest="sell_pct", help="Pct profit to sell for (e.g. 5 is 5 pct increase)", type=float, default=2.0)
     subcommand_simple_buy_sell.add_argument("-l", action="store", dest="limit", help="Limit on open orders (default 50)", type=int, default=50)
 
+    # backtest
+    subcommand_backtest = subparsers.add_parser(
+        "backtest",
+        help="Backtest simple buy sell against price history"
+    )
+    subcommand_backtest.set_defaults(call_func=process_backtest)
+    add_common_args(subcommand_backtest)
+
+    subcommand_backtest.add_argument("cointype", action="store", help="Coin type")
+    subcommand_backtest.add_argument("amount", action="store", help="Amount to buy (aud)", type=float)
+    subcommand_backtest.add_argument("-a", action="store", dest="age", help="Age for price history (e.g. 4h or 3d) (default 1d)", default="1d")
+    subcommand_backtest.add_argument("-b", action="store", dest="buy_pct", help="Pct drop to allow buy (e.g. 2 is a 2 pct drop)", type=float, default=3.0)
+    subcommand_backtest.add_argument("-s", action="store", dest="sell_pct", help="Pct profit to sell for (e.g. 5 is 5 pct increase)", type=float, default=2.0)
+    subcommand_backtest.add_argument("-l", action="store", dest="limit", help="Limit on open orders (default 50)", type=int, default=50)
+    subcommand_backtest.add_argument("-i", action="store", dest="interval", help="Interval between buy decisions (e.g. 5m or 1h) (default 1h)", default="1h")
+    subcommand_backtest.add_argument("-p", action="store", dest="period", help="Period of price history to retrieve (e.g. 4w) (default 4w)", default="4w")
+    subcommand_backtest.add_argument("-f", action="store", dest="file", help="Price series file (price_history output)", default=None)
+    subcommand_backtest.add_argument("-c", action="store", dest="capital", help="Starting aud balance (default unlimited)", type=float, default=None)
+    subcommand_backtest.add_argument("--fee", action="store", dest="fee_pct", help="Fee pct per trade (default 0)", type=float, default=0.0)
+    subcommand_backtest.add_argument("--trades", action="store_true", dest="trades", help="Include individual trades in output")
+
+    # sweep
+    subcommand_sweep = subparsers.add_parser(
+        "sweep",
+        help="Backtest a grid of simple buy sell parameters"
+    )
+    subcommand_sweep.set_defaults(call_func=process_sweep)
+    add_common_args(subcommand_sweep)
+
+    subcommand_sweep.add_argument("cointype", action="store", help="Coin type")
+    subcommand_sweep.add_argument("amount", action="store", help="Amount to buy (aud)", type=float)
+    subcommand_sweep.add_argument("-a", action="store", dest="age", help="Comma separated ages for price history (e.g. 12h,1d,3d) (default 1d)", default="1d")
+    subcommand_sweep.add_argument("-b", action="store", dest="buy_pct", help="Comma separated buy pcts (e.g. 1,2,3) (default 3)", default="3")
+    subcommand_sweep.add_argument("-s", action="store", dest="sell_pct", help="Comma separated sell pcts (e.g. 1,2,5) (default 2)", default="2")
+    subcommand_sweep.add_argument("-l", action="store", dest="limit", help="Limit on open orders (default 50)", type=int, default=50)
+    subcommand_sweep.add_argument("-i", action="store", dest="interval", help="Interval between buy decisions (e.g. 5m or 1h) (default 1h)", default="1h")
+    subcommand_sweep.add_argument("-p", action="store", dest="period", help="Period of price history to retrieve (e.g. 4w) (default 4w)", default="4w")
+    subcommand_sweep.add_argument("-f", action="store", dest="file", help="Price series file (price_history output)", default=None)
+    subcommand_sweep.add_argument("-c", action="store", dest="capital", help="Starting aud balance (default unlimited)", type=float, default=None)
+    subcommand_sweep.add_argument("-j", action="store", dest="workers", help="Worker processes (default cpu count)", type=int, default=None)
+    subcommand_sweep.add_argument("-k", action="store", dest="top", help="Number of results to display (default all)", type=int, default=None)
+    subcommand_sweep.add_argument("--rank", action="store", dest="rank", help="Result field to rank by (default pnl)",
+        choices=("pnl", "realised_pnl", "hit_rate", "sells"), default="pnl")
+    subcommand_sweep.add_argument("--fee", action="store", dest="fee_pct", help="Fee pct per trade (default 0)", type=float, default=0.0)
+
+    # correlate
+    subcommand_correlate = subparsers.add_parser(
+        "correlate",
+        help="Correlation matrix of price returns across coins"
+    )
+    subcommand_correlate.set_defaults(call_func=process_correlate)
+    add_common_args(subcommand_correlate)
+
+    subcommand_correlate.add_argument("coins", action="store", help="Comma separated coin types (e.g. btc,eth,sol)")
+    subcommand_correlate.add_argument("-a", action="store", dest="age", help="Age for price history (e.g. 4h or 3d) (default 1w)", default="1w")
+    subcommand_correlate.add_argument("-i", action="store", dest="interval", help="Grid interval for aligning prices (e.g. 5m or 1h) (default 1h)", default="1h")
+    subcommand_correlate.add_argument("-j", action="store", dest="workers", help="Concurrent price history requests (default 8)", type=int, default=8)
+    subcommand_correlate.add_argument("--format", action="store", dest="format", help="Output format (default json)",
+        choices=("json", "csv"), default="json")
+
+    # loadtest
+    subcommand_loadtest = subparsers.add_parser(
+        "loadtest",
+        help="Load test the api client against a local stand-in server"
+    )
+    subcommand_loadtest.set_defaults(call_func=process_loadtest)
+    add_common_args(subcommand_loadtest)
+
+    subcommand_loadtest.add_argument("--op", action="store", dest="op", help="Operation to call (default get)",
+        choices=("get", "post", "history"), default="get")
+    subcommand_loadtest.add_argument("-c", action="store", dest="callers", help="Concurrent callers (default 50)", type=int, default=50)
+    subcommand_loadtest.add_argument("-n", action="store", dest="requests", help="Requests per caller (default 20)", type=int, default=20)
+    subcommand_loadtest.add_argument("--latency", action="store", dest="latency", help="Server latency in ms (default 20)", type=float, default=20.0)
+    subcommand_loadtest.add_argument("--jitter", action="store", dest="jitter", help="Server latency jitter in ms (default 10)", type=float, default=10.0)
+    subcommand_loadtest.add_argument("--rate-429", action="store", dest="rate_429", help="Fraction of 429 responses (default 0)", type=float, default=0.0)
+    subcommand_loadtest.add_argument("--rate-5xx", action="store", dest="rate_5xx", help="Fraction of 503 responses (default 0)", type=float, default=0.0)
+
+    # record
+    subcommand_record = subparsers.add_parser(
+        "record",
+        help="Record latest bid/ask/last prices for all coins to a local tick store"
+    )
+    subcommand_record.set_defaults(call_func=process_record)
+    add_common_args(subcommand_record)
+
+    subcommand_record.add_argument("-i", action="store", dest="interval", help="Interval between snapshots (e.g. 10s or 1m) (default 10s)", default="10s")
+    subcommand_record.add_argument("-n", action="store", dest="count", help="Number of snapshots to record (default unlimited)", type=int, default=None)
+    subcommand_record.add_argument("--dir", action="store", dest="tick_dir", help="Tick store directory (default from CSUTL_TICK_DIR)", default=None)
+    subcommand_record.add_argument("--max-size", action="store", dest="max_size", help="Segment size in MiB before rotating (default 16)", type=int, default=16)
+    subcommand_record.add_argument("--keep", action="store", dest="keep", help="Number of segments to keep (default all)", type=int, default=None)
+
+    # ticks
+    subcommand_ticks = subparsers.add_parser(
+        "ticks",
+        help="Display recorded bid/ask/last prices for a coin from the local tick store"
+    )
+    subcommand_ticks.set_defaults(call_func=process_ticks)
+    add_common_args(subcommand_ticks)
+
+    subcommand_ticks.add_argument("cointype", action="store", help="Coin type")
+    subcommand_ticks.add_argument("-s", action="store", dest="start_date", help="Start date (epoch ms, YYYY-MM-DD or iso date time)", default=None)
+    subcommand_ticks.add_argument("-e", action="store", dest="end_date", help="End date (epoch ms, YYYY-MM-DD or iso date time)", default=None)
+    subcommand_ticks.add_argument("--dir", action="store", dest="tick_dir", help="Tick store directory (default from CSUTL_TICK_DIR)", default=None)
+
+    # serve
+    subcommand_serve = subparsers.add_parser(
+        "serve",
+        help="Run a local daemon serving get, balance, portfolio, price_history, scan and market commands"
+    )
+    subcommand_serve.set_defaults(call_func=process_serve)
+    add_common_args(subcommand_serve)
+
+    subcommand_serve.add_argument("-S", action="store", dest="socket", help="Socket path (default from CSUTL_SOCKET)", default=None)
 
     # market orders
     subcommand_market = subparsers.add_parser(
@@ -546,8 +1431,25 @@ def process_args():
     subcommand_market_orders.add_argument("-e", action="store", dest="end_date", help="End date", default=None)
     subcommand_market_orders.add_argument("-l", action="store", dest="limit", help="Result limit (default 200, max 500)", type=int, default=None)
     subcommand_market_orders.add_argument("-t", action="store", dest="cointype", help="coin type", default=None)
+    subcommand_market_orders.add_argument("--local", action="store_true", dest="local",
+        help="Query completed orders from the local order store (location from CSUTL_ORDER_STORE)")
+    subcommand_market_orders.add_argument("--sync", action="store_true", dest="sync",
+        help="Sync new completed orders in to the local order store, then query it")
     subcommand_market_orders.add_argument("-c", action="store_true", dest="completed", help="Show completed orders")
 
+    # Market quote
+    subcommand_market_quote = subparsers_market.add_parser(
+        "quote",
+        help="Estimate order fill from order book depth"
+    )
+    subcommand_market_quote.set_defaults(call_func=process_market_quote)
+    add_common_args(subcommand_market_quote)
+
+    subcommand_market_quote.add_argument("cointype", action="store", help="coin type")
+    subcommand_market_quote.add_argument("side", action="store", help="Order side", choices=("buy", "sell"))
+    subcommand_market_quote.add_argument("amount_type", action="store", help="Amount type", choices=("aud", "coin"))
+    subcommand_market_quote.add_argument("amount", action="store", help="Amount", type=float)
+
     # Market buy order
     subcommand_market_buy = subparsers_market.add_parser(
         "buy",
@@ -556,10 +1458,14 @@ def process_args():
     subcommand_market_buy.set_defaults(call_func=process_market_buy)
     add_common_args(subcommand_market_buy)
 
-    subcommand_market_buy.add_argument("cointype", action="store", help="coin type")
-    subcommand_market_buy.add_argument("amount_type", action="store", help="Amount type", choices=("aud", "coin"))
-    subcommand_market_buy.add_argument("amount", action="store", help="Amount", type=float)
+    subcommand_market_buy.add_argument("cointype", action="store", help="coin type", nargs="?")
+    subcommand_market_buy.add_argument("amount_type", action="store", help="Amount type", choices=("aud", "coin"), nargs="?")
+    subcommand_market_buy.add_argument("amount", action="store", help="Amount", type=float, nargs="?")
     subcommand_market_buy.add_argument("-r", action="store", dest="rate", help="rate", default=None, type=float)
+    subcommand_market_buy.add_argument("--depth", action="store_true", dest="depth",
+        help="Without a rate, use the order book depth to find the rate that fills the whole order")
+    subcommand_market_buy.add_argument("--from", action="store", dest="orders_file", default=None,
+        help="Place orders from a file of json lines (cointype, amount_type, amount and optional rate)")
 
     # Market sell order
     subcommand_market_sell = subparsers_market.add_parser(
@@ -569,13 +1475,44 @@ def process_args():
     subcommand_market_sell.set_defaults(call_func=process_market_sell)
     add_common_args(subcommand_market_sell)
 
-    subcommand_market_sell.add_argument("cointype", action="store", help="coin type")
-    subcommand_market_sell.add_argument("amount_type", action="store", help="Amount type", choices=("aud", "coin"))
-    subcommand_market_sell.add_argument("amount", action="store", help="Amount", type=float)
+    subcommand_market_sell.add_argument("cointype", action="store", help="coin type", nargs="?")
+    subcommand_market_sell.add_argument("amount_type", action="store", help="Amount type", choices=("aud", "coin"), nargs="?")
+    subcommand_market_sell.add_argument("amount", action="store", help="Amount", type=float, nargs="?")
     subcommand_market_sell.add_argument("-r", action="store", dest="rate", help="rate", default=None, type=float)
+    subcommand_market_sell.add_argument("--depth", action="store_true", dest="depth",
+        help="Without a rate, use the order book depth to find the rate that fills the whole order")
+    subcommand_market_sell.add_argument("--from", action="store", dest="orders_file", default=None,
+        help="Place orders from a file of json lines (cointype, amount_type, amount and optional rate)")
+
+    return parser
+
+def uses_local_files(args):
+    """
+    Whether a command reads or writes local files, or binary output. These are
+    always run locally, as the daemon may not see the same paths (or local
+    order store) and only returns text output.
+    """
+
+    local_file = getattr(args, "orders_file", None) is not None or getattr(args, "output_file", None) is not None
+    local_file = local_file or getattr(args, "format", "json") == "bin"
+
+    # The local order store is found from the caller's environment
+    local_file = local_file or getattr(args, "local", False) or getattr(args, "sync", False)
+
+    return local_file
+
+def process_args():
+    """
+    Processes csutl command line arguments
+    """
+
+    parser = build_parser()
+
+    # A bare --profile would otherwise consume the subcommand as its path
+    argv = [f"--profile={DEFAULT_PROFILE_PATH}" if x == "--profile" else x for x in sys.argv[1:]]
 
     # Parse arguments
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Capture argument options
     global debug
@@ -594,7 +1531,22 @@ def process_args():
         parser.print_help()
         return 1
 
-    return args.call_func(args)
+    # Forward to the daemon, if there is one running
+    if args.subcommand in DAEMON_SUBCOMMANDS and not args.no_daemon and not uses_local_files(args) and args.profile is None:
+        result = forward(default_socket_path(), argv, daemon_context(args))
+        if result is not None:
+            logger.debug("Command forwarded to daemon")
+            status, output = result
+            sys.stdout.write(output)
+            return status
+
+    with deadline_scope(args.deadline):
+        # Run under the profiler, if requested
+        if args.profile is not None:
+            args.profiler = Profiler(args.profile, collapsed_path=args.profile_collapsed)
+            return args.profiler.run(args.call_func, args)
+
+        return args.call_func(args)
 
 def main():
     ret = 0
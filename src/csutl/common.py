@@ -8,3 +8,49 @@ def val_arg(value, message):
 def val_run(value, message):
     if not value:
         raise RuntimeException(message)
+
+def parse_age(age):
+    """
+    Parse an age string (e.g. 4, 4h, 3d, 2w) in to a number of hours
+    """
+
+    val_arg(isinstance(age, str) and age != "", "Invalid age supplied")
+
+    mod = 1
+
+    if age.endswith("h"):
+        age = age[:-1]
+    elif age.endswith("d"):
+        age = age[:-1]
+        mod = 24
+    elif age.endswith("w"):
+        age = age[:-1]
+        mod = 24 * 7
+
+    val_arg(age.isdigit(), f"Age is not a valid format: {age}")
+
+    return int(age) * mod
+
+def parse_interval(interval):
+    """
+    Parse an interval string (e.g. 30s, 5m, 1h, 1d, 1w) in to a number of seconds
+    """
+
+    val_arg(isinstance(interval, str) and interval != "", "Invalid interval supplied")
+
+    units = {
+        "s": 1,
+        "m": 60,
+        "h": 60 * 60,
+        "d": 60 * 60 * 24,
+        "w": 60 * 60 * 24 * 7
+    }
+
+    mod = 1
+    if interval[-1] in units:
+        mod = units[interval[-1]]
+        interval = interval[:-1]
+
+    val_arg(interval.isdigit() and int(interval) > 0, f"Interval is not a valid format: {interval}")
+
+    return int(interval) * mod
@@ -0,0 +1,166 @@
+"""
+Cross coin return correlation, from price series aligned on a common time grid
+"""
+
+import csv
+import math
+import heapq
+import logging
+
+from .common import val_arg, val_run
+
+logger = logging.getLogger(__name__)
+
+def align_series(series, interval_ms):
+    """
+    Align price series (a list of (timestamps, prices) tuples, each in timestamp
+    order) on to a grid of interval_ms buckets, with a streaming k-way merge
+
+    Each grid row holds the last price seen for every series at the end of the
+    bucket, carrying prices forward over buckets without samples. Rows start
+    from the first bucket where every series has a price.
+
+    Returns (grid_timestamps, rows), where grid timestamps are bucket starts
+    """
+
+    val_arg(isinstance(series, list) and len(series) > 0, "Invalid series passed to align_series")
+    val_arg(isinstance(interval_ms, int) and interval_ms > 0, "Invalid interval_ms passed to align_series")
+
+    # Each series is reduced to its last price per bucket before merging, so the
+    # merge only orders one item per series per bucket
+    def events(index, timestamps, prices):
+        bucket = None
+        last = None
+        for timestamp, price in zip(timestamps, prices):
+            current = timestamp // interval_ms
+            if current != bucket and bucket is not None:
+                yield bucket, index, last
+            bucket = current
+            last = price
+
+        if bucket is not None:
+            yield bucket, index, last
+
+    merged = heapq.merge(*(events(index, x[0], x[1]) for index, x in enumerate(series)))
+
+    last = [None] * len(series)
+    missing = len(series)
+    grid_timestamps = []
+    rows = []
+    bucket = None
+
+    for current, index, price in merged:
+        # Close out the previous bucket (and any empty buckets since) once the
+        # merge moves past it
+        if bucket is not None and current != bucket and missing == 0:
+            for empty in range(bucket, current):
+                grid_timestamps.append(empty * interval_ms)
+                rows.append(list(last))
+
+        bucket = current
+
+        if last[index] is None:
+            missing -= 1
+        last[index] = price
+
+    if bucket is not None and missing == 0:
+        grid_timestamps.append(bucket * interval_ms)
+        rows.append(list(last))
+
+    return grid_timestamps, rows
+
+def correlation_matrix(rows):
+    """
+    Pearson correlation of log returns between the columns of aligned price rows.
+    Entries are None where a column has no variance.
+    """
+
+    val_arg(isinstance(rows, list), "Invalid rows passed to correlation_matrix")
+    val_run(len(rows) >= 3, "Must have at least three aligned samples for correlation")
+    val_run(all(x > 0 for row in rows for x in row), "Prices must be positive for log returns")
+
+    try:
+        import numpy # pylint: disable=import-outside-toplevel
+    except ImportError:
+        numpy = None
+
+    if numpy is not None:
+        return _correlation_matrix_numpy(rows)
+
+    columns = len(rows[0])
+
+    # Log returns per column, centred on the column mean
+    returns = [[math.log(rows[i][col] / rows[i - 1][col]) for i in range(1, len(rows))] for col in range(columns)]
+    centred = []
+    norms = []
+    for values in returns:
+        mean = math.fsum(values) / len(values)
+        centred.append([x - mean for x in values])
+        norms.append(math.sqrt(math.fsum((x - mean) ** 2 for x in values)))
+
+    matrix = [[None] * columns for _ in range(columns)]
+    for i in range(columns):
+        for j in range(i, columns):
+            if norms[i] == 0 or norms[j] == 0:
+                continue
+
+            if i == j:
+                matrix[i][i] = 1.0
+                continue
+
+            value = math.fsum(a * b for a, b in zip(centred[i], centred[j])) / (norms[i] * norms[j])
+            value = max(-1.0, min(1.0, value))
+            matrix[i][j] = value
+            matrix[j][i] = value
+
+    return matrix
+
+def _correlation_matrix_numpy(rows):
+    """
+    Correlation of log returns in one pass over a (samples x coins) array
+    """
+
+    import numpy # pylint: disable=import-outside-toplevel
+
+    returns = numpy.diff(numpy.log(numpy.asarray(rows, dtype=numpy.float64)), axis=0)
+    centred = returns - returns.mean(axis=0)
+    norms = numpy.sqrt((centred * centred).sum(axis=0))
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        matrix = (centred.T @ centred) / numpy.outer(norms, norms)
+
+    matrix = numpy.clip(matrix, -1.0, 1.0)
+    numpy.fill_diagonal(matrix, numpy.where(norms > 0, 1.0, numpy.nan))
+
+    return [[None if math.isnan(x) else float(x) for x in row] for row in matrix.tolist()]
+
+def build_correlation(coins, series, interval_ms):
+    """
+    Align the series for coins and build the correlation response
+    """
+
+    val_arg(isinstance(coins, list) and len(coins) == len(series), "Mismatched coins and series passed to build_correlation")
+
+    grid_timestamps, rows = align_series(series, interval_ms)
+    logger.debug("Aligned %s series on to %s grid points", len(series), len(rows))
+
+    matrix = correlation_matrix(rows)
+
+    return {
+        "coins": coins,
+        "interval_ms": interval_ms,
+        "samples": len(rows),
+        "start": grid_timestamps[0],
+        "end": grid_timestamps[-1],
+        "matrix": matrix
+    }
+
+def write_correlation_csv(file, correlation):
+    """
+    Write a correlation response as a csv matrix, with coin header row and column
+    """
+
+    writer = csv.writer(file, lineterminator="\n")
+    writer.writerow(["coin"] + correlation["coins"])
+    for coin, row in zip(correlation["coins"], correlation["matrix"]):
+        writer.writerow([coin] + ["" if x is None else x for x in row])
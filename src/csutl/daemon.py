@@ -0,0 +1,168 @@
+"""
+Local daemon, serving csutl commands over a unix socket from a warm process
+"""
+
+import os
+import json
+import socket
+import logging
+import socketserver
+
+from .common import val_arg, val_run
+from .exception import DaemonDeclinedException
+
+logger = logging.getLogger(__name__)
+
+def default_socket_path():
+    """
+    Default location for the daemon socket
+    """
+
+    path = os.environ.get("CSUTL_SOCKET")
+    if path is not None and path != "":
+        return path
+
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    if base is None or base == "":
+        base = os.path.join(os.path.expanduser("~"), ".cache", "csutl")
+
+    return os.path.join(base, "csutl.sock")
+
+def read_message(file):
+    """
+    Read a single newline delimited json message
+    """
+
+    line = file.readline()
+    val_run(line != b"", "Connection closed before message received")
+
+    return json.loads(line)
+
+def write_message(file, message):
+    """
+    Write a single newline delimited json message
+    """
+
+    file.write(json.dumps(message).encode("utf-8") + b"\n")
+    file.flush()
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Threaded unix socket server, passing each request to the command handler
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, command_handler):
+        self.command_handler = command_handler
+        super().__init__(path, DaemonRequestHandler)
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handler for a single client request
+    """
+
+    def handle(self):
+        try:
+            request = read_message(self.rfile)
+            val_run(isinstance(request.get("argv"), list), "Invalid request - missing argv")
+
+            status, output = self.server.command_handler(request["argv"], request.get("context"))
+            response = {"status": status, "output": output, "error": None}
+        except DaemonDeclinedException as e:
+            logger.info("Declined request: %s", e)
+            response = {"status": 1, "output": "", "error": None, "declined": str(e)}
+        except Exception as e: # pylint: disable=broad-exception-caught
+            logger.error("Request failed: %s", e)
+            response = {"status": 1, "output": "", "error": str(e)}
+
+        try:
+            write_message(self.wfile, response)
+        except OSError as e:
+            logger.debug("Failed to write response: %s", e)
+
+def serve(path, handle):
+    """
+    Serve requests on the unix socket at path until interrupted. handle is called
+    with the argv and client context for each request and returns a (status,
+    output) tuple, or raises DaemonDeclinedException for the client to run the
+    command itself.
+    """
+
+    val_arg(isinstance(path, str) and path != "", "Invalid path passed to serve")
+    val_arg(callable(handle), "Invalid handle passed to serve")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    # Remove a stale socket, but refuse to replace a running daemon
+    if os.path.exists(path):
+        val_run(not is_running(path), f"Daemon already listening on {path}")
+        os.unlink(path)
+
+    # The daemon acts with the api credentials of its own environment, so
+    # restrict the socket to the current user
+    old_umask = os.umask(0o177)
+    try:
+        server = DaemonServer(path, handle)
+    finally:
+        os.umask(old_umask)
+
+    logger.info("Listening on %s", path)
+
+    try:
+        with server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def is_running(path):
+    """
+    Check whether a daemon is accepting connections on the socket at path
+    """
+
+    if not os.path.exists(path):
+        return False
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+    except OSError:
+        return False
+
+    return True
+
+def forward(path, argv, context=None):
+    """
+    Forward argv to the daemon listening at path, returning the (status, output)
+    of the command. context describes the client (transport options and
+    account), for the daemon to check against its own. Returns None if no
+    daemon is listening, or the daemon declined the command.
+    """
+
+    val_arg(isinstance(argv, list), "Invalid argv passed to forward")
+    val_arg(isinstance(context, (dict, type(None))), "Invalid context passed to forward")
+
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        with sock.makefile("rwb") as file:
+            write_message(file, {"argv": argv, "context": context})
+            response = read_message(file)
+
+    if response.get("declined") is not None:
+        logger.debug("Daemon declined command: %s", response["declined"])
+        return None
+
+    val_run(response.get("error") is None, f"Daemon error: {response.get('error')}")
+
+    return response["status"], response["output"]
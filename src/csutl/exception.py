@@ -12,3 +12,19 @@ class RuntimeException(Exception):
     csutl runtime exception
     """
 
+
+class CircuitOpenException(RuntimeException):
+    """
+    csutl exception for requests refused by an open circuit breaker
+    """
+
+class DeadlineExceededException(RuntimeException):
+    """
+    csutl exception for work not started as the command deadline has passed
+    """
+
+class DaemonDeclinedException(RuntimeException):
+    """
+    csutl exception for commands the daemon won't run for a client, which the
+    client runs locally instead
+    """
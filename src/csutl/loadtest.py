@@ -0,0 +1,429 @@
+"""
+Load testing of CoinSpotApi against a local stand-in server
+"""
+
+import json
+import math
+import time
+import random
+import logging
+import threading
+import urllib.parse
+
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .common import val_arg
+
+logger = logging.getLogger(__name__)
+
+class LatencyHistogram:
+    """
+    Log-linear latency histogram in the style of HdrHistogram. Values (integer
+    microseconds) are counted in buckets of sub_bits of precision, so recording
+    is constant time and memory is bounded regardless of the number of samples.
+    """
+
+    def __init__(self, sub_bits=7):
+        val_arg(isinstance(sub_bits, int) and sub_bits >= 2, "Invalid sub_bits passed to LatencyHistogram")
+
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        self.half_count = self.sub_count >> 1
+
+        self.counts = Counter()
+        self.total = 0
+        self.sum = 0
+        self.sum_squares = 0
+        self.max = 0
+
+    def index(self, value):
+        """
+        Bucket index for a value
+        """
+
+        if value < self.sub_count:
+            return value
+
+        shift = value.bit_length() - self.sub_bits
+
+        return shift * self.half_count + (value >> shift)
+
+    def highest_equivalent(self, index):
+        """
+        Largest value counted in the bucket at index
+        """
+
+        if index < self.sub_count:
+            return index
+
+        shift = index // self.half_count - 1
+        mantissa = index - shift * self.half_count
+
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value):
+        """
+        Record a value (microseconds)
+        """
+
+        value = max(0, int(value))
+
+        self.counts[self.index(value)] += 1
+        self.total += 1
+        self.sum += value
+        self.sum_squares += value * value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """
+        Add the counts from another histogram with the same precision
+        """
+
+        val_arg(other.sub_bits == self.sub_bits, "Mismatched histogram precision")
+
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.sum += other.sum
+        self.sum_squares += other.sum_squares
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.sum / self.total if self.total > 0 else 0.0
+
+    def stdev(self):
+        if self.total == 0:
+            return 0.0
+
+        mean = self.mean()
+
+        return math.sqrt(max(0.0, self.sum_squares / self.total - mean * mean))
+
+    def distribution(self, ticks_per_half=5):
+        """
+        Percentile distribution as (value, percentile, total count) tuples, with
+        percentile steps halving towards 100, as reported by HdrHistogram
+        """
+
+        if self.total == 0:
+            return []
+
+        buckets = sorted(self.counts.items())
+
+        result = []
+        cumulative = 0
+        position = 0
+        percentile = 0.0
+        half = 0
+
+        while True:
+            target = max(1, math.ceil(percentile / 100 * self.total))
+            while cumulative < target:
+                cumulative += buckets[position][1]
+                position += 1
+
+            result.append((min(self.highest_equivalent(buckets[position - 1][0]), self.max), percentile, cumulative))
+
+            if cumulative >= self.total:
+                break
+
+            # Each half of the remaining distance to 100 is covered in the same
+            # number of steps
+            step = 100 / (2 ** (half + 1)) / ticks_per_half
+            percentile += step
+            if percentile >= 100 * (1 - 1 / (2 ** (half + 1))) - 1e-9:
+                half += 1
+
+            percentile = min(percentile, 100.0)
+
+        if result[-1][1] < 100.0:
+            result.append((self.max, 100.0, self.total))
+
+        return result
+
+    def value_at(self, percentile):
+        """
+        Value at or below which percentile of recorded values fall
+        """
+
+        if self.total == 0:
+            return 0
+
+        target = max(1, math.ceil(percentile / 100 * self.total))
+        cumulative = 0
+        for index, count in sorted(self.counts.items()):
+            cumulative += count
+            if cumulative >= target:
+                return min(self.highest_equivalent(index), self.max)
+
+        return self.max
+
+    def report(self, file, scale=1000.0):
+        """
+        Write the percentile distribution, with values divided by scale (so
+        milliseconds, by default)
+        """
+
+        file.write(f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>16}\n\n")
+
+        for value, percentile, count in self.distribution():
+            inverse = "" if percentile >= 100.0 else f"{1 / (1 - percentile / 100):16.2f}"
+            file.write(f"{value / scale:12.3f} {percentile / 100:14.12f} {count:10d} {inverse}\n")
+
+        file.write(f"#[Mean    = {self.mean() / scale:12.3f}, StdDeviation   = {self.stdev() / scale:12.3f}]\n")
+        file.write(f"#[Max     = {self.max / scale:12.3f}, Total count    = {self.total:12d}]\n")
+
+class StandInHTTPServer(ThreadingHTTPServer):
+    """
+    Threaded http server with a listen backlog deep enough for hundreds of
+    concurrent callers, so connections aren't dropped before reaching a handler
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+class StandInServer:
+    """
+    Local http server standing in for the CoinSpot api, with configurable
+    latency, jitter and injected 429 and 5xx responses
+
+    Nonces of post requests are recorded in arrival order, so the ordering seen
+    by the server can be checked.
+    """
+
+    def __init__(self, latency=0.02, jitter=0.01, rate_429=0.0, rate_5xx=0.0, seed=None):
+        val_arg(isinstance(latency, (int, float)) and latency >= 0, "Invalid latency passed to StandInServer")
+        val_arg(isinstance(jitter, (int, float)) and jitter >= 0, "Invalid jitter passed to StandInServer")
+        val_arg(isinstance(rate_429, (int, float)) and 0 <= rate_429 <= 1, "Invalid rate_429 passed to StandInServer")
+        val_arg(isinstance(rate_5xx, (int, float)) and 0 <= rate_5xx <= 1, "Invalid rate_5xx passed to StandInServer")
+        val_arg(rate_429 + rate_5xx <= 1, "Combined fault rates exceed 1")
+
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.nonces = []
+        self.statuses = Counter()
+
+        self.server = StandInHTTPServer(("127.0.0.1", 0), StandInRequestHandler)
+        self.server.stand_in = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def delay(self):
+        """
+        Response delay, uniform within jitter of the latency
+        """
+
+        with self.lock:
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+
+        return max(0.0, delay)
+
+    def fault(self):
+        """
+        Status code of an injected fault, or None
+        """
+
+        with self.lock:
+            value = self.random.random()
+
+        if value < self.rate_429:
+            return 429
+
+        if value < self.rate_429 + self.rate_5xx:
+            return 503
+
+        return None
+
+    def record(self, status, nonce=None):
+        with self.lock:
+            self.statuses[status] += 1
+            if nonce is not None:
+                self.nonces.append(nonce)
+
+    def nonce_stats(self):
+        """
+        Ordering of post nonces as they arrived at the server. A nonce that isn't
+        greater than every nonce before it would be rejected by the api.
+        """
+
+        with self.lock:
+            nonces = list(self.nonces)
+
+        out_of_order = 0
+        highest = None
+        for nonce in nonces:
+            if highest is not None and nonce <= highest:
+                out_of_order += 1
+            else:
+                highest = nonce
+
+        return {
+            "received": len(nonces),
+            "out_of_order": out_of_order,
+            "duplicates": len(nonces) - len(set(nonces))
+        }
+
+def history_response(query):
+    """
+    Synthetic history_basic series, one sample a minute over the requested range
+    """
+
+    params = urllib.parse.parse_qs(query)
+    start = int(params.get("from", ["0"])[0])
+    end = int(params.get("to", ["0"])[0])
+
+    step = 60 * 1000
+    first = -(-start // step) * step
+
+    return [[ts, 100.0 + 10 * math.sin(ts / 3600000)] for ts in range(first, min(end, first + 10000 * step) + 1, step)]
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler for the stand-in server
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+    def respond(self, status, content):
+        body = json.dumps(content).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, method):
+        stand_in = self.server.stand_in
+
+        nonce = None
+        if method == "post":
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                nonce = int(json.loads(self.rfile.read(length)).get("nonce"))
+            except (ValueError, TypeError, AttributeError):
+                nonce = None
+
+        time.sleep(stand_in.delay())
+
+        status = stand_in.fault()
+        stand_in.record(status or 200, nonce)
+
+        if status is not None:
+            self.respond(status, {"status": "error", "message": "Injected fault"})
+            return
+
+        url = urllib.parse.urlparse(self.path)
+
+        if url.path.startswith("/charts/history_basic"):
+            self.respond(200, history_response(url.query))
+        elif url.path.startswith("/pubapi/v2/latest"):
+            self.respond(200, {"status": "ok", "prices": {"btc": {"bid": "99", "ask": "101", "last": "100"}}})
+        else:
+            self.respond(200, {"status": "ok", "message": "ok"})
+
+    def do_GET(self): # pylint: disable=invalid-name
+        self.handle_request("get")
+
+    def do_POST(self): # pylint: disable=invalid-name
+        self.handle_request("post")
+
+def error_kind(exc):
+    """
+    Short description of a failed call, for grouping errors
+    """
+
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        return f"HTTP {status}"
+
+    return type(exc).__name__
+
+def run_load(func, callers, requests_per_caller):
+    """
+    Call func from callers threads, requests_per_caller times each, with all
+    threads released together. Latency is recorded per thread and merged, so
+    recording doesn't contend on a lock.
+
+    Returns a dict of the merged histogram (successful calls), errors by kind
+    and elapsed wall time
+    """
+
+    val_arg(callable(func), "Invalid func passed to run_load")
+    val_arg(isinstance(callers, int) and callers > 0, "Invalid callers passed to run_load")
+    val_arg(isinstance(requests_per_caller, int) and requests_per_caller > 0, "Invalid requests_per_caller passed to run_load")
+
+    barrier = threading.Barrier(callers + 1)
+    histograms = [LatencyHistogram() for _ in range(callers)]
+    errors = [Counter() for _ in range(callers)]
+
+    def caller(index):
+        histogram = histograms[index]
+        caller_errors = errors[index]
+
+        barrier.wait()
+
+        for _ in range(requests_per_caller):
+            start = time.perf_counter()
+            try:
+                func()
+            except Exception as e: # pylint: disable=broad-exception-caught
+                caller_errors[error_kind(e)] += 1
+                continue
+
+            histogram.record((time.perf_counter() - start) * 1000000)
+
+    threads = [threading.Thread(target=caller, args=(x,), daemon=True) for x in range(callers)]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start
+
+    histogram = LatencyHistogram()
+    total_errors = Counter()
+    for index in range(callers):
+        histogram.merge(histograms[index])
+        total_errors.update(errors[index])
+
+    return {
+        "histogram": histogram,
+        "errors": total_errors,
+        "elapsed": elapsed
+    }
@@ -0,0 +1,132 @@
+"""
+Order book model for estimating the cost of filling market orders
+"""
+
+import bisect
+import json
+import logging
+
+from .common import val_arg, val_run
+
+logger = logging.getLogger(__name__)
+
+class BookSide:
+    """
+    One side of the order book, ordered from best to worst rate, with prefix sums
+    of the cumulative coin amount and aud total at each level
+    """
+
+    def __init__(self, levels, descending=False):
+        val_arg(isinstance(levels, list), "Invalid levels passed to BookSide")
+
+        levels = sorted(levels, key=lambda x: x[0], reverse=descending)
+
+        self.rates = [x[0] for x in levels]
+        self.cum_amount = []
+        self.cum_aud = []
+
+        amount_total = 0.0
+        aud_total = 0.0
+        for rate, amount in levels:
+            amount_total += amount
+            aud_total += amount * rate
+            self.cum_amount.append(amount_total)
+            self.cum_aud.append(aud_total)
+
+    def __len__(self):
+        return len(self.rates)
+
+    def fill(self, amount=None, aud=None):
+        """
+        Estimate the fill for an amount of coin, or an aud total, walking the book
+        from the best rate. Located with a binary search over the prefix sums.
+        """
+
+        val_arg((amount is None) != (aud is None), "Specify one of amount or aud to fill")
+        val_run(len(self.rates) > 0, "Order book side is empty")
+
+        if amount is not None:
+            val_arg(isinstance(amount, (int, float)) and amount > 0, "Invalid amount to fill")
+            cumulative = self.cum_amount
+            target = amount
+        else:
+            val_arg(isinstance(aud, (int, float)) and aud > 0, "Invalid aud to fill")
+            cumulative = self.cum_aud
+            target = aud
+
+        index = bisect.bisect_left(cumulative, target)
+
+        # Not enough depth to fill completely - report the whole side
+        if index >= len(self.rates):
+            return {
+                "complete": False,
+                "levels": len(self.rates),
+                "amount": self.cum_amount[-1],
+                "aud": self.cum_aud[-1],
+                "vwap": self.cum_aud[-1] / self.cum_amount[-1],
+                "worst_rate": self.rates[-1]
+            }
+
+        rate = self.rates[index]
+        prior_amount = self.cum_amount[index - 1] if index > 0 else 0.0
+        prior_aud = self.cum_aud[index - 1] if index > 0 else 0.0
+
+        # Partially consume the final level
+        if amount is not None:
+            fill_amount = amount
+            fill_aud = prior_aud + (amount - prior_amount) * rate
+        else:
+            fill_aud = aud
+            fill_amount = prior_amount + (aud - prior_aud) / rate
+
+        return {
+            "complete": True,
+            "levels": index + 1,
+            "amount": fill_amount,
+            "aud": fill_aud,
+            "vwap": fill_aud / fill_amount,
+            "worst_rate": rate
+        }
+
+class OrderBook:
+    """
+    Open order book for a coin, built from the public open orders endpoint
+    """
+
+    def __init__(self, coin, buy_levels, sell_levels):
+        val_arg(isinstance(coin, str) and coin != "", "Invalid coin passed to OrderBook")
+
+        self.coin = coin
+
+        # Bids are consumed from the highest rate, asks from the lowest
+        self.bids = BookSide(buy_levels, descending=True)
+        self.asks = BookSide(sell_levels)
+
+    @classmethod
+    def from_response(cls, coin, response):
+        """
+        Build an order book from a /pubapi/v2/orders/open response
+        """
+
+        content = response
+        if isinstance(content, str):
+            content = json.loads(content)
+
+        val_run(isinstance(content.get("buyorders"), list), "API response missing 'buyorders' list")
+        val_run(isinstance(content.get("sellorders"), list), "API response missing 'sellorders' list")
+
+        buy_levels = [(float(x["rate"]), float(x["amount"])) for x in content["buyorders"]]
+        sell_levels = [(float(x["rate"]), float(x["amount"])) for x in content["sellorders"]]
+
+        return cls(coin, buy_levels, sell_levels)
+
+    def fill(self, side, amount=None, aud=None):
+        """
+        Estimate the fill for a buy (against asks) or sell (against bids)
+        """
+
+        val_arg(side in ("buy", "sell"), "Invalid side for order book fill")
+
+        book_side = self.asks if side == "buy" else self.bids
+
+        return book_side.fill(amount=amount, aud=aud)
@@ -0,0 +1,260 @@
+"""
+Local SQLite store of completed orders, synced incrementally from the api
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from datetime import datetime, timezone
+
+from .common import val_arg, val_run
+from .exception import ArgumentException
+
+logger = logging.getLogger(__name__)
+
+# Completed order endpoints, by store source
+ORDER_SOURCES = {
+    "orders": "/api/v2/ro/my/orders/completed",
+    "market": "/api/v2/ro/my/orders/market/completed"
+}
+
+# Maximum orders returned by a single completed orders request
+SYNC_LIMIT = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    account TEXT NOT NULL,
+    source TEXT NOT NULL,
+    key TEXT NOT NULL,
+    side TEXT NOT NULL,
+    coin TEXT NOT NULL,
+    sold_ms INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (account, source, key)
+);
+CREATE INDEX IF NOT EXISTS orders_coin_date ON orders (account, source, coin, sold_ms);
+CREATE INDEX IF NOT EXISTS orders_date ON orders (account, source, sold_ms);
+"""
+
+def default_store_path():
+    """
+    Default location for the order store
+    """
+
+    path = os.environ.get("CSUTL_ORDER_STORE")
+    if path is not None and path != "":
+        return path
+
+    base = os.environ.get("XDG_DATA_HOME", os.path.join(os.path.expanduser("~"), ".local", "share"))
+
+    return os.path.join(base, "csutl", "orders.db")
+
+def parse_date_ms(value):
+    """
+    Parse a date (epoch milliseconds, YYYY-MM-DD or an iso format date time) in
+    to epoch milliseconds. Dates without a timezone are taken as UTC.
+    """
+
+    val_arg(isinstance(value, str) and value != "", "Invalid date supplied")
+
+    if value.isdigit():
+        return int(value)
+
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError as e:
+        raise ArgumentException(f"Date is not a valid format: {value}") from e
+
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+
+    return int(parsed.timestamp() * 1000)
+
+def account_id():
+    """
+    Identifier for the account of the configured api key, so orders from
+    different accounts are kept apart without storing the key itself
+    """
+
+    apikey = os.environ.get("COINSPOT_API_KEY", "")
+    val_run(apikey != "", "Missing api key in COINSPOT_API_KEY")
+
+    return hashlib.sha256(apikey.encode("utf-8")).hexdigest()[:16]
+
+def order_key(side, order):
+    """
+    Key identifying a completed order. Completed orders carry no id, but never
+    change, so the key is a digest of the order content.
+    """
+
+    content = json.dumps([side, order], sort_keys=True, separators=(",", ":"))
+
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+def order_rows(account, source, response):
+    """
+    Convert a completed orders response in to rows for the order store
+    """
+
+    content = response
+    if isinstance(content, str):
+        content = json.loads(content)
+
+    val_run(isinstance(content.get("buyorders"), list), "API response missing 'buyorders' list")
+    val_run(isinstance(content.get("sellorders"), list), "API response missing 'sellorders' list")
+
+    rows = []
+    for side, key in (("buy", "buyorders"), ("sell", "sellorders")):
+        for order in content[key]:
+            val_run(isinstance(order.get("solddate"), str), "Order missing 'solddate'")
+            rows.append((account, source, order_key(side, order), side, str(order.get("coin", "")).upper(),
+                parse_date_ms(order["solddate"]), json.dumps(order)))
+
+    return rows
+
+class OrderStore:
+    """
+    Completed orders for each account and source, queried by coin and date range
+
+    Completed orders are immutable, so a sync only requests orders from the
+    newest stored order date. Orders already stored are ignored.
+    """
+
+    def __init__(self, path=None):
+        val_arg(isinstance(path, (str, type(None))), "Invalid path passed to OrderStore")
+
+        if path is None:
+            path = default_store_path()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self.path = path
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        """
+        Close the underlying database
+        """
+
+        self.conn.close()
+
+    def newest(self, account, source):
+        """
+        Sold date (epoch milliseconds) of the newest stored order, or None
+        """
+
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(sold_ms) FROM orders WHERE account = ? AND source = ?",
+                (account, source)).fetchone()
+
+        return row[0]
+
+    def add(self, rows):
+        """
+        Store order rows from order_rows in a single transaction, returning the
+        number of orders not already stored
+        """
+
+        with self.lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO orders VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+            return self.conn.total_changes - before
+
+    def sync(self, api, source):
+        """
+        Retrieve orders completed since the newest stored order. A full page
+        means there may be older new orders, so paging continues backwards from
+        the oldest order in the page, until a page isn't full. Pages are stored
+        together, so an interrupted sync doesn't leave a gap behind the newest
+        stored order.
+
+        Returns the number of orders added
+        """
+
+        val_arg(source in ORDER_SOURCES, "Invalid source passed to OrderStore.sync")
+
+        account = account_id()
+        newest = self.newest(account, source)
+
+        request = {"limit": SYNC_LIMIT}
+
+        # Overlap on the newest stored date - orders at that time may have been
+        # only partly stored
+        if newest is not None:
+            request["startdate"] = newest
+
+        rows = []
+        while True:
+            page = order_rows(account, source, api.post(ORDER_SOURCES[source], request))
+            rows.extend(page)
+
+            logger.debug("Retrieved %s orders from %s", len(page), source)
+
+            if len(page) < SYNC_LIMIT:
+                break
+
+            # No progress possible if the whole page shares the same date
+            oldest = min(x[5] for x in page)
+            if request.get("enddate") == oldest:
+                logger.warning("More than %s orders at %s, some may be missing", SYNC_LIMIT, oldest)
+                break
+
+            request["enddate"] = oldest
+
+        return self.add(rows)
+
+    def query(self, source, coin=None, start=None, end=None, limit=None):
+        """
+        Stored orders for the configured account, newest first, in the shape of a
+        completed orders response. start and end are epoch milliseconds.
+        """
+
+        val_arg(source in ORDER_SOURCES, "Invalid source passed to OrderStore.query")
+        val_arg(isinstance(coin, (str, type(None))), "Invalid coin passed to OrderStore.query")
+        val_arg(isinstance(start, (int, type(None))), "Invalid start passed to OrderStore.query")
+        val_arg(isinstance(end, (int, type(None))), "Invalid end passed to OrderStore.query")
+        val_arg(limit is None or (isinstance(limit, int) and limit > 0), "Invalid limit passed to OrderStore.query")
+
+        sql = "SELECT side, data FROM orders WHERE account = ? AND source = ?"
+        params = [account_id(), source]
+
+        if coin is not None:
+            sql += " AND coin = ?"
+            params.append(coin.upper())
+
+        if start is not None:
+            sql += " AND sold_ms >= ?"
+            params.append(start)
+
+        if end is not None:
+            sql += " AND sold_ms <= ?"
+            params.append(end)
+
+        sql += " ORDER BY sold_ms DESC"
+
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+
+        response = {
+            "status": "ok",
+            "buyorders": [],
+            "sellorders": []
+        }
+
+        for side, data in rows:
+            response[f"{side}orders"].append(json.loads(data))
+
+        return json.dumps(response)
@@ -0,0 +1,170 @@
+"""
+Profiling support for csutl subcommands
+"""
+
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+
+from collections import Counter
+
+from .common import val_arg
+
+logger = logging.getLogger(__name__)
+
+class Profiler:
+    """
+    Profile a call with cProfile, optionally sampling stacks for flamegraphs
+
+    Time spent waiting on the api requestor is measured separately (wall clock),
+    so network wait can be distinguished from cpu time in the report.
+    """
+
+    def __init__(self, path, collapsed_path=None, interval=0.001, top=20):
+        val_arg(isinstance(path, str) and path != "", "Invalid path passed to Profiler")
+        val_arg(isinstance(collapsed_path, (str, type(None))), "Invalid collapsed_path passed to Profiler")
+        val_arg(isinstance(interval, (int, float)) and interval > 0, "Invalid interval passed to Profiler")
+        val_arg(isinstance(top, int) and top > 0, "Invalid top passed to Profiler")
+
+        self.path = path
+        self.collapsed_path = collapsed_path
+        self.interval = interval
+        self.top = top
+
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.request_time = 0.0
+
+        self.samples = Counter()
+        self.sampling = False
+
+    def wrap_requestor(self, requestor):
+        """
+        Wrap a requestor to measure the wall clock time spent waiting on it
+        """
+
+        def timed_requestor(method, url, headers, payload):
+            start = time.perf_counter()
+            try:
+                return requestor(method, url, headers, payload)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    self.request_count += 1
+                    self.request_time += elapsed
+
+        return timed_requestor
+
+    def wrap_stream_requestor(self, requestor):
+        """
+        Wrap a streaming requestor to measure the wall clock time spent waiting
+        on it, including waits for each chunk of the body until it is
+        exhausted. Time the caller spends between chunks isn't counted.
+        """
+
+        def add_time(elapsed, requests=0):
+            with self.lock:
+                self.request_count += requests
+                self.request_time += elapsed
+
+        def timed_chunks(chunks):
+            iterator = iter(chunks)
+            while True:
+                start = time.perf_counter()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    add_time(time.perf_counter() - start)
+
+                yield chunk
+
+        def timed_stream_requestor(method, url, headers, payload):
+            start = time.perf_counter()
+            try:
+                chunks = requestor(method, url, headers, payload)
+            finally:
+                add_time(time.perf_counter() - start, requests=1)
+
+            return timed_chunks(chunks)
+
+        return timed_stream_requestor
+
+    def sample(self, thread_id):
+        """
+        Sample the stack of the thread until sampling stops, counting each
+        distinct stack in collapsed (root first, semicolon separated) form
+        """
+
+        while self.sampling:
+            frame = sys._current_frames().get(thread_id) # pylint: disable=protected-access
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+            time.sleep(self.interval)
+
+    def run(self, func, *args, **kwargs):
+        """
+        Call func under the profiler, writing the pstats (and collapsed stacks, if
+        requested) and reporting hot functions to stderr
+        """
+
+        profile = cProfile.Profile()
+
+        sampler = None
+        if self.collapsed_path is not None:
+            self.sampling = True
+            sampler = threading.Thread(target=self.sample, args=(threading.get_ident(),), daemon=True)
+            sampler.start()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+
+            if sampler is not None:
+                self.sampling = False
+                sampler.join()
+
+            self.report(profile, wall, cpu)
+
+    def report(self, profile, wall, cpu):
+        """
+        Write profile output files and display a summary on stderr
+        """
+
+        profile.dump_stats(self.path)
+
+        if self.collapsed_path is not None:
+            with open(self.collapsed_path, "w", encoding="utf-8") as file:
+                for stack, count in self.samples.items():
+                    file.write(f"{stack} {count}\n")
+
+        print(f"Profile written to {self.path}", file=sys.stderr)
+        if self.collapsed_path is not None:
+            print(f"Collapsed stacks written to {self.collapsed_path}", file=sys.stderr)
+
+        print(f"Wall time: {wall:.3f}s, CPU time: {cpu:.3f}s", file=sys.stderr)
+        print(f"Requestor wait: {self.request_time:.3f}s over {self.request_count} requests", file=sys.stderr)
+        print(f"Other (wall - requestor wait): {max(0.0, wall - self.request_time):.3f}s", file=sys.stderr)
+
+        stats = pstats.Stats(profile, stream=sys.stderr)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
@@ -0,0 +1,247 @@
+"""
+Helpers for working with price series returned by the history_basic endpoint
+"""
+
+import re
+import sys
+import csv
+import json
+import math
+import mmap
+import struct
+import logging
+
+from array import array
+
+from .common import val_arg, val_run
+from .exception import RuntimeException
+
+logger = logging.getLogger(__name__)
+
+# Binary series layout - a 32 byte header (magic, version, flags, count and
+# coin), followed by count little endian int64 timestamps (epoch milliseconds)
+# and then count little endian float64 prices. Consumers can map the arrays
+# directly, e.g. numpy.memmap(path, dtype="<i8", offset=32, shape=(count,))
+BIN_MAGIC = b"CSPH"
+BIN_VERSION = 1
+BIN_HEADER = struct.Struct("<4sHHQ16s")
+
+# A single [ts, price] element of a history_basic array - the first element,
+# then later elements with their leading separator
+SERIES_FIRST = re.compile(rb"\s*\[\s*([-+0-9.eE]+)\s*,\s*([-+0-9.eE]+|NaN|-?Infinity)\s*\]")
+SERIES_ITEM = re.compile(rb"\s*,\s*\[\s*([-+0-9.eE]+)\s*,\s*([-+0-9.eE]+|NaN|-?Infinity)\s*\]")
+SERIES_END = re.compile(rb"\s*\]\s*")
+
+# Longest incomplete element held between chunks before the content is
+# considered invalid
+SERIES_MAX_PENDING = 4096
+
+def parse_series(content):
+    """
+    Parse a history_basic style response ([[ts, price], ...]) in to separate
+    timestamp and price lists
+    """
+
+    # Validate incoming arguments
+    val_arg(isinstance(content, (str, bytes, list)), "Invalid content passed to parse_series")
+
+    parsed = content
+    if not isinstance(parsed, list):
+        parsed = json.loads(content)
+
+    val_run(isinstance(parsed, list), "Invalid price series - not a list")
+    val_run(all(isinstance(x, list) for x in parsed), "Invalid price series - Some items are not lists")
+    val_run(all(len(x) == 2 for x in parsed), "Invalid price series - Elements should have two items")
+
+    timestamps = [int(x[0]) for x in parsed]
+    prices = [x[1] for x in parsed]
+    val_run(all(not math.isnan(x) for x in prices), "Invalid price series - NaN values")
+
+    return timestamps, prices
+
+def iter_series(chunks):
+    """
+    Incrementally parse a history_basic style response from an iterable of
+    bytes (or str) chunks, yielding (ts, price) tuples as each element
+    completes. Only the incomplete tail of a chunk is held, so the full body,
+    its decoded text and the parsed lists never need to be in memory together.
+    """
+
+    pending = b""
+    started = False
+    pattern = SERIES_FIRST
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+
+        pending += chunk
+
+        if not started:
+            pending = pending.lstrip()
+            if pending == b"":
+                continue
+
+            val_run(pending[:1] == b"[", "Invalid price series - not a list")
+            pending = pending[1:]
+            started = True
+
+        position = 0
+        while True:
+            match = pattern.match(pending, position)
+            if match is None:
+                break
+
+            timestamp = match.group(1)
+            try:
+                item = int(timestamp) if timestamp.isdigit() else int(float(timestamp)), float(match.group(2))
+            except ValueError as e:
+                raise RuntimeException(f"Invalid price series - bad number in {match.group(0).strip().decode('ascii')}") from e
+
+            yield item
+
+            pattern = SERIES_ITEM
+            position = match.end()
+
+        pending = pending[position:]
+        val_run(len(pending) <= SERIES_MAX_PENDING, "Invalid price series - unexpected content")
+
+    val_run(started, "Invalid price series - not a list")
+    val_run(SERIES_END.fullmatch(pending) is not None, "Invalid price series - unexpected content")
+
+def load_series(path):
+    """
+    Load a price series from a file, as written by 'csutl price_history', in
+    either json or binary format
+    """
+
+    val_arg(isinstance(path, str) and path != "", "Invalid path passed to load_series")
+
+    with open(path, "rb") as file:
+        magic = file.read(len(BIN_MAGIC))
+
+    if magic == BIN_MAGIC:
+        return load_series_bin(path)
+
+    with open(path, "r", encoding="utf-8") as file:
+        return parse_series(file.read())
+
+def write_series_bin(file, timestamps, prices, coin=""):
+    """
+    Write a price series to a binary file object in the fixed binary layout
+    """
+
+    # Validate incoming arguments
+    val_arg(len(timestamps) == len(prices), "Mismatched timestamps and prices passed to write_series_bin")
+    val_arg(isinstance(coin, str) and len(coin.encode("ascii")) <= 16, "Invalid coin passed to write_series_bin")
+
+    ts_array = array("q", timestamps)
+    price_array = array("d", prices)
+
+    if sys.byteorder != "little":
+        ts_array.byteswap()
+        price_array.byteswap()
+
+    file.write(BIN_HEADER.pack(BIN_MAGIC, BIN_VERSION, 0, len(prices), coin.encode("ascii")))
+    file.write(ts_array.tobytes())
+    file.write(price_array.tobytes())
+
+def read_series_bin_header(buffer):
+    """
+    Parse and validate the header of a binary series, returning (count, coin)
+    """
+
+    val_run(len(buffer) >= BIN_HEADER.size, "Invalid binary series - truncated header")
+
+    magic, version, _, count, coin = BIN_HEADER.unpack_from(buffer)
+    val_run(magic == BIN_MAGIC, "Invalid binary series - bad magic")
+    val_run(version == BIN_VERSION, f"Unsupported binary series version: {version}")
+    val_run(len(buffer) >= BIN_HEADER.size + count * 16, "Invalid binary series - truncated data")
+
+    return count, coin.rstrip(b"\0").decode("ascii")
+
+def load_series_bin(path):
+    """
+    Load a binary price series, returning (timestamps, prices). The file is
+    memory mapped and the returned sequences are views on to the mapping, so
+    no parsing or copying takes place.
+    """
+
+    val_arg(isinstance(path, str) and path != "", "Invalid path passed to load_series_bin")
+
+    with open(path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    count, _ = read_series_bin_header(mapped)
+
+    ts_start = BIN_HEADER.size
+    price_start = ts_start + count * 8
+    price_end = price_start + count * 8
+
+    if sys.byteorder != "little":
+        # Views would be in the wrong byte order, so fall back to copies
+        timestamps = array("q", mapped[ts_start:price_start])
+        prices = array("d", mapped[price_start:price_end])
+        timestamps.byteswap()
+        prices.byteswap()
+        mapped.close()
+        return timestamps, prices
+
+    view = memoryview(mapped)
+
+    return view[ts_start:price_start].cast("q"), view[price_start:price_end].cast("d")
+
+def write_series_csv(file, timestamps, prices):
+    """
+    Stream a price series to a text file object as csv, with a header row
+    """
+
+    val_arg(len(timestamps) == len(prices), "Mismatched timestamps and prices passed to write_series_csv")
+
+    writer = csv.writer(file, lineterminator="\n")
+    writer.writerow(("timestamp", "price"))
+    writer.writerows(zip(timestamps, prices))
+
+def write_series_ndjson(file, timestamps, prices):
+    """
+    Stream a price series to a text file object as one json object per line
+    """
+
+    val_arg(len(timestamps) == len(prices), "Mismatched timestamps and prices passed to write_series_ndjson")
+
+    for timestamp, price in zip(timestamps, prices):
+        file.write(f'{{"timestamp":{timestamp},"price":{json.dumps(price)}}}\n')
+
+def build_candles(timestamps, prices, interval_ms):
+    """
+    Bucket a price series in to [ts, open, high, low, close, count] candles, where
+    ts is the start of the bucket. The series is processed in a single pass and
+    must be in timestamp order.
+    """
+
+    # Validate incoming arguments
+    val_arg(len(timestamps) == len(prices), "Mismatched timestamps and prices passed to build_candles")
+    val_arg(isinstance(interval_ms, int) and interval_ms > 0, "Invalid interval passed to build_candles")
+
+    candles = []
+    candle = None
+    bucket_end = None
+
+    for timestamp, price in zip(timestamps, prices):
+        if candle is not None and candle[0] <= timestamp < bucket_end:
+            if price > candle[2]:
+                candle[2] = price
+            if price < candle[3]:
+                candle[3] = price
+            candle[4] = price
+            candle[5] += 1
+            continue
+
+        val_run(candle is None or timestamp >= candle[0], "Price series is not in timestamp order")
+
+        bucket = timestamp - timestamp % interval_ms
+        bucket_end = bucket + interval_ms
+        candle = [bucket, price, price, price, price, 1]
+        candles.append(candle)
+
+    return candles
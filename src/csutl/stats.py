@@ -0,0 +1,809 @@
+"""
+Price statistics used by the price history stats output
+"""
+
+import bisect
+import math
+import random
+import statistics
+import logging
+
+from collections import deque
+
+from .common import val_arg, val_run
+
+logger = logging.getLogger(__name__)
+
+# Default periods for technical indicators
+INDICATOR_PERIODS = {
+    "sma": 20,
+    "ema": 20,
+    "rsi": 14,
+    "bbands": 20,
+    "roc": 12
+}
+
+def sorted_quantiles(data, n=4):
+    """
+    Cut points dividing already sorted data in to n intervals, matching the
+    default (exclusive) method of statistics.quantiles
+    """
+
+    count = len(data)
+    val_run(count >= 2, "Must have at least two data points for quantiles")
+
+    m = count + 1
+    result = []
+    for i in range(1, n):
+        j = i * m // n
+        j = 1 if j < 1 else count - 1 if j > count - 1 else j
+        delta = i * m - j * n
+        result.append((data[j - 1] * (n - delta) + data[j] * delta) / n)
+
+    return result
+
+def sorted_quantile(data, fraction):
+    """
+    Value at an arbitrary fraction (0 to 1) of already sorted data, with the
+    same (exclusive) interpolation as sorted_quantiles
+    """
+
+    count = len(data)
+    val_run(count >= 2, "Must have at least two data points for quantiles")
+
+    position = fraction * (count + 1)
+    j = int(position)
+    j = 1 if j < 1 else count - 1 if j > count - 1 else j
+
+    return data[j - 1] + (data[j] - data[j - 1]) * (position - j)
+
+def sorted_median(data):
+    """
+    Median of already sorted data, matching statistics.median
+    """
+
+    count = len(data)
+    val_run(count > 0, "No median for empty data")
+
+    i = count // 2
+    if count % 2 == 1:
+        return data[i]
+
+    return (data[i - 1] + data[i]) / 2
+
+def build_reference(reference_price, price_min, price_max, avg, median, quartiles, ten_quantiles, pstdev):
+    """
+    Build the reference section of the stats output for a reference price
+    """
+
+    width = price_max - price_min
+
+    # Quantile cut points are sorted, so the count below the reference is a
+    # binary search
+    ten_quantile_index = bisect.bisect_left(ten_quantiles, reference_price)
+    quartile_index = bisect.bisect_left(quartiles, reference_price)
+    pstdev_index = (reference_price - median) / pstdev
+    width_index = (reference_price - price_min) / width
+
+    return {
+        "reference_price": reference_price,
+        "quartile_index": quartile_index,
+        "ten_quantile_index": ten_quantile_index,
+        "width_index": width_index,
+        "pstdev_index": pstdev_index,
+        "avg_price_diff_pct": (avg / reference_price - 1)*100,
+        "med_price_diff_pct": (median / reference_price - 1)*100,
+        "max_price_diff_pct": (price_max / reference_price - 1)*100
+    }
+
+def build_stats_response(price_first, price_last, price_min, price_max, avg, median, quartiles,
+                         ten_quantiles, pstdev, reference_price=None, reference_prices=None, requested=None):
+    """
+    Assemble the stats output from precomputed summary values
+
+    reference_prices adds a list of references, evaluated against the same
+    summary. requested is a list of (fraction, value) pairs for requested
+    quantiles.
+    """
+
+    width = price_max - price_min
+
+    growth = price_last - price_first
+    growth_pct = growth / price_first * 100
+
+    # Indexes
+    if reference_price is None:
+        reference_price = price_last
+
+    response = {
+        "first": price_first,
+        "last": price_last,
+        "min": price_min,
+        "max": price_max,
+        "avg": avg,
+        "med": median,
+        "width": width,
+        "growth": growth,
+        "growth_pct": growth_pct,
+        "quartiles": quartiles,
+        "ten_quantiles": ten_quantiles,
+        "pstdev": pstdev,
+        "reference": build_reference(reference_price, price_min, price_max, avg, median,
+            quartiles, ten_quantiles, pstdev)
+    }
+
+    if requested is not None:
+        response["requested_quantiles"] = {str(fraction): value for fraction, value in requested}
+
+    if reference_prices is not None:
+        response["references"] = [build_reference(x, price_min, price_max, avg, median, quartiles, ten_quantiles, pstdev)
+            for x in reference_prices]
+
+    return response
+
+def validate_quantiles(quantiles):
+    """
+    Check requested quantiles are a list of fractions between 0 and 1
+    """
+
+    val_arg(quantiles is None or (isinstance(quantiles, list) and all(isinstance(x, (int, float)) and 0 < x < 1 for x in quantiles)),
+        "Invalid quantiles - must be fractions between 0 and 1")
+
+def validate_reference_prices(reference_prices):
+    """
+    Check reference prices are a list of positive prices
+    """
+
+    val_arg(reference_prices is None or (isinstance(reference_prices, list) and len(reference_prices) > 0
+        and all(isinstance(x, (int, float)) and x > 0 for x in reference_prices)), "Invalid reference prices")
+
+def build_stats(prices, reference_price=None, reference_prices=None, quantiles=None):
+    """
+    Calculate the stats output for a list of prices
+
+    Order statistics all come from a single sort of the prices, including any
+    requested quantiles (fractions between 0 and 1)
+    """
+
+    # Validate incoming arguments
+    val_arg(isinstance(reference_price, (int, float, type(None))), "Invalid reference price passed to build_stats")
+    validate_reference_prices(reference_prices)
+    validate_quantiles(quantiles)
+    val_run(len(prices) > 0, "No prices to calculate stats for")
+    val_run(all(not math.isnan(x) for x in prices), "Invalid prices - NaN values")
+
+    data = sorted(prices)
+
+    requested = None
+    if quantiles is not None:
+        requested = [(x, sorted_quantile(data, x)) for x in quantiles]
+
+    return build_stats_response(
+        prices[0],
+        prices[-1],
+        data[0],
+        data[-1],
+        statistics.mean(prices),
+        sorted_median(data),
+        sorted_quantiles(data),
+        sorted_quantiles(data, n=10),
+        statistics.pstdev(prices),
+        reference_price=reference_price,
+        reference_prices=reference_prices,
+        requested=requested
+    )
+
+class SortedBlocks:
+    """
+    Sorted multiset of values, held as a list of sorted blocks of bounded size
+
+    Values are located by bisecting the block maximums and then the block, so an
+    add or remove only shifts values within a single block. Block lengths are
+    kept in a Fenwick tree so the value at a sorted position is found in
+    O(log n), and the tree is only rebuilt when a block is split or emptied.
+    """
+
+    # Blocks are split once they reach twice this size
+    LOAD = 256
+
+    def __init__(self):
+        self.blocks = []
+        self.maxes = []
+        self.tree = [0]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def rebuild(self):
+        """
+        Rebuild the Fenwick tree of block lengths after the blocks change
+        """
+
+        count = len(self.blocks)
+        tree = [0] * (count + 1)
+        for i, block in enumerate(self.blocks, 1):
+            tree[i] += len(block)
+            parent = i + (i & -i)
+            if parent <= count:
+                tree[parent] += tree[i]
+
+        self.tree = tree
+
+    def update(self, pos, delta):
+        """
+        Adjust the length recorded for the block at pos
+        """
+
+        tree = self.tree
+        count = len(self.blocks)
+        i = pos + 1
+        while i <= count:
+            tree[i] += delta
+            i += i & -i
+
+    def add(self, value):
+        """
+        Insert a value, keeping the blocks sorted
+        """
+
+        self.size += 1
+
+        if not self.blocks:
+            self.blocks.append([value])
+            self.maxes.append(value)
+            self.rebuild()
+            return
+
+        pos = bisect.bisect_left(self.maxes, value)
+        if pos == len(self.maxes):
+            pos -= 1
+
+        block = self.blocks[pos]
+        bisect.insort(block, value)
+        self.maxes[pos] = block[-1]
+
+        if len(block) < 2 * self.LOAD:
+            self.update(pos, 1)
+            return
+
+        self.blocks[pos:pos + 1] = [block[:self.LOAD], block[self.LOAD:]]
+        self.maxes[pos:pos + 1] = [block[self.LOAD - 1], block[-1]]
+        self.rebuild()
+
+    def remove(self, value):
+        """
+        Remove a single occurrence of value
+        """
+
+        pos = bisect.bisect_left(self.maxes, value)
+        val_run(pos < len(self.maxes), "Value not present in SortedBlocks")
+
+        block = self.blocks[pos]
+        i = bisect.bisect_left(block, value)
+        val_run(block[i] == value, "Value not present in SortedBlocks")
+
+        del block[i]
+        self.size -= 1
+
+        if block:
+            self.maxes[pos] = block[-1]
+            self.update(pos, -1)
+            return
+
+        del self.blocks[pos]
+        del self.maxes[pos]
+        self.rebuild()
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+
+        if index < 0 or index >= self.size:
+            raise IndexError("SortedBlocks index out of range")
+
+        # Descend the Fenwick tree to the block holding the index
+        tree = self.tree
+        count = len(self.blocks)
+        pos = 0
+        step = 1 << count.bit_length()
+        while step:
+            upper = pos + step
+            if upper <= count and tree[upper] <= index:
+                pos = upper
+                index -= tree[upper]
+            step >>= 1
+
+        return self.blocks[pos][index]
+
+class RollingStats:
+    """
+    Sliding window price statistics, updated incrementally as samples are pushed
+    and evicted
+
+    Mean and population standard deviation are maintained with Welford updates.
+    Order statistics (min, max, median, quantiles) come from a SortedBlocks copy
+    of the window, so each push or evict is O(log n) rather than a full sort.
+    Callers needing only the mean can pass ordered=False to skip the sorted copy.
+    """
+
+    def __init__(self, width_ms=None, ordered=True):
+        val_arg(width_ms is None or (isinstance(width_ms, int) and width_ms > 0), "Invalid width passed to RollingStats")
+
+        self.width_ms = width_ms
+        self.samples = deque()
+        self.ordered = SortedBlocks() if ordered else None
+        self.avg = 0.0
+        self.m2 = 0.0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def push(self, price, timestamp=None):
+        """
+        Add a sample to the window. If the window has a width, samples older than
+        the width relative to timestamp are evicted.
+        """
+
+        val_arg(isinstance(price, (int, float)) and not math.isnan(price), "Invalid price passed to RollingStats.push")
+        val_arg(self.width_ms is None or timestamp is not None, "Timestamp required for a time based window")
+
+        self.samples.append((timestamp, price))
+        if self.ordered is not None:
+            self.ordered.add(price)
+
+        count = len(self.samples)
+        delta = price - self.avg
+        self.avg += delta / count
+        self.m2 += delta * (price - self.avg)
+
+        if self.width_ms is not None:
+            self.evict_before(timestamp - self.width_ms)
+
+    def evict(self):
+        """
+        Remove the oldest sample from the window
+        """
+
+        val_run(len(self.samples) > 0, "Evict from empty RollingStats")
+
+        _, price = self.samples.popleft()
+        if self.ordered is not None:
+            self.ordered.remove(price)
+
+        count = len(self.samples)
+        if count == 0:
+            self.avg = 0.0
+            self.m2 = 0.0
+            return
+
+        delta = price - self.avg
+        self.avg -= delta / count
+        self.m2 -= delta * (price - self.avg)
+
+        # Guard against drift below zero from floating point error
+        if self.m2 < 0:
+            self.m2 = 0.0
+
+    def evict_before(self, timestamp):
+        """
+        Remove samples with a timestamp older than timestamp
+        """
+
+        samples = self.samples
+        while samples and samples[0][0] < timestamp:
+            self.evict()
+
+    def mean(self):
+        """
+        Average price across the window
+        """
+
+        val_run(len(self.samples) > 0, "Mean requested for empty window")
+
+        return self.avg
+
+    def pstdev(self):
+        """
+        Population standard deviation of the window
+        """
+
+        val_run(len(self.samples) > 0, "No pstdev for empty RollingStats")
+
+        return math.sqrt(self.m2 / len(self.samples))
+
+    def sorted_window(self):
+        """
+        Sorted copy of the window, for order statistics
+        """
+
+        val_run(self.ordered is not None, "Order statistics not maintained for this RollingStats")
+
+        return self.ordered
+
+    def quantiles(self, n=4):
+        """
+        Quantile cut points for the window, as per statistics.quantiles
+        """
+
+        return sorted_quantiles(self.sorted_window(), n)
+
+    def median(self):
+        """
+        Median of the window
+        """
+
+        return sorted_median(self.sorted_window())
+
+    def stats(self, reference_price=None):
+        """
+        Stats output for the current window, in the same form as build_stats
+        """
+
+        val_arg(isinstance(reference_price, (int, float, type(None))), "Invalid reference price passed to RollingStats.stats")
+        val_run(len(self.samples) > 0, "No stats for empty RollingStats")
+
+        ordered = self.sorted_window()
+
+        return build_stats_response(
+            self.samples[0][1],
+            self.samples[-1][1],
+            ordered[0],
+            ordered[-1],
+            self.avg,
+            self.median(),
+            self.quantiles(),
+            self.quantiles(n=10),
+            self.pstdev(),
+            reference_price=reference_price
+        )
+
+class KllSketch:
+    """
+    KLL streaming quantile sketch (Karnin, Lang and Liberty)
+
+    Memory is bounded to roughly 3k retained items regardless of stream length.
+    With the default k of 200, quantile ranks are within about 1.65% of the true
+    rank (normalised, at 99% confidence).
+    """
+
+    # Normalised rank error at 99% confidence for k=200, as per the DataSketches KLL analysis
+    RANK_ERROR_K200 = 0.0165
+
+    def __init__(self, k=200, seed=0):
+        val_arg(isinstance(k, int) and k >= 8, "Invalid k passed to KllSketch")
+
+        self.k = k
+        self.count = 0
+        self.compactors = [[]]
+        self.retained = 0
+        self.max_size = self.capacity(0)
+        self.random = random.Random(seed)
+
+    def rank_error(self):
+        """
+        Approximate normalised rank error for this sketch size
+        """
+
+        return self.RANK_ERROR_K200 * 200 / self.k
+
+    def capacity(self, level):
+        """
+        Capacity of the compactor at level, shrinking geometrically below the top level
+        """
+
+        depth = len(self.compactors) - level - 1
+
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, value):
+        """
+        Add a value to the sketch
+        """
+
+        self.compactors[0].append(value)
+        self.count += 1
+        self.retained += 1
+
+        if self.retained >= self.max_size:
+            self.compress()
+
+    def compress(self):
+        """
+        Compact the first over capacity level, promoting every other item to the
+        level above with double the weight
+        """
+
+        for level, compactor in enumerate(self.compactors):
+            if len(compactor) < self.capacity(level):
+                continue
+
+            if level + 1 == len(self.compactors):
+                self.compactors.append([])
+                self.max_size = sum(self.capacity(x) for x in range(len(self.compactors)))
+
+            compactor.sort()
+
+            # An odd item out stays at this level
+            keep = []
+            if len(compactor) % 2 == 1:
+                keep.append(compactor.pop())
+
+            promoted = compactor[self.random.randint(0, 1)::2]
+            self.compactors[level + 1].extend(promoted)
+            self.retained -= len(compactor) - len(promoted)
+
+            compactor[:] = keep
+            return
+
+    def quantiles(self, fractions):
+        """
+        Approximate values at each of the supplied fractions (0 to 1) of the rank
+        """
+
+        val_run(self.count > 0, "No quantiles for empty KllSketch")
+
+        weighted = sorted((value, 1 << level) for level, compactor in enumerate(self.compactors) for value in compactor)
+        total = sum(x[1] for x in weighted)
+
+        result = []
+        for fraction in fractions:
+            target = fraction * total
+            cumulative = 0
+            value = weighted[-1][0]
+            for item, weight in weighted:
+                cumulative += weight
+                if cumulative >= target:
+                    value = item
+                    break
+
+            result.append(value)
+
+        return result
+
+def build_stats_approx(prices, reference_price=None, k=200, reference_prices=None, quantiles=None):
+    """
+    Calculate the stats output from an iterable of prices in a single pass with
+    bounded memory. Median and quantiles (including any requested quantiles)
+    are approximated with a KLL sketch.
+    """
+
+    # Validate incoming arguments
+    val_arg(isinstance(reference_price, (int, float, type(None))), "Invalid reference price passed to build_stats_approx")
+    validate_reference_prices(reference_prices)
+    validate_quantiles(quantiles)
+
+    sketch = KllSketch(k=k)
+
+    count = 0
+    mean = 0.0
+    m2 = 0.0
+    price_first = None
+    price_last = None
+    price_min = math.inf
+    price_max = -math.inf
+
+    for price in prices:
+        val_run(not math.isnan(price), "Invalid prices - NaN values")
+
+        if price_first is None:
+            price_first = price
+        price_last = price
+
+        if price < price_min:
+            price_min = price
+        if price > price_max:
+            price_max = price
+
+        count += 1
+        delta = price - mean
+        mean += delta / count
+        m2 += delta * (price - mean)
+
+        sketch.update(price)
+
+    val_run(count > 0, "No prices to calculate stats for")
+
+    requested = quantiles or []
+    estimates = sketch.quantiles([0.5] + [x / 4 for x in range(1, 4)] + [x / 10 for x in range(1, 10)] + requested)
+
+    response = build_stats_response(
+        price_first,
+        price_last,
+        price_min,
+        price_max,
+        mean,
+        estimates[0],
+        estimates[1:4],
+        estimates[4:13],
+        math.sqrt(m2 / count),
+        reference_price=reference_price,
+        reference_prices=reference_prices,
+        requested=None if quantiles is None else list(zip(quantiles, estimates[13:]))
+    )
+
+    response["approx"] = {
+        "method": "kll",
+        "k": k,
+        "rank_error": sketch.rank_error()
+    }
+
+    return response
+
+def parse_indicators(value):
+    """
+    Parse a comma separated list of indicators, each optionally with a period
+    (e.g. sma,ema:50,rsi:7), in to a list of (name, period) tuples
+    """
+
+    val_arg(isinstance(value, str) and value != "", "Invalid indicators supplied")
+
+    result = []
+    for item in value.split(","):
+        item = item.strip().lower()
+        if item == "":
+            continue
+
+        name, _, period = item.partition(":")
+        val_arg(name in INDICATOR_PERIODS, f"Unknown indicator: {name}")
+
+        if period == "":
+            period = INDICATOR_PERIODS[name]
+        else:
+            val_arg(period.isdigit() and int(period) > 0, f"Invalid period for indicator: {item}")
+            period = int(period)
+
+        result.append((name, period))
+
+    return result
+
+def indicator_key(name, period):
+    """
+    Key for an indicator in the indicators output
+    """
+
+    return f"{name}_{period}"
+
+def rsi_value(avg_gain, avg_loss):
+    """
+    Relative strength index from the smoothed average gain and loss
+    """
+
+    if avg_loss == 0:
+        return 100.0 if avg_gain > 0 else 50.0
+
+    return 100 - 100 / (1 + avg_gain / avg_loss)
+
+def build_indicators(prices, indicators):
+    """
+    Calculate the latest value of each technical indicator for a list of prices
+
+    sma, bbands (2 standard deviations) and roc use the last period prices. ema,
+    and the Wilder smoothed averages for rsi, are seeded with the first value of
+    the series. Indicators with a period longer than the series are None.
+    """
+
+    val_arg(isinstance(indicators, list), "Invalid indicators passed to build_indicators")
+    val_run(len(prices) > 0, "No prices to calculate indicators for")
+
+    # NumPy is optional - indicators are vectorised when it is available. It is
+    # imported on first use, as most commands never calculate indicators
+    try:
+        import numpy # pylint: disable=import-outside-toplevel
+    except ImportError:
+        numpy = None
+
+    if numpy is not None:
+        return _build_indicators_numpy(prices, indicators)
+
+    count = len(prices)
+
+    # Recursive indicators are all updated in a single pass over the series
+    ema_alphas = {period: 2 / (period + 1) for name, period in indicators if name == "ema"}
+    rsi_alphas = {period: 1 / period for name, period in indicators if name == "rsi"}
+
+    emas = {period: prices[0] for period in ema_alphas}
+    gains = {period: None for period in rsi_alphas}
+    losses = {period: None for period in rsi_alphas}
+
+    if ema_alphas or rsi_alphas:
+        previous = prices[0]
+        for price in prices[1:]:
+            for period, alpha in ema_alphas.items():
+                emas[period] += alpha * (price - emas[period])
+
+            change = price - previous
+            gain = change if change > 0 else 0.0
+            loss = -change if change < 0 else 0.0
+            for period, alpha in rsi_alphas.items():
+                if gains[period] is None:
+                    gains[period] = gain
+                    losses[period] = loss
+                else:
+                    gains[period] += alpha * (gain - gains[period])
+                    losses[period] += alpha * (loss - losses[period])
+
+            previous = price
+
+    result = {}
+    for name, period in indicators:
+        key = indicator_key(name, period)
+
+        if name == "ema":
+            result[key] = emas[period] if count >= period else None
+        elif name == "rsi":
+            result[key] = rsi_value(gains[period], losses[period]) if count > period else None
+        elif count < period or (name == "roc" and count <= period):
+            result[key] = None
+        elif name == "sma":
+            result[key] = math.fsum(prices[-period:]) / period
+        elif name == "bbands":
+            window = prices[-period:]
+            middle = math.fsum(window) / period
+            deviation = math.sqrt(math.fsum((x - middle) ** 2 for x in window) / period)
+            result[key] = {
+                "middle": middle,
+                "upper": middle + 2 * deviation,
+                "lower": middle - 2 * deviation
+            }
+        elif name == "roc":
+            result[key] = (prices[-1] / prices[-1 - period] - 1) * 100
+
+    return result
+
+def _ewm_last(values, alpha):
+    """
+    Last value of an exponentially weighted average seeded with the first value,
+    as a single weighted sum
+    """
+
+    import numpy # pylint: disable=import-outside-toplevel
+
+    count = len(values)
+    weights = alpha * (1 - alpha) ** numpy.arange(count - 1, -1, -1, dtype=float)
+    weights[0] = (1 - alpha) ** (count - 1)
+
+    return float(numpy.dot(weights, values))
+
+def _build_indicators_numpy(prices, indicators):
+    """
+    Vectorised implementation of build_indicators
+    """
+
+    import numpy # pylint: disable=import-outside-toplevel
+
+    values = numpy.asarray(prices, dtype=float)
+    count = len(values)
+
+    changes = numpy.diff(values)
+    gains = numpy.where(changes > 0, changes, 0.0)
+    losses = numpy.where(changes < 0, -changes, 0.0)
+
+    result = {}
+    for name, period in indicators:
+        key = indicator_key(name, period)
+
+        if name == "ema":
+            result[key] = _ewm_last(values, 2 / (period + 1)) if count >= period else None
+        elif name == "rsi":
+            if count > period:
+                result[key] = rsi_value(_ewm_last(gains, 1 / period), _ewm_last(losses, 1 / period))
+            else:
+                result[key] = None
+        elif count < period or (name == "roc" and count <= period):
+            result[key] = None
+        elif name == "sma":
+            result[key] = float(values[-period:].mean())
+        elif name == "bbands":
+            window = values[-period:]
+            middle = float(window.mean())
+            deviation = float(window.std())
+            result[key] = {
+                "middle": middle,
+                "upper": middle + 2 * deviation,
+                "lower": middle - 2 * deviation
+            }
+        elif name == "roc":
+            result[key] = float((values[-1] / values[-1 - period] - 1) * 100)
+
+    return result
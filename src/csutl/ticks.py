@@ -0,0 +1,515 @@
+"""
+Append-only local store of latest price (bid/ask/last) snapshots
+"""
+
+import os
+import re
+import sys
+import json
+import zlib
+import struct
+import bisect
+import logging
+
+from array import array
+
+from .common import val_arg, val_run
+
+logger = logging.getLogger(__name__)
+
+# Segment layout - an 8 byte header (magic, version, flags), followed by
+# records. Each record has a 17 byte header (type, payload length, crc32 of the
+# payload and timestamp in epoch milliseconds) and a payload.
+#
+# Coin records ("C") assign segment local ids to coin names, as (id, name
+# length, name) entries. Snapshot records ("S") hold (id, bid, ask, last)
+# entries for only the coins that changed since the previous snapshot in the
+# segment, so the first snapshot of a segment is complete and segments can be
+# read on their own.
+SEGMENT_MAGIC = b"CSTK"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sHH")
+RECORD_HEADER = struct.Struct("<BIIq")
+COIN_ENTRY = struct.Struct("<HB")
+TICK_ENTRY = struct.Struct("<Hddd")
+
+RECORD_COINS = ord("C")
+RECORD_SNAPSHOT = ord("S")
+
+# Index layout, written alongside a segment once it is sealed - a 24 byte header
+# (magic, version, flags, snapshot count, coin count), the snapshot timestamps
+# (int64) and offsets (uint64), then for each coin its name, segment id, the
+# number of snapshots where it changed and those snapshot numbers (uint32)
+INDEX_MAGIC = b"CSTI"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<4sHHQQ")
+INDEX_COIN = struct.Struct("<BHI")
+
+SEGMENT_NAME = re.compile(r"ticks-(\d{16})\.log")
+
+# Default segment size before rotating to a new segment
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+
+def default_tick_dir():
+    """
+    Default location for the tick store
+    """
+
+    path = os.environ.get("CSUTL_TICK_DIR")
+    if path is not None and path != "":
+        return path
+
+    base = os.environ.get("XDG_DATA_HOME", os.path.join(os.path.expanduser("~"), ".local", "share"))
+
+    return os.path.join(base, "csutl", "ticks")
+
+def parse_latest(response):
+    """
+    Convert a /pubapi/v2/latest response in to a dict of coin to (bid, ask,
+    last) floats
+    """
+
+    content = response
+    if isinstance(content, (str, bytes)):
+        content = json.loads(content)
+
+    val_run(isinstance(content.get("prices"), dict), "API response missing 'prices' key")
+
+    ticks = {}
+    for coin, price in content["prices"].items():
+        try:
+            ticks[coin.upper()] = (float(price["bid"]), float(price["ask"]), float(price["last"]))
+        except (KeyError, TypeError, ValueError):
+            logger.debug("Skipping invalid latest price for %s", coin)
+
+    return ticks
+
+def to_little(values):
+    """
+    Array in little endian byte order, for writing
+    """
+
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+
+    return values
+
+def from_little(typecode, content):
+    """
+    Array from little endian bytes
+    """
+
+    values = array(typecode, content)
+    if sys.byteorder != "little":
+        values.byteswap()
+
+    return values
+
+class SegmentIndex:
+    """
+    Time index for one segment - snapshot timestamps and offsets, and for each
+    coin its segment id and the snapshots where its prices changed
+    """
+
+    def __init__(self):
+        self.timestamps = array("q")
+        self.offsets = array("Q")
+        self.coin_ids = {}
+        self.coins = {}
+
+    def add(self, timestamp, offset, coins):
+        snapshot = len(self.timestamps)
+        self.timestamps.append(timestamp)
+        self.offsets.append(offset)
+
+        for coin in coins:
+            self.coins.setdefault(coin, array("I")).append(snapshot)
+
+    def write(self, path):
+        """
+        Write the index atomically to path
+        """
+
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as file:
+            file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, len(self.timestamps), len(self.coins)))
+            file.write(to_little(self.timestamps).tobytes())
+            file.write(to_little(self.offsets).tobytes())
+
+            for coin, snapshots in self.coins.items():
+                name = coin.encode("ascii")
+                file.write(INDEX_COIN.pack(len(name), self.coin_ids[coin], len(snapshots)))
+                file.write(name)
+                file.write(to_little(snapshots).tobytes())
+
+        os.replace(temp_path, path)
+
+    @classmethod
+    def read(cls, path):
+        """
+        Read an index written by write
+        """
+
+        with open(path, "rb") as file:
+            content = file.read()
+
+        val_run(len(content) >= INDEX_HEADER.size, "Invalid tick index - truncated header")
+        magic, version, _, count, coin_count = INDEX_HEADER.unpack_from(content)
+        val_run(magic == INDEX_MAGIC, "Invalid tick index - bad magic")
+        val_run(version == INDEX_VERSION, f"Unsupported tick index version: {version}")
+
+        index = cls()
+        position = INDEX_HEADER.size
+        index.timestamps = from_little("q", content[position:position + count * 8])
+        position += count * 8
+        index.offsets = from_little("Q", content[position:position + count * 8])
+        position += count * 8
+
+        for _ in range(coin_count):
+            name_length, coin_id, snapshot_count = INDEX_COIN.unpack_from(content, position)
+            position += INDEX_COIN.size
+            name = content[position:position + name_length].decode("ascii")
+            position += name_length
+            index.coin_ids[name] = coin_id
+            index.coins[name] = from_little("I", content[position:position + snapshot_count * 4])
+            position += snapshot_count * 4
+
+        val_run(len(index.offsets) == count and position == len(content), "Invalid tick index - truncated data")
+
+        return index
+
+def read_records(file):
+    """
+    Read the records of a segment from the current position, yielding
+    (offset, type, timestamp, payload). Reading stops at the first incomplete or
+    corrupt record, as left by an interrupted write.
+    """
+
+    while True:
+        offset = file.tell()
+
+        header = file.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+
+        record_type, length, crc, timestamp = RECORD_HEADER.unpack(header)
+        payload = file.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc or record_type not in (RECORD_COINS, RECORD_SNAPSHOT):
+            logger.debug("Incomplete tick record at offset %s of %s", offset, file.name)
+            return
+
+        yield offset, record_type, timestamp, payload
+
+def read_coins(payload):
+    """
+    Coin id assignments from a coin record payload
+    """
+
+    coins = {}
+    position = 0
+    while position < len(payload):
+        coin_id, name_length = COIN_ENTRY.unpack_from(payload, position)
+        position += COIN_ENTRY.size
+        coins[coin_id] = payload[position:position + name_length].decode("ascii")
+        position += name_length
+
+    return coins
+
+def scan_segment(path):
+    """
+    Rebuild the index of a segment from its records, returning (index, end),
+    where end is the offset after the last complete record
+    """
+
+    index = SegmentIndex()
+    names = {}
+
+    with open(path, "rb") as file:
+        header = file.read(SEGMENT_HEADER.size)
+        val_run(len(header) == SEGMENT_HEADER.size, f"Invalid tick segment - truncated header: {path}")
+        magic, version, _ = SEGMENT_HEADER.unpack(header)
+        val_run(magic == SEGMENT_MAGIC, f"Invalid tick segment - bad magic: {path}")
+        val_run(version == SEGMENT_VERSION, f"Unsupported tick segment version: {version}")
+
+        end = file.tell()
+        for offset, record_type, timestamp, payload in read_records(file):
+            if record_type == RECORD_COINS:
+                coins = read_coins(payload)
+                names.update(coins)
+                index.coin_ids.update({name: coin_id for coin_id, name in coins.items()})
+            else:
+                index.add(timestamp, offset, [names[x[0]] for x in TICK_ENTRY.iter_unpack(payload)])
+
+            end = file.tell()
+
+    return index, end
+
+class TickStore:
+    """
+    Latest price snapshots for all coins, appended to size rotated segments in
+    a directory
+
+    A segment is named by the timestamp of its first snapshot, so a time range
+    maps to segments by name. Each sealed segment has an index file recording,
+    per coin, the snapshots where that coin changed, so a range query for a coin
+    only reads those records. The segment being written is indexed in memory,
+    or scanned when read by another process.
+
+    Only one recorder should append to a directory at a time.
+    """
+
+    def __init__(self, path=None, segment_bytes=DEFAULT_SEGMENT_BYTES, keep=None):
+        val_arg(isinstance(path, (str, type(None))), "Invalid path passed to TickStore")
+        val_arg(isinstance(segment_bytes, int) and segment_bytes > 0, "Invalid segment_bytes passed to TickStore")
+        val_arg(keep is None or (isinstance(keep, int) and keep > 0), "Invalid keep passed to TickStore")
+
+        if path is None:
+            path = default_tick_dir()
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.keep = keep
+
+        # Segment being appended to, with its last written prices and in memory
+        # index
+        self.file = None
+        self.segment_path = None
+        self.last = {}
+        self.index = None
+        self.last_timestamp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def segments(self):
+        """
+        Segment paths in time order, with the timestamp of their first snapshot
+        """
+
+        segments = []
+        for name in os.listdir(self.path):
+            match = SEGMENT_NAME.fullmatch(name)
+            if match is not None:
+                segments.append((int(match.group(1)), os.path.join(self.path, name)))
+
+        return sorted(segments)
+
+    def seal(self):
+        """
+        Write the index for the current segment and close it
+        """
+
+        if self.file is None:
+            return
+
+        self.file.close()
+        self.index.write(self.segment_path + ".idx")
+
+        logger.debug("Sealed tick segment %s with %s snapshots", self.segment_path, len(self.index.timestamps))
+
+        self.file = None
+        self.segment_path = None
+        self.index = None
+
+    def close(self):
+        self.seal()
+
+    def recover(self):
+        """
+        Seal segments left without an index by an interrupted recorder, dropping
+        any incomplete record at the end
+        """
+
+        for _, path in self.segments():
+            if os.path.exists(path + ".idx"):
+                continue
+
+            # Nothing was recorded before the segment header completed
+            if os.path.getsize(path) < SEGMENT_HEADER.size:
+                os.unlink(path)
+                continue
+
+            index, end = scan_segment(path)
+            if end < os.path.getsize(path):
+                logger.warning("Dropping incomplete tick record at offset %s of %s", end, path)
+                os.truncate(path, end)
+
+            index.write(path + ".idx")
+            logger.info("Recovered tick segment %s with %s snapshots", path, len(index.timestamps))
+
+    def open_segment(self, timestamp):
+        """
+        Start a new segment from a snapshot at timestamp
+        """
+
+        self.recover()
+
+        # Segment names must increase, even if the clock went backwards
+        segments = self.segments()
+        if segments:
+            val_run(timestamp > segments[-1][0], "Snapshot timestamp is not after the latest tick segment")
+
+        self.segment_path = os.path.join(self.path, f"ticks-{timestamp:016d}.log")
+        self.file = open(self.segment_path, "xb") # pylint: disable=consider-using-with
+        self.file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, 0))
+
+        self.last = {}
+        self.index = SegmentIndex()
+
+        self.prune()
+
+    def prune(self):
+        """
+        Remove the oldest segments beyond keep
+        """
+
+        if self.keep is None:
+            return
+
+        segments = self.segments()
+        for _, path in segments[:max(0, len(segments) - self.keep)]:
+            os.unlink(path)
+            if os.path.exists(path + ".idx"):
+                os.unlink(path + ".idx")
+
+            logger.info("Removed tick segment %s", path)
+
+    def write_record(self, record_type, timestamp, payload):
+        self.file.write(RECORD_HEADER.pack(record_type, len(payload), zlib.crc32(payload), timestamp))
+        self.file.write(payload)
+
+    def append(self, timestamp, ticks):
+        """
+        Append a snapshot of ticks (a dict of coin to (bid, ask, last)) taken at
+        timestamp (epoch milliseconds). Returns the number of coins that changed.
+        """
+
+        val_arg(isinstance(timestamp, int) and timestamp > 0, "Invalid timestamp passed to TickStore.append")
+        val_arg(isinstance(ticks, dict), "Invalid ticks passed to TickStore.append")
+
+        val_run(self.last_timestamp is None or timestamp > self.last_timestamp, "Snapshot timestamp is not after the previous snapshot")
+
+        if self.file is None:
+            self.open_segment(timestamp)
+
+        changed = sorted(coin for coin, values in ticks.items() if self.last.get(coin) != tuple(values))
+
+        # Coins not seen before in this segment are assigned ids first
+        coin_ids = self.index.coin_ids
+        new_coins = [x for x in changed if x not in coin_ids]
+        if new_coins:
+            payload = bytearray()
+            for coin in new_coins:
+                name = coin.encode("ascii")
+                val_arg(len(name) < 256, f"Invalid coin passed to TickStore.append: {coin}")
+
+                coin_ids[coin] = len(coin_ids)
+                payload += COIN_ENTRY.pack(coin_ids[coin], len(name))
+                payload += name
+
+            self.write_record(RECORD_COINS, 0, bytes(payload))
+
+        offset = self.file.tell()
+        payload = b"".join(TICK_ENTRY.pack(coin_ids[coin], *ticks[coin]) for coin in changed)
+        self.write_record(RECORD_SNAPSHOT, timestamp, payload)
+        self.file.flush()
+
+        for coin in changed:
+            self.last[coin] = tuple(ticks[coin])
+        self.index.add(timestamp, offset, changed)
+        self.last_timestamp = timestamp
+
+        if self.file.tell() >= self.segment_bytes:
+            self.seal()
+
+        return len(changed)
+
+    def segment_index(self, path):
+        """
+        Index for a segment, from its index file, the in memory index for the
+        segment being written, or a scan of the segment
+        """
+
+        if path == self.segment_path:
+            return self.index
+
+        if os.path.exists(path + ".idx"):
+            return SegmentIndex.read(path + ".idx")
+
+        index, _ = scan_segment(path)
+
+        return index
+
+    def query(self, coin, start=None, end=None):
+        """
+        Ticks for a coin from start to end (inclusive, epoch milliseconds), as a
+        list of (timestamp, bid, ask, last)
+
+        Only snapshots where the coin's prices changed are stored, so the first
+        tick is the last change at or before start, where there is one in the
+        same segment, giving the prices in effect at start.
+        """
+
+        val_arg(isinstance(coin, str) and coin != "", "Invalid coin passed to TickStore.query")
+        val_arg(isinstance(start, (int, type(None))), "Invalid start passed to TickStore.query")
+        val_arg(isinstance(end, (int, type(None))), "Invalid end passed to TickStore.query")
+
+        coin = coin.upper()
+        segments = self.segments()
+
+        # Segments that may hold snapshots in range - from the last segment
+        # starting at or before start, up to the last starting at or before end
+        first = 0
+        if start is not None:
+            first = max(0, bisect.bisect_right([x[0] for x in segments], start) - 1)
+
+        ticks = []
+        for segment_start, path in segments[first:]:
+            if end is not None and segment_start > end:
+                break
+
+            index = self.segment_index(path)
+            snapshots = index.coins.get(coin)
+            if not snapshots:
+                continue
+
+            # Snapshot numbers are in time order, so the range is found by
+            # bisecting on their timestamps. Later segments start after start,
+            # so only the first can hold a tick from before it.
+            def snapshot_time(snapshot, index=index):
+                return index.timestamps[snapshot]
+
+            low = 0
+            if start is not None:
+                low = max(0, bisect.bisect_right(snapshots, start, key=snapshot_time) - 1)
+            high = len(snapshots) if end is None else bisect.bisect_right(snapshots, end, key=snapshot_time)
+
+            if low < high:
+                ticks.extend(self.read_ticks(path, index.coin_ids[coin], [index.offsets[x] for x in snapshots[low:high]]))
+
+        return ticks
+
+    def read_ticks(self, path, coin_id, offsets):
+        """
+        Read the ticks for a coin id from the snapshot records at offsets
+        """
+
+        ticks = []
+        with open(path, "rb") as file:
+            for offset in offsets:
+                file.seek(offset)
+                record_type, length, _, timestamp = RECORD_HEADER.unpack(file.read(RECORD_HEADER.size))
+                val_run(record_type == RECORD_SNAPSHOT, f"Tick index points to a non snapshot record: {path}")
+
+                for entry_id, bid, ask, last in TICK_ENTRY.iter_unpack(file.read(length)):
+                    if entry_id == coin_id:
+                        ticks.append((timestamp, bid, ask, last))
+                        break
+
+        return ticks
@@ -0,0 +1,228 @@
+"""
+Tracking of open market orders per coin, cached between runs
+"""
+
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import val_arg, val_run
+from .cache import locked
+from .orders import account_id
+from .transport import submit
+
+logger = logging.getLogger(__name__)
+
+def default_tracker_path():
+    """
+    Default location for the open order state
+    """
+
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+
+    return os.path.join(base, "csutl", "open_orders.json")
+
+class OpenOrderTracker:
+    """
+    Open market orders for each coin, keyed by order id
+
+    The order set for a coin is kept on disk, so a run can decide on a recent
+    set without waiting on the api. Refreshes run in the background and apply
+    only the difference from the cached set, and orders placed by csutl are
+    added as soon as the order response arrives.
+    """
+
+    def __init__(self, api, path=None, max_age=60):
+        val_arg(isinstance(path, (str, type(None))), "Invalid path passed to OpenOrderTracker")
+        val_arg(isinstance(max_age, (int, float)) and max_age >= 0, "Invalid max_age passed to OpenOrderTracker")
+
+        if path is None:
+            path = default_tracker_path()
+
+        self.api = api
+        self.path = path
+        self.max_age = max_age
+        self.account = account_id()
+
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="csutl-tracker")
+        self.pending = {}
+
+        # Per coin entries of {"updated": epoch seconds, "orders": {id: order}}
+        self.coins = {}
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        self.load()
+
+    def close(self):
+        """
+        Wait for any background refresh to finish
+        """
+
+        self.executor.shutdown(wait=True)
+
+    def load(self):
+        """
+        Load the cached order sets for the account
+        """
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                content = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        if isinstance(content, dict) and isinstance(content.get(self.account), dict):
+            self.coins = content[self.account]
+
+    def save(self, coin):
+        """
+        Write the order set for a coin, merging with sets written by other
+        processes for other coins
+        """
+
+        with self.lock:
+            entry = json.loads(json.dumps(self.coins[coin]))
+
+        with locked(self.path + ".lock"):
+            try:
+                with open(self.path, "r", encoding="utf-8") as file:
+                    content = json.load(file)
+            except (OSError, ValueError):
+                content = {}
+
+            if not isinstance(content, dict):
+                content = {}
+
+            content.setdefault(self.account, {})[coin] = entry
+
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as file:
+                    json.dump(content, file)
+
+                os.replace(temp_path, self.path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+
+    def refresh(self, coin):
+        """
+        Retrieve the open orders for a coin and apply the difference to the
+        cached set. Returns the (added, removed) order ids.
+        """
+
+        coin = coin.upper()
+
+        response = json.loads(self.api.post("/api/v2/ro/my/orders/market/open", {"cointype": coin}))
+        val_run(isinstance(response.get("buyorders"), list), "API response missing 'buyorders' list")
+        val_run(isinstance(response.get("sellorders"), list), "API response missing 'sellorders' list")
+
+        current = {}
+        for side, key in (("buy", "buyorders"), ("sell", "sellorders")):
+            for order in response[key]:
+                val_run("id" in order, "Open order missing 'id'")
+                current[str(order["id"])] = {"side": side, "amount": order.get("amount"), "rate": order.get("rate")}
+
+        with self.lock:
+            entry = self.coins.setdefault(coin, {"updated": 0, "orders": {}})
+            orders = entry["orders"]
+
+            added = [x for x in current if x not in orders]
+            removed = [x for x in orders if x not in current]
+
+            for order_id in added:
+                orders[order_id] = current[order_id]
+            for order_id in removed:
+                del orders[order_id]
+
+            entry["updated"] = time.time()
+
+        logger.debug("Open orders for %s: %s added, %s removed", coin, len(added), len(removed))
+
+        self.save(coin)
+
+        return added, removed
+
+    def start_refresh(self, coin):
+        """
+        Refresh the open orders for a coin in the background
+        """
+
+        coin = coin.upper()
+
+        with self.lock:
+            future = self.pending.get(coin)
+            if future is None or future.done():
+                future = submit(self.executor, self.refresh, coin)
+                self.pending[coin] = future
+
+        return future
+
+    def count(self, coin):
+        """
+        Number of open orders for a coin. A cached set within max_age is used
+        immediately, unless a background refresh has already completed,
+        otherwise this waits for the refresh. A failed refresh falls back to
+        the cached set, where there is one.
+        """
+
+        coin = coin.upper()
+
+        with self.lock:
+            future = self.pending.get(coin)
+            entry = self.coins.get(coin)
+            fresh = entry is not None and time.time() - entry["updated"] <= self.max_age
+
+        try:
+            if future is not None and (future.done() or not fresh):
+                future.result()
+            elif future is None and not fresh:
+                self.refresh(coin)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            with self.lock:
+                cached = coin in self.coins
+            if not cached:
+                raise
+
+            logger.warning("Open order refresh for %s failed, using cached orders: %s", coin, e)
+
+        with self.lock:
+            return len(self.coins[coin]["orders"])
+
+    def record(self, side, coin, response):
+        """
+        Add an order placed by csutl from the buy or sell order response, ahead
+        of the next refresh
+        """
+
+        val_arg(side in ("buy", "sell"), "Invalid side passed to OpenOrderTracker.record")
+
+        coin = coin.upper()
+
+        content = response
+        if isinstance(content, str):
+            content = json.loads(content)
+
+        val_run("id" in content, "Order response missing 'id'")
+
+        # A refresh started before the order could otherwise drop it
+        with self.lock:
+            future = self.pending.get(coin)
+        if future is not None:
+            try:
+                future.result()
+            except Exception as e: # pylint: disable=broad-exception-caught
+                logger.warning("Open order refresh for %s failed: %s", coin, e)
+
+        with self.lock:
+            entry = self.coins.setdefault(coin, {"updated": 0, "orders": {}})
+            entry["orders"][str(content["id"])] = {"side": side, "amount": content.get("amount"), "rate": content.get("rate")}
+
+        self.save(coin)
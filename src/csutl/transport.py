@@ -0,0 +1,461 @@
+"""
+Retry and hedging policies for requests made by CoinSpotApi
+"""
+
+import os
+import json
+import time
+import random
+import logging
+import tempfile
+import threading
+import contextvars
+import urllib.parse
+
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+from .common import val_arg
+from .exception import CircuitOpenException, DeadlineExceededException
+from .cache import locked
+
+logger = logging.getLogger(__name__)
+
+def is_retryable(exc):
+    """
+    Determine whether a requestor exception is transient (connection failure,
+    timeout or a 5xx response)
+    """
+
+    import requests # pylint: disable=import-outside-toplevel
+
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+
+    if isinstance(exc, requests.HTTPError):
+        response = exc.response
+        return response is not None and response.status_code >= 500
+
+    return False
+
+# Endpoint families for circuit breaking, by url path prefix (longest first)
+ENDPOINT_FAMILIES = (
+    ("/pubapi/v2/latest", "latest"),
+    ("/charts/", "history"),
+    ("/api/v2/ro/", "readonly"),
+    ("/api/", "trading"),
+    ("/pubapi/", "public")
+)
+
+def endpoint_family(url):
+    """
+    Endpoint family of a url, for circuit breaking
+    """
+
+    path = urllib.parse.urlparse(url).path
+
+    for prefix, family in ENDPOINT_FAMILIES:
+        if path.startswith(prefix):
+            return family
+
+    return "other"
+
+# Deadline for the work of the current command, if any. Context variables
+# follow the work in to hedge and background threads when the context is
+# copied on submit
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+@contextmanager
+def deadline_scope(seconds):
+    """
+    Run the enclosed work within a deadline of seconds from now. None runs the
+    work without a deadline.
+    """
+
+    val_arg(seconds is None or (isinstance(seconds, (int, float)) and seconds > 0), "Invalid deadline supplied")
+
+    expires = None
+    if seconds is not None:
+        expires = time.monotonic() + seconds
+
+    token = current_deadline.set(expires)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+def remaining_time():
+    """
+    Seconds remaining before the current deadline, or None without a deadline
+    """
+
+    expires = current_deadline.get()
+    if expires is None:
+        return None
+
+    return max(0.0, expires - time.monotonic())
+
+def submit(executor, func, *args):
+    """
+    Submit func to an executor, running in a copy of the caller's context so
+    the current deadline applies to it
+    """
+
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+def start_daemon(func, name):
+    """
+    Run func in a new daemon thread, in a copy of the caller's context, and
+    return a Future for its result. Unlike executor threads, daemon threads
+    don't hold up interpreter exit, so abandoned calls don't delay it.
+    """
+
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+
+        try:
+            result = context.run(func)
+        except BaseException as e: # pylint: disable=broad-exception-caught
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+
+    return future
+
+def check_deadline(step):
+    """
+    Raise DeadlineExceededException if the current deadline has passed, before
+    starting step
+    """
+
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceededException(f"Deadline exceeded before {step}")
+
+def default_breaker_path():
+    """
+    Default location for persisted circuit breaker state
+    """
+
+    path = os.environ.get("CSUTL_BREAKER_FILE")
+    if path is not None and path != "":
+        return path
+
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+
+    return os.path.join(base, "csutl", "breaker.json")
+
+class RetryPolicy:
+    """
+    Bounded retry with exponential backoff and jitter for transient failures
+    """
+
+    def __init__(self, attempts=3, backoff=0.2, max_backoff=2.0):
+        val_arg(isinstance(attempts, int) and attempts > 0, "Invalid attempts passed to RetryPolicy")
+        val_arg(isinstance(backoff, (int, float)) and backoff >= 0, "Invalid backoff passed to RetryPolicy")
+        val_arg(isinstance(max_backoff, (int, float)) and max_backoff >= 0, "Invalid max_backoff passed to RetryPolicy")
+
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt):
+        """
+        Delay before the retry following the (zero based) attempt
+        """
+
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+
+        return random.uniform(delay / 2, delay)
+
+    def call(self, func):
+        """
+        Call func, retrying transient failures up to the attempt limit
+        """
+
+        for attempt in range(self.attempts):
+            try:
+                return func()
+            except Exception as e: # pylint: disable=broad-exception-caught
+                if attempt + 1 >= self.attempts or not is_retryable(e):
+                    raise
+
+                delay = self.delay(attempt)
+
+                # Don't retry past the deadline
+                remaining = remaining_time()
+                if remaining is not None and remaining <= delay:
+                    raise DeadlineExceededException("Deadline exceeded before retry") from e
+
+                logger.debug("Retrying request in %.3fs after error: %s", delay, e)
+                time.sleep(delay)
+
+        # Unreachable - the final attempt either returns or raises
+        return None
+
+class HedgePolicy:
+    """
+    Hedging for idempotent requests. If a request hasn't completed within a
+    percentile of recently observed latencies, a second identical request is
+    sent and the first response to arrive is used.
+
+    Calls run in daemon threads, so the losing call of a hedged pair is
+    abandoned, rather than waited on, when the process exits.
+    """
+
+    def __init__(self, percentile=95, initial_delay=0.5, min_delay=0.05, max_delay=2.0, samples=100):
+        val_arg(isinstance(percentile, (int, float)) and 0 < percentile < 100, "Invalid percentile passed to HedgePolicy")
+        val_arg(isinstance(initial_delay, (int, float)) and initial_delay >= 0, "Invalid initial_delay passed to HedgePolicy")
+        val_arg(isinstance(min_delay, (int, float)) and min_delay >= 0, "Invalid min_delay passed to HedgePolicy")
+        val_arg(isinstance(max_delay, (int, float)) and max_delay >= min_delay, "Invalid max_delay passed to HedgePolicy")
+        val_arg(isinstance(samples, int) and samples > 0, "Invalid samples passed to HedgePolicy")
+
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+        self.latencies = deque(maxlen=samples)
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        """
+        Record the latency of a completed request
+        """
+
+        with self.lock:
+            self.latencies.append(latency)
+
+    def delay(self):
+        """
+        Time to wait for a response before sending the hedge request
+        """
+
+        with self.lock:
+            latencies = sorted(self.latencies)
+
+        # Not enough history to estimate the tail yet
+        if len(latencies) < 10:
+            return self.initial_delay
+
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+
+        return min(self.max_delay, max(self.min_delay, latencies[index]))
+
+    def call(self, func):
+        """
+        Call func, sending a hedge call if the first is slow to respond
+        """
+
+        def timed():
+            start = time.monotonic()
+            result = func()
+            self.record(time.monotonic() - start)
+            return result
+
+        # Each call runs in a copy of the caller's context, carrying the deadline
+        pending = {start_daemon(timed, "csutl-hedge")}
+        done, pending = wait(pending, timeout=self.delay())
+
+        if not done:
+            logger.debug("Sending hedge request")
+            pending.add(start_daemon(timed, "csutl-hedge"))
+
+        # Use the first successful response, only failing if every call fails
+        error = None
+        while True:
+            if not done:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+
+                if error is None:
+                    error = future.exception()
+
+            done = set()
+            if not pending:
+                raise error
+
+class RateLimiter:
+    """
+    Spaces calls evenly to stay within a request rate, shared between threads
+    """
+
+    def __init__(self, rate):
+        val_arg(isinstance(rate, (int, float)) and rate > 0, "Invalid rate passed to RateLimiter")
+
+        self.interval = 1.0 / rate
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until the next request slot is available
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_time)
+            self.next_time = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+class CircuitBreaker:
+    """
+    Circuit breaker per endpoint family. After threshold consecutive transient
+    failures the circuit opens, and requests fail immediately for the cool-off
+    period. A single probe request is then let through (half-open) - success
+    closes the circuit, failure opens it for another cool-off.
+
+    With a path, breaker state is kept in a json file (under a lock), so
+    separate processes share it.
+    """
+
+    def __init__(self, threshold=5, cooloff=30.0, path=None):
+        val_arg(isinstance(threshold, int) and threshold > 0, "Invalid threshold passed to CircuitBreaker")
+        val_arg(isinstance(cooloff, (int, float)) and cooloff > 0, "Invalid cooloff passed to CircuitBreaker")
+        val_arg(isinstance(path, (str, type(None))), "Invalid path passed to CircuitBreaker")
+
+        self.threshold = threshold
+        self.cooloff = cooloff
+        self.path = path
+
+        self.lock = threading.Lock()
+        self.states = {}
+
+        if self.path is not None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+    def update(self, family, func):
+        """
+        Apply func to the state for a family, returning its result. The state
+        is reloaded and, if changed, saved when persisted.
+        """
+
+        with self.lock:
+            if self.path is None:
+                state = self.states.setdefault(family, {"failures": 0, "opened": None, "probe_until": None})
+                return func(state)
+
+            with locked(self.path + ".lock"):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as file:
+                        content = json.load(file)
+                except (OSError, ValueError):
+                    content = {}
+
+                if not isinstance(content, dict):
+                    content = {}
+
+                state = content.setdefault(family, {"failures": 0, "opened": None, "probe_until": None})
+                before = dict(state)
+
+                result = func(state)
+
+                if state != before:
+                    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", prefix=".tmp-")
+                    try:
+                        with os.fdopen(fd, "w", encoding="utf-8") as file:
+                            json.dump(content, file)
+
+                        os.replace(temp_path, self.path)
+                    except BaseException:
+                        os.unlink(temp_path)
+                        raise
+
+                return result
+
+    def allow(self, family):
+        """
+        Check whether a request to the family may be made, raising
+        CircuitOpenException if the circuit is open
+        """
+
+        def check(state):
+            now = time.time()
+
+            if state["opened"] is None:
+                return None
+
+            if now < state["opened"] + self.cooloff:
+                return state["opened"] + self.cooloff - now
+
+            # Half open - let one probe through at a time. An abandoned probe
+            # is replaced after another cool-off.
+            if state["probe_until"] is not None and now < state["probe_until"]:
+                return state["probe_until"] - now
+
+            state["probe_until"] = now + self.cooloff
+            logger.debug("Circuit for %s half open, sending probe", family)
+            return None
+
+        remaining = self.update(family, check)
+        if remaining is not None:
+            raise CircuitOpenException(f"Circuit open for {family} endpoints, retry in {remaining:.1f}s")
+
+    def record(self, family, success):
+        """
+        Record the outcome of a request to the family
+        """
+
+        def apply(state):
+            if success:
+                if state["opened"] is not None:
+                    logger.info("Circuit for %s closed", family)
+
+                state["failures"] = 0
+                state["opened"] = None
+                state["probe_until"] = None
+                return
+
+            state["failures"] += 1
+            state["probe_until"] = None
+
+            if state["opened"] is not None or state["failures"] >= self.threshold:
+                if state["opened"] is None:
+                    logger.warning("Circuit for %s opened after %s failures", family, state["failures"])
+
+                state["opened"] = time.time()
+
+        # Skip the (locked) update when nothing would change
+        if success and self.path is None:
+            with self.lock:
+                state = self.states.get(family)
+                if state is None or (state["failures"] == 0 and state["opened"] is None):
+                    return
+
+        self.update(family, apply)
+
+    def call(self, url, func):
+        """
+        Call func for a request to url, through the breaker for its family.
+        Only transient failures (as for retries) count against the circuit.
+        Any other outcome counts as a success.
+        """
+
+        # State is kept per host, so a stand-in server doesn't trip the
+        # circuit for the real api
+        family = f"{urllib.parse.urlparse(url).netloc}/{endpoint_family(url)}"
+
+        self.allow(family)
+
+        try:
+            result = func()
+        except Exception as e:
+            # Other failures (e.g. 4xx responses) show the endpoint is answering
+            self.record(family, not is_retryable(e))
+            raise
+
+        self.record(family, True)
+
+        return result
@@ -4,6 +4,7 @@ import subprocess
 import pytest
 import csutl
 import json
+import os
 
 from datetime import datetime, timedelta
 
@@ -152,3 +153,118 @@ class TestCli:
 
         assert ret == 0
 
+    def test_backtest1(self):
+        """
+        Test that the backtest subcommand is available
+        """
+
+        ret = subprocess.call(["/work/bin/entrypoint", "backtest", "--help"])
+
+        assert ret == 0
+
+    def test_sweep1(self):
+        """
+        Test that the sweep subcommand is available
+        """
+
+        ret = subprocess.call(["/work/bin/entrypoint", "sweep", "--help"])
+
+        assert ret == 0
+
+    def test_serve1(self):
+        """
+        Test that the serve subcommand is available
+        """
+
+        ret = subprocess.call(["/work/bin/entrypoint", "serve", "--help"])
+
+        assert ret == 0
+
+    def test_portfolio1(self):
+        """
+        Test that the portfolio subcommand is available
+        """
+
+        ret = subprocess.call(["/work/bin/entrypoint", "portfolio", "--help"])
+
+        assert ret == 0
+
+    def test_profile1(self, tmp_path):
+        """
+        Test profiling of a subcommand
+        """
+
+        path = str(tmp_path / "csutl.prof")
+        collapsed_path = str(tmp_path / "csutl.collapsed")
+
+        result = subprocess.run(["/work/bin/entrypoint", f"--profile={path}", "--profile-collapsed", collapsed_path,
+            "get", "/pubapi/v2/latest"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL, text=True)
+
+        assert result.returncode == 0
+        assert os.path.exists(path)
+        assert os.path.exists(collapsed_path)
+        assert "Requestor wait" in result.stderr
+
+    def test_market_quote1(self):
+        """
+        Test that the market quote subcommand is available
+        """
+
+        ret = subprocess.call(["/work/bin/entrypoint", "market", "quote", "--help"])
+
+        assert ret == 0
+
+    def test_correlate1(self):
+        """
+        Test that the correlate subcommand is available
+        """
+
+        ret = subprocess.call(["/work/bin/entrypoint", "correlate", "--help"])
+
+        assert ret == 0
+
+    def test_scan1(self):
+        """
+        Test that the scan subcommand is available
+        """
+
+        ret = subprocess.call(["/work/bin/entrypoint", "scan", "--help"])
+
+        assert ret == 0
+
+    def test_order_history_local1(self, tmp_path):
+        """
+        Test querying an empty local order store
+        """
+
+        env = dict(os.environ, CSUTL_ORDER_STORE=str(tmp_path / "orders.db"), COINSPOT_API_KEY="apikey")
+
+        result = subprocess.run(["/work/bin/entrypoint", "order_history", "--local", "-t", "btc"],
+            stdout=subprocess.PIPE, stdin=subprocess.DEVNULL, env=env, text=True)
+
+        assert result.returncode == 0
+        assert json.loads(result.stdout)["buyorders"] == []
+
+    def test_loadtest1(self):
+        """
+        Test a small load test against the stand-in server
+        """
+
+        result = subprocess.run(["/work/bin/entrypoint", "loadtest", "-c", "4", "-n", "5", "--latency", "1"],
+            stdout=subprocess.PIPE, stdin=subprocess.DEVNULL, text=True)
+
+        assert result.returncode == 0
+        assert "Total count" in result.stdout
+
+    def test_ticks1(self, tmp_path):
+        """
+        Test querying an empty local tick store
+        """
+
+        env = dict(os.environ, CSUTL_TICK_DIR=str(tmp_path / "ticks"))
+
+        result = subprocess.run(["/work/bin/entrypoint", "ticks", "btc"],
+            stdout=subprocess.PIPE, stdin=subprocess.DEVNULL, env=env, text=True)
+
+        assert result.returncode == 0
+        assert json.loads(result.stdout)["ticks"] == []
@@ -0,0 +1,75 @@
+import pytest
+import csutl
+
+from csutl.backtest import backtest_simple_buy_sell, sweep_simple_buy_sell
+from csutl.stats import RollingStats
+
+class TestBacktest:
+    def test_rolling_window1(self):
+        """
+        Check the window average after eviction of old samples
+        """
+
+        window = RollingStats(width_ms=1000, ordered=False)
+        window.push(10.0, 0)
+        window.push(20.0, 500)
+        assert window.mean() == 15.0
+
+        window.push(30.0, 1500)
+        assert len(window) == 2
+        assert window.mean() == 25.0
+
+    def test_backtest1(self):
+        """
+        Buy on a drop below the average and sell on the recovery
+        """
+
+        hour = 60 * 60 * 1000
+        timestamps = [x * hour for x in range(6)]
+        prices = [100.0, 100.0, 90.0, 95.0, 100.0, 100.0]
+
+        result = backtest_simple_buy_sell(timestamps, prices, 90.0, 1, 3.0, 5.0, interval_secs=3600, trades=True)
+
+        assert result["buys"] == 1
+        assert result["sells"] == 1
+        assert result["open"] == 0
+        assert result["hit_rate"] == 1.0
+        assert result["trades"][0]["buy_rate"] == 90.0
+        assert result["trades"][0]["sell_rate"] == pytest.approx(94.5)
+        assert result["pnl"] == pytest.approx(4.5)
+
+    def test_backtest2(self):
+        """
+        Check the open order limit and capital constraints
+        """
+
+        hour = 60 * 60 * 1000
+        timestamps = [x * hour for x in range(6)]
+        prices = [100.0, 90.0, 80.0, 70.0, 60.0, 50.0]
+
+        result = backtest_simple_buy_sell(timestamps, prices, 10.0, 1, 1.0, 5.0, limit=2)
+        assert result["buys"] == 2
+        assert result["open"] == 2
+        assert result["pnl"] < 0
+
+        result = backtest_simple_buy_sell(timestamps, prices, 10.0, 1, 1.0, 5.0, capital=15.0)
+        assert result["buys"] == 1
+        assert result["available"] == 5.0
+
+    def test_sweep1(self):
+        """
+        Sweep results should match individual backtests and be ranked by pnl
+        """
+
+        hour = 60 * 60 * 1000
+        timestamps = [x * hour for x in range(48)]
+        prices = [100.0 + (10.0 if x % 6 < 3 else -10.0) for x in range(48)]
+
+        results = sweep_simple_buy_sell(timestamps, prices, 10.0, [1.0, 5.0], [2.0, 50.0], [1, 3], workers=2)
+
+        assert len(results) == 8
+        assert all(results[x]["pnl"] >= results[x + 1]["pnl"] for x in range(7))
+
+        params = results[0]["params"]
+        single = backtest_simple_buy_sell(timestamps, prices, 10.0, params["age_hours"], params["buy_pct"], params["sell_pct"])
+        assert single == results[0]
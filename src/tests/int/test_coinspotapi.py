@@ -3,8 +3,13 @@ import sys
 import subprocess
 import pytest
 import csutl
+import io
 import json
 import os
+import time
+import threading
+import requests
+import urllib.parse
 
 from datetime import datetime, timedelta
 
@@ -371,3 +376,375 @@ class TestCoinSpotApi:
         assert "max_price_diff_pct" in response["reference"]
         assert isinstance(response["reference"]["max_price_diff_pct"], (int, float))
 
+    def test_price_candles1(self):
+        """
+        Test bucketing of price history in to candles
+        """
+
+        def test_requestor(method, url, headers, payload=None):
+            assert "/charts/history_basic" in url
+            return json.dumps([[0, 1.0], [1000, 3.0], [59999, 2.0], [60000, 5.0], [180000, 4.0]])
+
+        api = csutl.CoinSpotApi(requestor=test_requestor)
+        response = json.loads(api.get_price_candles("BTC", age_hours=1, interval_secs=60))
+
+        assert response == [
+            [0, 1.0, 3.0, 1.0, 2.0, 3],
+            [60000, 5.0, 5.0, 5.0, 5.0, 1],
+            [180000, 4.0, 4.0, 4.0, 4.0, 1]
+        ]
+
+    def test_retry1(self):
+        """
+        Get requests should be retried on connection errors
+        """
+
+        calls = []
+
+        def test_requestor(method, url, headers, payload=None):
+            calls.append(method)
+            if len(calls) < 3:
+                raise requests.ConnectionError("failed")
+
+            return "{}"
+
+        api = csutl.CoinSpotApi(requestor=test_requestor, retry_policy=csutl.transport.RetryPolicy(attempts=3, backoff=0))
+        assert api.get("/pubapi/v2/latest") == "{}"
+        assert len(calls) == 3
+
+    def test_retry2(self):
+        """
+        Post requests should never be retried
+        """
+
+        calls = []
+
+        def test_requestor(method, url, headers, payload=None):
+            calls.append(method)
+            raise requests.ConnectionError("failed")
+
+        os.environ["COINSPOT_API_KEY"] = "apikey"
+        os.environ["COINSPOT_API_SECRET"] = "apisecret"
+
+        api = csutl.CoinSpotApi(requestor=test_requestor, retry_policy=csutl.transport.RetryPolicy(attempts=3, backoff=0),
+            hedge_policy=csutl.transport.HedgePolicy(initial_delay=0))
+
+        with pytest.raises(requests.ConnectionError):
+            api.post("/api/v2/my/buy", {})
+
+        assert calls == ["post"]
+
+    def test_hedge1(self):
+        """
+        A slow get request should be hedged with a second request
+        """
+
+        lock = threading.Lock()
+        calls = []
+
+        def test_requestor(method, url, headers, payload=None):
+            with lock:
+                calls.append(method)
+                first = len(calls) == 1
+
+            if first:
+                time.sleep(1)
+                return json.dumps({"request": "first"})
+
+            return json.dumps({"request": "hedge"})
+
+        api = csutl.CoinSpotApi(requestor=test_requestor, hedge_policy=csutl.transport.HedgePolicy(initial_delay=0.05))
+        response = json.loads(api.get("/pubapi/v2/latest"))
+
+        assert response["request"] == "hedge"
+        assert len(calls) == 2
+
+    def test_hedge3(self):
+        """
+        The process should exit without waiting on the losing call of a hedged pair
+        """
+
+        script = """
+import json, time, threading, csutl
+calls = []
+lock = threading.Lock()
+def test_requestor(method, url, headers, payload=None):
+    with lock:
+        calls.append(method)
+        first = len(calls) == 1
+    if first:
+        time.sleep(5)
+    return json.dumps({})
+api = csutl.CoinSpotApi(requestor=test_requestor, hedge_policy=csutl.transport.HedgePolicy(initial_delay=0.1))
+api.get("/pubapi/v2/latest")
+"""
+
+        start = time.monotonic()
+        subprocess.run([sys.executable, "-c", script], check=True, cwd=os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+        assert time.monotonic() - start < 3
+
+    def test_cache1(self, tmp_path):
+        """
+        Public get responses should be served from the disk cache, across api instances
+        """
+
+        calls = []
+
+        def test_requestor(method, url, headers, payload=None):
+            calls.append(url)
+            return json.dumps({"count": len(calls)})
+
+        cache = csutl.cache.DiskCache(path=str(tmp_path))
+
+        api = csutl.CoinSpotApi(requestor=test_requestor, cache=cache)
+        assert json.loads(api.get("/pubapi/v2/latest"))["count"] == 1
+
+        api = csutl.CoinSpotApi(requestor=test_requestor, cache=csutl.cache.DiskCache(path=str(tmp_path)))
+        assert json.loads(api.get("/pubapi/v2/latest"))["count"] == 1
+        assert json.loads(api.get("/pubapi/v2/latest/BTC"))["count"] == 2
+        assert len(calls) == 2
+
+    def test_cache2(self, tmp_path):
+        """
+        Signed requests should never be cached
+        """
+
+        calls = []
+
+        def test_requestor(method, url, headers, payload=None):
+            calls.append(url)
+            return "{}"
+
+        os.environ["COINSPOT_API_KEY"] = "apikey"
+        os.environ["COINSPOT_API_SECRET"] = "apisecret"
+
+        api = csutl.CoinSpotApi(requestor=test_requestor, cache=csutl.cache.DiskCache(path=str(tmp_path)))
+        api.post("/api/v2/ro/my/balances", {})
+        api.post("/api/v2/ro/my/balances", {})
+
+        assert len(calls) == 2
+        assert not any(not x.name.startswith(".") for x in tmp_path.iterdir())
+
+    def test_cache3(self, tmp_path):
+        """
+        The cache should evict least recently used entries to stay within its size bound
+        """
+
+        cache = csutl.cache.DiskCache(path=str(tmp_path), max_bytes=400)
+
+        for i in range(10):
+            cache.fetch(f"https://www.coinspot.com.au/pubapi/v2/latest/C{i}", lambda: "x" * 100)
+
+        entries = [x for x in tmp_path.iterdir() if not x.name.startswith(".")]
+        assert sum(x.stat().st_size for x in entries) <= 400
+        assert cache.get("https://www.coinspot.com.au/pubapi/v2/latest/C9") is not None
+
+    def test_portfolio1(self):
+        """
+        Test valuation of balances against the latest prices
+        """
+
+        calls = []
+
+        def test_requestor(method, url, headers, payload=None):
+            calls.append(url)
+
+            if url.endswith("/api/v2/ro/my/balances"):
+                return json.dumps({"status": "ok", "balances": [
+                    {"AUD": {"balance": 10.0, "available": 5.0}},
+                    {"BTC": {"balance": 2.0, "available": 2.0}},
+                    {"XYZ": {"balance": 1.0, "available": 1.0}}
+                ]})
+
+            return json.dumps({"status": "ok", "prices": {
+                "btc": {"bid": "99", "ask": "101", "last": "100"},
+                "eth": {"bid": "9", "ask": "11", "last": "10"}
+            }})
+
+        os.environ["COINSPOT_API_KEY"] = "apikey"
+        os.environ["COINSPOT_API_SECRET"] = "apisecret"
+
+        api = csutl.CoinSpotApi(requestor=test_requestor)
+        response = json.loads(api.get_portfolio())
+
+        assert len(calls) == 2
+        assert response["coins"]["BTC"]["value_bid"] == 198.0
+        assert response["coins"]["AUD"]["value_last"] == 10.0
+        assert response["totals"]["value_last"] == 210.0
+        assert response["totals"]["value_ask"] == 212.0
+        assert response["missing"] == ["XYZ"]
+
+    def test_scan1(self):
+        """
+        Test scanning all coins, keeping the top coins by a reference index
+        """
+
+        histories = {
+            "BTC": [100.0, 110.0, 120.0, 90.0],
+            "ETH": [10.0, 10.0, 12.0, 11.0],
+            "SOL": [5.0, 6.0, 5.0, 6.0],
+            "BAD": []
+        }
+
+        def test_requestor(method, url, headers, payload=None):
+            if url.endswith("/pubapi/v2/latest"):
+                return json.dumps({"status": "ok", "prices": {
+                    coin.lower(): {"bid": "1", "ask": "1", "last": str(prices[-1] if prices else 1)}
+                    for coin, prices in histories.items()
+                }})
+
+            coin = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)["symbol"][0]
+            return json.dumps([[1700000000000 + x * 1000, price] for x, price in enumerate(histories[coin])])
+
+        api = csutl.CoinSpotApi(requestor=test_requestor)
+
+        response = json.loads(api.scan_price_history(age_hours=24, index="avg_price_diff_pct", top=2))
+
+        assert response["scanned"] == 3
+        assert response["skipped"] == ["BAD"]
+        assert [x["coin"] for x in response["results"]] == ["BTC", "ETH"]
+        assert response["results"][0]["value"] == pytest.approx((105.0 / 90.0 - 1) * 100)
+
+        response = json.loads(api.scan_price_history(age_hours=24, index="avg_price_diff_pct", top=1, lowest=True))
+
+        assert [x["coin"] for x in response["results"]] == ["SOL"]
+
+    def test_stream1(self):
+        """
+        Bytes responses should be accepted, and price history stats parsed from
+        a streamed body
+        """
+
+        series = [[1700000000000 + x * 1000, 100.0 + x] for x in range(100)]
+        body = json.dumps(series).encode("utf-8")
+        streamed = []
+
+        def test_requestor(method, url, headers, payload=None):
+            return json.dumps({"status": "ok", "test": "response"}).encode("utf-8")
+
+        def test_stream_requestor(method, url, headers, payload=None):
+            streamed.append(url)
+            return iter([body[x:x + 10] for x in range(0, len(body), 10)])
+
+        api = csutl.CoinSpotApi(requestor=test_requestor)
+        api.stream_requestor = test_stream_requestor
+
+        assert json.loads(api.get("/pubapi/v2/latest")) == {"test": "response"}
+        assert isinstance(api.get("/pubapi/v2/latest", raw_output=True), str)
+
+        response = json.loads(api.get_price_history("btc", age_hours=1, stats=True))
+
+        assert len(streamed) == 1
+        assert response["first"] == 100.0
+        assert response["last"] == 199.0
+        assert response["med"] == 149.5
+
+        response = json.loads(api.get_price_history("btc", age_hours=1, stats=True, approx=True))
+        assert response["max"] == 199.0
+
+    def test_prepare_post1(self):
+        """
+        Requests prepared in order should carry ascending nonces, even when sent out of order
+        """
+
+        nonces = []
+
+        def test_requestor(method, url, headers, payload=None):
+            nonces.append(int(json.loads(payload)["nonce"]))
+            return "{}"
+
+        os.environ["COINSPOT_API_KEY"] = "apikey"
+        os.environ["COINSPOT_API_SECRET"] = "apisecret"
+
+        api = csutl.CoinSpotApi(requestor=test_requestor)
+        prepared = [api.prepare_post("/api/v2/my/buy", {"index": x}) for x in range(100)]
+
+        for request in reversed(prepared):
+            assert api.send_prepared(request) == "{}"
+
+        assert len(set(nonces)) == 100
+        assert nonces == sorted(nonces, reverse=True)
+
+    def test_market_bulk1(self, tmp_path):
+        """
+        Bulk orders should reach the api in file order, with ascending nonces
+        """
+
+        nonces = []
+
+        def test_requestor(method, url, headers, payload=None):
+            nonces.append(int(json.loads(payload)["nonce"]))
+            return json.dumps({"status": "ok"})
+
+        os.environ["COINSPOT_API_KEY"] = "apikey"
+        os.environ["COINSPOT_API_SECRET"] = "apisecret"
+
+        path = tmp_path / "orders.jsonl"
+        path.write_text("".join(json.dumps({"cointype": "btc", "amount": x + 1, "rate": 100}) + "\n" for x in range(40)))
+
+        args = csutl.cli.build_parser().parse_args(["market", "buy", "--from", str(path)])
+        args.api = csutl.CoinSpotApi(requestor=test_requestor)
+        args.output = io.StringIO()
+        args.call_func(args)
+
+        assert json.loads(args.output.getvalue())["submitted"] == 40
+        assert len(nonces) == 40
+        assert nonces == sorted(nonces)
+
+    def test_post_concurrent1(self):
+        """
+        Concurrent signed requests should reach the api with increasing nonces
+        """
+
+        nonces = []
+
+        def test_requestor(method, url, headers, payload=None):
+            nonce = int(json.loads(payload)["nonce"])
+            time.sleep(0.001)
+            nonces.append(nonce)
+            return "{}"
+
+        os.environ["COINSPOT_API_KEY"] = "apikey"
+        os.environ["COINSPOT_API_SECRET"] = "apisecret"
+
+        api = csutl.CoinSpotApi(requestor=test_requestor)
+
+        threads = [threading.Thread(target=lambda: [api.post("/api/v2/ro/my/balances", {}) for _ in range(10)]) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(nonces) == 80
+        assert nonces == sorted(nonces)
+
+    def test_price_history_chunked1(self):
+        """
+        Chunked price history should match a single request, including retried chunks
+        """
+
+        failures = []
+
+        def test_requestor(method, url, headers, payload=None):
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+            start = int(query["from"][0])
+            end = int(query["to"][0])
+
+            # Fail the first request for one of the chunks
+            if start != 1000 and not failures:
+                failures.append(start)
+                raise requests.ConnectionError("failed")
+
+            first = start + (-start % 60000)
+            return json.dumps([[x, x / 60000] for x in range(first, end + 1, 60000)], separators=(",", ":"))
+
+        api = csutl.CoinSpotApi(requestor=test_requestor)
+        start = datetime.fromtimestamp(1)
+        end = datetime.fromtimestamp(3600 * 30)
+
+        single = api.get_price_history_range("BTC", start, end)
+        chunked = api.get_price_history_range("BTC", start, end, chunk_hours=2, workers=4)
+
+        assert chunked == single
+        assert len(failures) == 1
@@ -0,0 +1,87 @@
+import io
+import sys
+import math
+import random
+import pytest
+import csutl
+
+from csutl.correlate import align_series, correlation_matrix, build_correlation, write_correlation_csv
+
+class TestCorrelate:
+    def test_align1(self):
+        """
+        Series should be aligned on the grid, carrying prices forward
+        """
+
+        series = [
+            ([0, 1500, 4200], [1.0, 2.0, 3.0]),
+            ([500, 2500], [10.0, 20.0])
+        ]
+
+        grid_timestamps, rows = align_series(series, 1000)
+
+        assert grid_timestamps == [0, 1000, 2000, 3000, 4000]
+        assert rows == [[1.0, 10.0], [2.0, 10.0], [2.0, 20.0], [2.0, 20.0], [3.0, 20.0]]
+
+    def test_align2(self):
+        """
+        Rows should only start once every series has a price
+        """
+
+        series = [
+            ([0, 1000, 2000, 3000], [1.0, 2.0, 3.0, 4.0]),
+            ([2100, 3100], [10.0, 20.0])
+        ]
+
+        grid_timestamps, rows = align_series(series, 1000)
+
+        assert grid_timestamps == [2000, 3000]
+        assert rows == [[3.0, 10.0], [4.0, 20.0]]
+
+    def test_matrix1(self, monkeypatch):
+        """
+        The vectorised and pure python matrices should agree with a direct
+        calculation
+        """
+
+        rng = random.Random(3)
+        base = [100.0]
+        for _ in range(200):
+            base.append(base[-1] * math.exp(rng.gauss(0, 0.01)))
+
+        rows = [[x, x * 2, 100.0 / x, 5.0] for x in base]
+
+        expected = correlation_matrix(rows)
+        assert expected[0][1] == pytest.approx(1.0)
+        assert expected[0][2] == pytest.approx(-1.0)
+        assert expected[0][3] is None
+        assert expected[3][3] is None
+
+        pytest.importorskip("numpy")
+
+        monkeypatch.setitem(sys.modules, "numpy", None)
+        pure = correlation_matrix(rows)
+
+        for row, pure_row in zip(expected, pure):
+            assert row == pytest.approx(pure_row)
+
+    def test_csv1(self):
+        """
+        Correlation should be written as a csv matrix
+        """
+
+        series = [
+            ([x * 1000 for x in range(10)], [float(x + 1) for x in range(10)]),
+            ([x * 1000 for x in range(10)], [float((x % 3) + 1) for x in range(10)])
+        ]
+
+        correlation = build_correlation(["BTC", "ETH"], series, 1000)
+        assert correlation["samples"] == 10
+
+        file = io.StringIO()
+        write_correlation_csv(file, correlation)
+
+        lines = file.getvalue().splitlines()
+        assert lines[0] == "coin,BTC,ETH"
+        assert lines[1].startswith("BTC,1.0,")
+        assert len(lines) == 3
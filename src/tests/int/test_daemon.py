@@ -0,0 +1,78 @@
+import os
+import time
+import threading
+import pytest
+import csutl
+
+from csutl.daemon import serve, forward, is_running
+
+class TestDaemon:
+    def test_forward1(self, tmp_path):
+        """
+        Forwarding without a running daemon should return None
+        """
+
+        assert forward(str(tmp_path / "missing.sock"), ["get", "/pubapi/v2/latest"]) is None
+
+    def test_forward2(self, tmp_path):
+        """
+        Commands forwarded to the daemon should return the handler output and status
+        """
+
+        path = str(tmp_path / "csutl.sock")
+
+        def handle(argv, context):
+            if argv[0] == "fail":
+                raise csutl.exception.RuntimeException("failed")
+
+            # Clients with other settings run the command themselves
+            if context != {"account": "a"}:
+                raise csutl.exception.DaemonDeclinedException("context differs")
+
+            return 0, " ".join(argv)
+
+        thread = threading.Thread(target=serve, args=(path, handle), daemon=True)
+        thread.start()
+
+        for _ in range(50):
+            if is_running(path):
+                break
+            time.sleep(0.05)
+
+        assert forward(path, ["get", "/pubapi/v2/latest"], {"account": "a"}) == (0, "get /pubapi/v2/latest")
+        assert forward(path, ["get", "/pubapi/v2/latest"], {"account": "b"}) is None
+        assert forward(path, ["get", "/pubapi/v2/latest"]) is None
+        assert os.stat(path).st_mode & 0o077 == 0
+
+        with pytest.raises(csutl.exception.RuntimeException):
+            forward(path, ["fail"])
+
+    def test_context1(self, monkeypatch):
+        """
+        The daemon context should reflect transport options and the api key account
+        """
+
+        monkeypatch.setenv("COINSPOT_API_KEY", "apikey")
+
+        parser = csutl.cli.build_parser()
+        context = csutl.cli.daemon_context(parser.parse_args(["balance"]))
+
+        assert context["account"] == csutl.orders.account_id()
+        assert context == csutl.cli.daemon_context(parser.parse_args(["balance"]))
+        assert context != csutl.cli.daemon_context(parser.parse_args(["balance", "--retries", "2"]))
+        assert context != csutl.cli.daemon_context(parser.parse_args(["balance", "--read-timeout", "5"]))
+
+        monkeypatch.setenv("COINSPOT_API_KEY", "other")
+        assert context["account"] != csutl.cli.daemon_context(parser.parse_args(["balance"]))["account"]
+
+    def test_local_files1(self):
+        """
+        Commands using local files or the local order store shouldn't be forwarded
+        """
+
+        parser = csutl.cli.build_parser()
+
+        assert not csutl.cli.uses_local_files(parser.parse_args(["market", "orders"]))
+        assert csutl.cli.uses_local_files(parser.parse_args(["market", "orders", "--local"]))
+        assert csutl.cli.uses_local_files(parser.parse_args(["market", "orders", "--sync"]))
+        assert csutl.cli.uses_local_files(parser.parse_args(["price_history", "btc", "--format", "bin"]))
@@ -0,0 +1,67 @@
+import io
+import random
+import pytest
+import csutl
+
+from csutl.loadtest import LatencyHistogram, StandInServer, run_load
+
+class TestLoadTest:
+    def test_histogram1(self):
+        """
+        Histogram percentiles should be within bucket precision of the exact values
+        """
+
+        rng = random.Random(5)
+        values = sorted(int(rng.lognormvariate(9, 1)) for _ in range(20000))
+
+        histogram = LatencyHistogram()
+        for value in values:
+            histogram.record(value)
+
+        for percentile in (50, 90, 99, 99.9):
+            exact = values[int(len(values) * percentile / 100) - 1]
+            assert histogram.value_at(percentile) == pytest.approx(exact, rel=0.02)
+
+        assert histogram.value_at(100) == values[-1]
+
+        distribution = histogram.distribution()
+        assert distribution[0][1] == 0.0
+        assert distribution[-1] == (values[-1], 100.0, len(values))
+        assert all(a[0] <= b[0] and a[1] < b[1] for a, b in zip(distribution, distribution[1:]))
+
+        file = io.StringIO()
+        histogram.report(file)
+        assert "Total count" in file.getvalue()
+
+    def test_load1(self, monkeypatch):
+        """
+        Concurrent posts against the stand-in server should all be counted
+        """
+
+        monkeypatch.setenv("COINSPOT_API_KEY", "apikey")
+        monkeypatch.setenv("COINSPOT_API_SECRET", "apisecret")
+
+        with StandInServer(latency=0.001, jitter=0.001) as server:
+            api = csutl.CoinSpotApi(base_url=server.base_url)
+
+            result = run_load(lambda: api.post("/api/v2/ro/my/balances", {}), 8, 5)
+            nonces = server.nonce_stats()
+
+        assert result["histogram"].total == 40
+        assert sum(result["errors"].values()) == 0
+        assert nonces["received"] == 40
+        assert nonces["duplicates"] == 0
+
+    def test_load2(self):
+        """
+        Injected faults should be reported as errors by status
+        """
+
+        with StandInServer(latency=0, jitter=0, rate_5xx=1.0) as server:
+            api = csutl.CoinSpotApi(base_url=server.base_url)
+
+            result = run_load(lambda: api.get("/pubapi/v2/latest"), 4, 3)
+
+        assert result["histogram"].total == 0
+        assert result["errors"] == {"HTTP 503": 12}
+        assert server.statuses[503] == 12
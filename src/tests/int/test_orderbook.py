@@ -0,0 +1,58 @@
+import pytest
+import csutl
+
+from csutl.orderbook import OrderBook
+
+class TestOrderBook:
+    def build(self):
+        return OrderBook.from_response("BTC", {
+            "buyorders": [
+                {"rate": "99", "amount": "1"},
+                {"rate": "98", "amount": "2"},
+                {"rate": "100", "amount": "0.5"}
+            ],
+            "sellorders": [
+                {"rate": "102", "amount": "2"},
+                {"rate": "101", "amount": "1"}
+            ]
+        })
+
+    def test_fill1(self):
+        """
+        Buy fills walk the asks from the lowest rate
+        """
+
+        book = self.build()
+
+        fill = book.fill("buy", amount=2)
+        assert fill["complete"]
+        assert fill["levels"] == 2
+        assert fill["worst_rate"] == 102
+        assert fill["vwap"] == pytest.approx(101.5)
+
+        fill = book.fill("buy", aud=101)
+        assert fill["levels"] == 1
+        assert fill["amount"] == pytest.approx(1)
+
+    def test_fill2(self):
+        """
+        Sell fills walk the bids from the highest rate
+        """
+
+        book = self.build()
+
+        fill = book.fill("sell", amount=1.5)
+        assert fill["worst_rate"] == 99
+        assert fill["aud"] == pytest.approx(50 + 99)
+
+    def test_fill3(self):
+        """
+        Orders larger than the book should be reported as incomplete
+        """
+
+        book = self.build()
+
+        fill = book.fill("sell", amount=10)
+        assert not fill["complete"]
+        assert fill["amount"] == pytest.approx(3.5)
+        assert fill["worst_rate"] == 98
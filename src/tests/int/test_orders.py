@@ -0,0 +1,103 @@
+import os
+import json
+import pytest
+import csutl
+
+from csutl.orders import OrderStore, parse_date_ms, SYNC_LIMIT
+
+def make_order(coin, ms):
+    return {
+        "coin": coin,
+        "market": f"{coin}/AUD",
+        "amount": 1.0,
+        "rate": 100.0,
+        "total": 100.0,
+        "solddate": f"{ms}"
+    }
+
+class TestOrders:
+    def test_parse_date1(self):
+        """
+        Dates should parse from epoch milliseconds and iso formats
+        """
+
+        assert parse_date_ms("1700000000000") == 1700000000000
+        assert parse_date_ms("2024-01-01") == 1704067200000
+        assert parse_date_ms("2024-01-01T00:00:01.500Z") == 1704067201500
+
+        with pytest.raises(csutl.exception.ArgumentException):
+            parse_date_ms("yesterday")
+
+    def test_sync1(self, tmp_path, monkeypatch):
+        """
+        Sync should only request orders from the newest stored order, and
+        queries should be served locally
+        """
+
+        monkeypatch.setenv("COINSPOT_API_KEY", "apikey")
+        monkeypatch.setenv("COINSPOT_API_SECRET", "apisecret")
+
+        orders = [("buy", make_order("BTC", 1000)), ("sell", make_order("ETH", 2000))]
+        requests_made = []
+
+        def test_requestor(method, url, headers, payload=None):
+            request = json.loads(payload)
+            requests_made.append(request)
+
+            start = int(request.get("startdate", 0))
+            return json.dumps({
+                "status": "ok",
+                "buyorders": [x for side, x in orders if side == "buy" and int(x["solddate"]) >= start],
+                "sellorders": [x for side, x in orders if side == "sell" and int(x["solddate"]) >= start]
+            })
+
+        api = csutl.CoinSpotApi(requestor=test_requestor)
+        store = OrderStore(str(tmp_path / "orders.db"))
+
+        assert store.sync(api, "orders") == 2
+        assert "startdate" not in requests_made[-1]
+
+        orders.append(("buy", make_order("BTC", 3000)))
+        assert store.sync(api, "orders") == 1
+        assert requests_made[-1]["startdate"] == 2000
+
+        response = json.loads(store.query("orders", coin="btc"))
+        assert [x["solddate"] for x in response["buyorders"]] == ["3000", "1000"]
+        assert response["sellorders"] == []
+
+        response = json.loads(store.query("orders", start=1500, end=2500))
+        assert len(response["buyorders"]) == 0
+        assert len(response["sellorders"]) == 1
+
+        # Other sources and accounts are kept apart
+        assert json.loads(store.query("market"))["buyorders"] == []
+        monkeypatch.setenv("COINSPOT_API_KEY", "otherkey")
+        assert json.loads(store.query("orders"))["buyorders"] == []
+
+        store.close()
+
+    def test_sync2(self, tmp_path, monkeypatch):
+        """
+        Full pages should be followed backwards by end date
+        """
+
+        monkeypatch.setenv("COINSPOT_API_KEY", "apikey")
+        monkeypatch.setenv("COINSPOT_API_SECRET", "apisecret")
+
+        orders = [make_order("BTC", 1000 + x) for x in range(SYNC_LIMIT + 100)]
+
+        def test_requestor(method, url, headers, payload=None):
+            request = json.loads(payload)
+            end = int(request.get("enddate", 10 ** 15))
+
+            # Newest first, truncated to the limit
+            matched = [x for x in reversed(orders) if int(x["solddate"]) <= end]
+            return json.dumps({"status": "ok", "buyorders": matched[:request["limit"]], "sellorders": []})
+
+        api = csutl.CoinSpotApi(requestor=test_requestor)
+        store = OrderStore(str(tmp_path / "orders.db"))
+
+        assert store.sync(api, "market") == len(orders)
+        assert len(json.loads(store.query("market"))["buyorders"]) == len(orders)
+
+        store.close()
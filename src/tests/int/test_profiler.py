@@ -0,0 +1,31 @@
+import json
+import time
+import pytest
+import csutl
+
+from csutl.profiler import Profiler
+
+class TestProfiler:
+    def test_stream_requestor1(self, tmp_path):
+        """
+        Streamed requests should count the wait for every chunk of the body
+        """
+
+        body = json.dumps([[x, 100.0] for x in range(100)]).encode("utf-8")
+
+        def test_stream_requestor(method, url, headers, payload=None):
+            def chunks():
+                for x in range(0, len(body), 500):
+                    time.sleep(0.02)
+                    yield body[x:x + 500]
+
+            return chunks()
+
+        profiler = Profiler(str(tmp_path / "profile.out"))
+
+        api = csutl.CoinSpotApi(requestor=lambda *args: b"[]")
+        api.stream_requestor = profiler.wrap_stream_requestor(test_stream_requestor)
+
+        assert len(list(api.iter_price_history("BTC", 0, 1000))) == 100
+        assert profiler.request_count == 1
+        assert profiler.request_time >= 0.02 * (len(body) // 500)
@@ -0,0 +1,76 @@
+import json
+import io
+import pytest
+import csutl
+
+from csutl.series import iter_series, load_series, write_series_bin, write_series_csv, write_series_ndjson, BIN_HEADER
+
+class TestSeries:
+    def test_bin1(self, tmp_path):
+        """
+        A binary series should round trip through the memory mapped loader
+        """
+
+        path = str(tmp_path / "series.bin")
+        timestamps = [1700000000000 + x * 60000 for x in range(1000)]
+        prices = [100.0 + x / 7 for x in range(1000)]
+
+        with open(path, "wb") as file:
+            write_series_bin(file, timestamps, prices, coin="BTC")
+
+        assert (tmp_path / "series.bin").stat().st_size == BIN_HEADER.size + 1000 * 16
+
+        loaded_timestamps, loaded_prices = load_series(path)
+        assert list(loaded_timestamps) == timestamps
+        assert list(loaded_prices) == prices
+
+    def test_bin2(self, tmp_path):
+        """
+        Truncated binary series should be rejected
+        """
+
+        path = tmp_path / "series.bin"
+
+        buffer = io.BytesIO()
+        write_series_bin(buffer, [1, 2], [1.0, 2.0])
+        path.write_bytes(buffer.getvalue()[:-1])
+
+        with pytest.raises(csutl.exception.RuntimeException):
+            load_series(str(path))
+
+    def test_text1(self):
+        """
+        Check the csv and ndjson writers
+        """
+
+        buffer = io.StringIO()
+        write_series_csv(buffer, [1, 2], [1.5, 2.5])
+        assert buffer.getvalue() == "timestamp,price\n1,1.5\n2,2.5\n"
+
+        buffer = io.StringIO()
+        write_series_ndjson(buffer, [1, 2], [1.5, 2.5])
+        assert buffer.getvalue() == '{"timestamp":1,"price":1.5}\n{"timestamp":2,"price":2.5}\n'
+
+    def test_iter1(self):
+        """
+        Incremental parsing should match a full parse, however the body is split
+        """
+
+        series = [[1700000000000 + x * 60000, 100.0 + x / 7] for x in range(500)]
+        content = json.dumps(series).encode("utf-8")
+
+        for size in (1, 7, 64, len(content)):
+            chunks = [content[x:x + size] for x in range(0, len(content), size)]
+            assert [list(x) for x in iter_series(chunks)] == series
+
+        assert list(iter_series([" [ ]\n"])) == []
+
+    def test_iter2(self):
+        """
+        Invalid series should be rejected by the incremental parser
+        """
+
+        for content in (b"", b'{"a": 1}', b"[[1, 2, 3]]", b"[[1, 2]", b"[[1, 2]] x", b"[[1,2][3,4]]", b"[,[1,2]]",
+                        b"[[1,2],]", b"[[e,1]]", b"[[1,2],[3,-]]"):
+            with pytest.raises(csutl.exception.RuntimeException):
+                list(iter_series([content]))
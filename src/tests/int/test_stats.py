@@ -0,0 +1,216 @@
+import sys
+import bisect
+import random
+import statistics
+import pytest
+import csutl
+
+from csutl.stats import build_stats, build_stats_approx, build_indicators, parse_indicators, sorted_quantiles, sorted_quantile, RollingStats, SortedBlocks
+
+class TestStats:
+    def test_sorted_quantiles1(self):
+        """
+        Quantiles from sorted data should match statistics.quantiles
+        """
+
+        rng = random.Random(1)
+        for count in (2, 3, 7, 10, 101):
+            data = sorted(rng.uniform(1, 100) for _ in range(count))
+
+            assert sorted_quantiles(data) == statistics.quantiles(data)
+            assert sorted_quantiles(data, n=10) == statistics.quantiles(data, n=10)
+
+    def test_sorted_quantile1(self):
+        """
+        A single quantile at i/n should match the matching statistics.quantiles cut point
+        """
+
+        rng = random.Random(4)
+        for count in (2, 3, 10, 101):
+            data = sorted(rng.uniform(1, 100) for _ in range(count))
+            expected = statistics.quantiles(data, n=20)
+
+            for i in range(1, 20):
+                assert sorted_quantile(data, i / 20) == pytest.approx(expected[i - 1])
+
+    def test_reference_prices1(self):
+        """
+        A list of reference prices should match evaluating each reference on its own
+        """
+
+        rng = random.Random(5)
+        prices = [rng.uniform(50, 150) for _ in range(1000)]
+        references = [40.0, 75.5, 100.0, 149.0, 200.0]
+
+        response = build_stats(prices, reference_prices=references, quantiles=[0.05, 0.5, 0.95])
+
+        assert response["med"] == statistics.median(prices)
+        assert response["quartiles"] == statistics.quantiles(prices)
+        assert response["reference"] == build_stats(prices)["reference"]
+        assert response["requested_quantiles"]["0.5"] == pytest.approx(statistics.median(prices))
+
+        for reference, actual in zip(references, response["references"]):
+            expected = build_stats(prices, reference_price=reference)["reference"]
+            assert actual == expected
+            assert actual["quartile_index"] == sum(1 for x in response["quartiles"] if reference > x)
+
+        with pytest.raises(csutl.exception.ArgumentException):
+            build_stats(prices, quantiles=[1.5])
+
+    def test_rolling_stats1(self):
+        """
+        Rolling stats should match stats calculated from scratch over the same window
+        """
+
+        rng = random.Random(2)
+        prices = [rng.uniform(90, 110) for _ in range(200)]
+
+        rolling = RollingStats(width_ms=50)
+        for i, price in enumerate(prices):
+            rolling.push(price, timestamp=i)
+
+            window = prices[max(0, i - 50):i + 1]
+            if len(window) < 2:
+                continue
+
+            expected = build_stats(window, reference_price=100.0)
+            actual = rolling.stats(reference_price=100.0)
+
+            assert len(rolling) == len(window)
+            assert actual["quartiles"] == expected["quartiles"]
+            assert actual["ten_quantiles"] == expected["ten_quantiles"]
+            assert actual["med"] == expected["med"]
+            assert actual["min"] == expected["min"] and actual["max"] == expected["max"]
+            assert actual["avg"] == pytest.approx(expected["avg"])
+            assert actual["pstdev"] == pytest.approx(expected["pstdev"])
+            assert actual["reference"]["quartile_index"] == expected["reference"]["quartile_index"]
+            assert actual["reference"]["pstdev_index"] == pytest.approx(expected["reference"]["pstdev_index"])
+
+    def test_rolling_stats2(self):
+        """
+        Evicting all samples should reset the window
+        """
+
+        rolling = RollingStats()
+        rolling.push(1.0)
+        rolling.push(2.0)
+        rolling.evict()
+        rolling.evict()
+
+        assert len(rolling) == 0
+
+        with pytest.raises(csutl.exception.RuntimeException):
+            rolling.stats()
+
+    def test_sorted_blocks1(self):
+        """
+        SortedBlocks should match a sorted list through adds and removes that
+        split and empty blocks
+        """
+
+        rng = random.Random(4)
+        blocks = SortedBlocks()
+        expected = []
+
+        for step in range(5000):
+            if expected and rng.random() < 0.45:
+                value = expected[rng.randrange(len(expected))]
+                blocks.remove(value)
+                expected.remove(value)
+            else:
+                value = rng.randrange(200)
+                blocks.add(value)
+                expected.append(value)
+                expected.sort()
+
+            if step % 97 == 0:
+                assert len(blocks) == len(expected)
+                assert [blocks[i] for i in range(len(blocks))] == expected
+
+        assert len(blocks.blocks) > 1
+        assert blocks[0] == expected[0] and blocks[-1] == expected[-1]
+
+        with pytest.raises(csutl.exception.RuntimeException):
+            blocks.remove(1000)
+
+        with pytest.raises(IndexError):
+            blocks[len(expected)] # pylint: disable=pointless-statement
+
+    def test_approx_stats1(self):
+        """
+        Approximate quantiles should be within the stated rank error
+        """
+
+        rng = random.Random(3)
+        prices = [rng.gauss(100, 10) for _ in range(100000)]
+        ordered = sorted(prices)
+
+        response = build_stats_approx(iter(prices), reference_price=100.0)
+        error = response["approx"]["rank_error"]
+
+        for i, value in enumerate(response["ten_quantiles"], start=1):
+            rank = bisect.bisect_left(ordered, value) / len(ordered)
+            assert abs(rank - i / 10) <= error
+
+        assert response["min"] == ordered[0]
+        assert response["max"] == ordered[-1]
+        assert response["avg"] == pytest.approx(statistics.mean(prices))
+        assert response["pstdev"] == pytest.approx(statistics.pstdev(prices))
+        assert len(response["quartiles"]) == 3
+        assert "quartile_index" in response["reference"]
+
+        response = build_stats_approx(iter(prices), reference_prices=[90.0, 110.0], quantiles=[0.01, 0.99])
+        assert len(response["references"]) == 2
+        for fraction, value in response["requested_quantiles"].items():
+            rank = bisect.bisect_left(ordered, value) / len(ordered)
+            assert abs(rank - float(fraction)) <= error
+
+    def test_indicators1(self):
+        """
+        Check indicators against direct calculations
+        """
+
+        prices = [float(x % 7 + x / 10) for x in range(60)]
+        indicators = parse_indicators("sma:5,ema:10,rsi,bbands:5,roc:3")
+
+        response = build_indicators(prices, indicators)
+
+        assert response["sma_5"] == pytest.approx(statistics.mean(prices[-5:]))
+        assert response["bbands_5"]["upper"] == pytest.approx(statistics.mean(prices[-5:]) + 2 * statistics.pstdev(prices[-5:]))
+        assert response["roc_3"] == pytest.approx((prices[-1] / prices[-4] - 1) * 100)
+
+        ema = prices[0]
+        for price in prices[1:]:
+            ema += 2 / 11 * (price - ema)
+        assert response["ema_10"] == pytest.approx(ema)
+
+        assert 0 <= response["rsi_14"] <= 100
+
+        assert build_indicators(prices[:3], indicators)["sma_5"] is None
+
+    def test_indicators2(self, monkeypatch):
+        """
+        The vectorised and pure python indicators should agree
+        """
+
+        pytest.importorskip("numpy")
+
+        rng = random.Random(4)
+        prices = [100 + rng.gauss(0, 1) for _ in range(1000)]
+        indicators = parse_indicators("sma,ema,ema:50,rsi,bbands,roc")
+
+        vectorised = build_indicators(prices, indicators)
+        monkeypatch.setitem(sys.modules, "numpy", None)
+        pure = build_indicators(prices, indicators)
+
+        assert vectorised.keys() == pure.keys()
+        for key, value in pure.items():
+            assert vectorised[key] == pytest.approx(value)
+
+    def test_indicators3(self):
+        """
+        Unknown indicators should be rejected
+        """
+
+        with pytest.raises(csutl.exception.ArgumentException):
+            parse_indicators("sma,macd")
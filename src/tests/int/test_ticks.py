@@ -0,0 +1,113 @@
+import os
+import json
+import pytest
+import csutl
+
+from csutl.ticks import TickStore, SegmentIndex, parse_latest
+
+def snapshot(step):
+    """
+    Ticks for a snapshot, with BTC changing every step and ETH every fourth step
+    """
+
+    return {
+        "BTC": (100.0 + step, 101.0 + step, 100.5 + step),
+        "ETH": (10.0 + step // 4, 10.5 + step // 4, 10.2 + step // 4)
+    }
+
+class TestTicks:
+    def test_parse_latest1(self):
+        """
+        Latest prices should parse to bid/ask/last floats, skipping invalid coins
+        """
+
+        response = json.dumps({"status": "ok", "prices": {
+            "btc": {"bid": "99", "ask": "101", "last": "100"},
+            "bad": {"bid": "1"}
+        }})
+
+        assert parse_latest(response) == {"BTC": (99.0, 101.0, 100.0)}
+
+    def test_record1(self, tmp_path):
+        """
+        Ticks should round trip, storing only changes, and range queries
+        should include the prices in effect at the start
+        """
+
+        with TickStore(str(tmp_path)) as store:
+            for step in range(40):
+                changed = store.append(1000 + step * 10, snapshot(step))
+                assert changed == (2 if step % 4 == 0 else 1)
+
+            # Queries are served from the in memory index while recording
+            assert len(store.query("btc")) == 40
+
+        store = TickStore(str(tmp_path))
+
+        btc = store.query("BTC", start=1100, end=1200)
+        assert [x[0] for x in btc] == list(range(1100, 1201, 10))
+        assert btc[0][1:] == snapshot(10)["BTC"]
+
+        # ETH changed at 1080, so that is the tick in effect at 1100
+        eth = store.query("ETH", start=1100, end=1200)
+        assert [x[0] for x in eth] == [1080, 1120, 1160, 1200]
+        assert eth[0][1:] == snapshot(8)["ETH"]
+
+        assert store.query("SOL") == []
+
+    def test_rotate1(self, tmp_path):
+        """
+        Segments should rotate by size, each indexed and readable on its own,
+        with the oldest removed beyond keep
+        """
+
+        with TickStore(str(tmp_path), segment_bytes=1024) as store:
+            for step in range(100):
+                store.append(1000 + step * 10, snapshot(step))
+
+        segments = store.segments()
+        assert len(segments) > 3
+        assert all(os.path.exists(path + ".idx") for _, path in segments)
+
+        # Every segment starts with a complete snapshot
+        index = SegmentIndex.read(segments[1][1] + ".idx")
+        assert index.coins["ETH"][0] == 0
+        assert index.coins["BTC"][0] == 0
+
+        expected = [(1000 + x * 10, *snapshot(x)["BTC"]) for x in range(100)]
+        assert store.query("BTC") == expected
+        assert store.query("BTC", start=1455, end=1705) == expected[45:71]
+
+        with TickStore(str(tmp_path), segment_bytes=1024, keep=2) as store:
+            store.append(5000, snapshot(100))
+
+        assert len(store.segments()) == 2
+
+    def test_recover1(self, tmp_path):
+        """
+        A segment left by an interrupted recorder should be indexed, with a
+        partly written record dropped
+        """
+
+        store = TickStore(str(tmp_path))
+        for step in range(10):
+            store.append(1000 + step * 10, snapshot(step))
+
+        # Simulate a crash part way through a record
+        store.file.write(b"S\x40\x00")
+        store.file.close()
+        path = store.segment_path
+
+        # Readers scan a segment without an index
+        reader = TickStore(str(tmp_path))
+        assert len(reader.query("BTC")) == 10
+
+        with TickStore(str(tmp_path)) as store:
+            store.append(2000, snapshot(10))
+
+            assert os.path.exists(path + ".idx")
+            assert len(store.query("BTC")) == 11
+
+        with pytest.raises(csutl.exception.RuntimeException):
+            with TickStore(str(tmp_path)) as store:
+                store.append(1500, snapshot(11))
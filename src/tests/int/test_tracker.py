@@ -0,0 +1,157 @@
+import io
+import json
+import time
+import threading
+import pytest
+import csutl
+
+from csutl.cli import build_parser
+from csutl.tracker import OpenOrderTracker
+
+class TestTracker:
+    def test_refresh1(self, tmp_path, monkeypatch):
+        """
+        Refreshes should apply differences to the cached order set, which is
+        shared with later trackers
+        """
+
+        monkeypatch.setenv("COINSPOT_API_KEY", "apikey")
+        monkeypatch.setenv("COINSPOT_API_SECRET", "apisecret")
+
+        open_orders = {"buyorders": [{"id": "a", "amount": 1, "rate": 10}], "sellorders": [{"id": "b", "amount": 1, "rate": 12}]}
+        calls = []
+
+        def test_requestor(method, url, headers, payload=None):
+            calls.append(json.loads(payload))
+            return json.dumps({"status": "ok", **open_orders})
+
+        api = csutl.CoinSpotApi(requestor=test_requestor)
+        path = str(tmp_path / "open_orders.json")
+
+        tracker = OpenOrderTracker(api, path=path)
+        assert tracker.count("btc") == 2
+        assert calls[-1]["cointype"] == "BTC"
+
+        open_orders["buyorders"] = []
+        added, removed = tracker.refresh("btc")
+        assert added == []
+        assert removed == ["a"]
+        tracker.close()
+
+        # A fresh cached set is used without a request
+        tracker = OpenOrderTracker(api, path=path)
+        assert tracker.count("BTC") == 1
+        assert len(calls) == 2
+        tracker.close()
+
+        # A stale cached set is refreshed
+        tracker = OpenOrderTracker(api, path=path, max_age=0)
+        time.sleep(0.01)
+        assert tracker.count("BTC") == 1
+        assert len(calls) == 3
+        tracker.close()
+
+    def test_record1(self, tmp_path, monkeypatch):
+        """
+        Orders placed should be added to the set ahead of a refresh, and the
+        count shouldn't wait on a background refresh when the set is fresh
+        """
+
+        monkeypatch.setenv("COINSPOT_API_KEY", "apikey")
+        monkeypatch.setenv("COINSPOT_API_SECRET", "apisecret")
+
+        release = threading.Event()
+
+        def test_requestor(method, url, headers, payload=None):
+            release.wait(5)
+            return json.dumps({"status": "ok", "buyorders": [], "sellorders": []})
+
+        api = csutl.CoinSpotApi(requestor=test_requestor)
+        path = str(tmp_path / "open_orders.json")
+
+        tracker = OpenOrderTracker(api, path=path)
+
+        release.set()
+        assert tracker.count("BTC") == 0
+        release.clear()
+
+        tracker.record("sell", "btc", json.dumps({"status": "ok", "id": "c", "amount": 1, "rate": 12}))
+        assert tracker.count("BTC") == 1
+
+        future = tracker.start_refresh("btc")
+        assert tracker.count("BTC") == 1
+        assert not future.done()
+
+        release.set()
+        tracker.close()
+
+        assert OpenOrderTracker(api, path=path).count("BTC") == 0
+
+    def test_refresh_failed1(self, tmp_path, monkeypatch):
+        """
+        A failed refresh should fall back to the cached set, and only fail the
+        count without one
+        """
+
+        monkeypatch.setenv("COINSPOT_API_KEY", "apikey")
+        monkeypatch.setenv("COINSPOT_API_SECRET", "apisecret")
+
+        fail = threading.Event()
+
+        def test_requestor(method, url, headers, payload=None):
+            if fail.is_set():
+                raise csutl.exception.RuntimeException("Invalid nonce")
+            return json.dumps({"status": "ok", "buyorders": [{"id": "a"}], "sellorders": []})
+
+        api = csutl.CoinSpotApi(requestor=test_requestor)
+        path = str(tmp_path / "open_orders.json")
+
+        tracker = OpenOrderTracker(api, path=path, max_age=0)
+        assert tracker.count("BTC") == 1
+
+        fail.set()
+        tracker.start_refresh("btc").exception()
+        assert tracker.count("BTC") == 1
+
+        with pytest.raises(csutl.exception.RuntimeException):
+            tracker.count("ETH")
+
+        tracker.close()
+
+    def test_place_record_failed1(self, tmp_path, monkeypatch):
+        """
+        simple_buy_sell should still place the sell order when recording the
+        orders fails
+        """
+
+        monkeypatch.setenv("COINSPOT_API_KEY", "apikey")
+        monkeypatch.setenv("COINSPOT_API_SECRET", "apisecret")
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+
+        orders = []
+
+        def test_requestor(method, url, headers, payload=None):
+            if "balance/aud" in url:
+                return json.dumps({"status": "ok", "balance": {"AUD": {"available": 1000}}})
+            if "/latest/" in url:
+                return json.dumps({"status": "ok", "prices": {"bid": "90", "ask": "90"}})
+            if "history_basic" in url:
+                return json.dumps([[x, 100.0 + x % 3] for x in range(10)])
+            if "orders/market/open" in url:
+                return json.dumps({"status": "ok", "buyorders": [], "sellorders": []})
+
+            orders.append(url)
+            return json.dumps({"status": "ok", "id": "1", "amount": 1, "rate": 1})
+
+        def failed_record(self, side, coin, response):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(OpenOrderTracker, "record", failed_record)
+
+        args = build_parser().parse_args(["simple_buy_sell", "btc", "10"])
+        args.api = csutl.CoinSpotApi(requestor=test_requestor)
+        args.output = io.StringIO()
+        args.call_func(args)
+
+        assert [x.rsplit("/", 1)[-1] for x in orders] == ["buy", "sell"]
+        assert json.loads(args.output.getvalue())["sell"]["id"] == "1"
@@ -0,0 +1,211 @@
+import io
+import json
+import time
+import threading
+import pytest
+import requests
+import csutl
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from csutl.cli import build_parser
+from csutl.exception import CircuitOpenException, DeadlineExceededException
+from csutl.loadtest import StandInServer
+from csutl.transport import CircuitBreaker, endpoint_family, deadline_scope, remaining_time
+
+def failing():
+    raise requests.ConnectionError("down")
+
+class TestTransport:
+    def test_family1(self):
+        """
+        Urls should map to their endpoint families
+        """
+
+        assert endpoint_family("https://www.coinspot.com.au/pubapi/v2/latest/btc") == "latest"
+        assert endpoint_family("https://www.coinspot.com.au/charts/history_basic?symbol=BTC") == "history"
+        assert endpoint_family("https://www.coinspot.com.au/api/v2/ro/my/balances") == "readonly"
+        assert endpoint_family("https://www.coinspot.com.au/api/v2/my/buy") == "trading"
+        assert endpoint_family("https://www.coinspot.com.au/pubapi/v2/orders/open/btc") == "public"
+
+    def test_breaker1(self):
+        """
+        The circuit should open after consecutive failures, fail fast, then close
+        after a successful probe
+        """
+
+        breaker = CircuitBreaker(threshold=2, cooloff=0.2)
+        url = "https://www.coinspot.com.au/pubapi/v2/latest"
+        calls = []
+
+        def succeed():
+            calls.append(1)
+            return "ok"
+
+        for _ in range(2):
+            with pytest.raises(requests.ConnectionError):
+                breaker.call(url, failing)
+
+        with pytest.raises(CircuitOpenException):
+            breaker.call(url, succeed)
+        assert calls == []
+
+        # Other families are unaffected
+        assert breaker.call("https://www.coinspot.com.au/charts/history_basic", succeed) == "ok"
+
+        time.sleep(0.25)
+        assert breaker.call(url, succeed) == "ok"
+        assert breaker.call(url, succeed) == "ok"
+
+    def test_breaker2(self, tmp_path):
+        """
+        Persisted breaker state should be shared, with a failed probe reopening
+        the circuit
+        """
+
+        path = str(tmp_path / "breaker.json")
+        url = "https://www.coinspot.com.au/api/v2/ro/my/balances"
+
+        first = CircuitBreaker(threshold=1, cooloff=0.2, path=path)
+        second = CircuitBreaker(threshold=1, cooloff=0.2, path=path)
+
+        with pytest.raises(requests.ConnectionError):
+            first.call(url, failing)
+
+        with pytest.raises(CircuitOpenException):
+            second.call(url, lambda: "ok")
+
+        time.sleep(0.25)
+
+        # Only one probe is let through while half open
+        with pytest.raises(requests.ConnectionError):
+            second.call(url, failing)
+        with pytest.raises(CircuitOpenException):
+            first.call(url, lambda: "ok")
+
+        # Client errors don't count against the circuit
+        time.sleep(0.25)
+        with pytest.raises(ValueError):
+            first.call(url, lambda: int("x"))
+        assert second.call(url, lambda: "ok") == "ok"
+
+    def test_breaker3(self):
+        """
+        Retries should stop once the circuit opens
+        """
+
+        calls = []
+
+        def test_requestor(method, url, headers, payload=None):
+            calls.append(url)
+            raise requests.ConnectionError("down")
+
+        api = csutl.CoinSpotApi(requestor=test_requestor, retry_policy=csutl.transport.RetryPolicy(attempts=5, backoff=0),
+            breaker=CircuitBreaker(threshold=2, cooloff=10))
+
+        with pytest.raises(CircuitOpenException):
+            api.get("/pubapi/v2/latest")
+
+        assert len(calls) == 2
+
+    def test_deadline1(self):
+        """
+        Requests should be cut short, and later requests refused, once the
+        deadline passes
+        """
+
+        with StandInServer(latency=0.5, jitter=0) as server:
+            api = csutl.CoinSpotApi(base_url=server.base_url)
+
+            start = time.monotonic()
+            with deadline_scope(0.2):
+                with pytest.raises(DeadlineExceededException):
+                    api.get("/pubapi/v2/latest")
+
+                with pytest.raises(DeadlineExceededException):
+                    api.get("/pubapi/v2/latest")
+
+            assert time.monotonic() - start < 0.45
+            assert remaining_time() is None
+
+    def test_deadline_stream1(self):
+        """
+        A slowly trickling streamed body should be cut short once the deadline passes
+        """
+
+        class TrickleHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                pass
+
+            def do_GET(self): # pylint: disable=invalid-name
+                self.send_response(200)
+                self.end_headers()
+
+                try:
+                    self.wfile.write(b"[")
+                    for index in range(40):
+                        self.wfile.write(f"[{index},1.0],".encode("utf-8") * 8192)
+                        self.wfile.flush()
+                        time.sleep(0.05)
+                    self.wfile.write(b"[0,1.0]]")
+                except OSError:
+                    pass
+
+        server = HTTPServer(("127.0.0.1", 0), TrickleHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        try:
+            api = csutl.CoinSpotApi(base_url=f"http://127.0.0.1:{server.server_address[1]}")
+
+            start = time.monotonic()
+            with deadline_scope(0.3):
+                with pytest.raises(DeadlineExceededException):
+                    list(api.iter_price_history("BTC", 0, 1000))
+
+            assert time.monotonic() - start < 1.0
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_deadline2(self, tmp_path, monkeypatch):
+        """
+        simple_buy_sell should skip the buy, without placing orders, once the
+        deadline passes
+        """
+
+        monkeypatch.setenv("COINSPOT_API_KEY", "apikey")
+        monkeypatch.setenv("COINSPOT_API_SECRET", "apisecret")
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+
+        orders = []
+
+        def test_requestor(method, url, headers, payload=None):
+            if "balance/aud" in url:
+                return json.dumps({"status": "ok", "balance": {"AUD": {"available": 1000}}})
+            if "/latest/" in url:
+                return json.dumps({"status": "ok", "prices": {"bid": "90", "ask": "90"}})
+            if "history_basic" in url:
+                time.sleep(0.3)
+                return json.dumps([[x, 100.0 + x % 3] for x in range(10)])
+            if "orders/market/open" in url:
+                return json.dumps({"status": "ok", "buyorders": [], "sellorders": []})
+
+            orders.append(url)
+            return json.dumps({"status": "ok", "id": "1", "amount": 1, "rate": 1})
+
+        args = build_parser().parse_args(["simple_buy_sell", "btc", "10", "--deadline", "0.1"])
+        args.api = csutl.CoinSpotApi(requestor=test_requestor)
+        args.output = io.StringIO()
+
+        with deadline_scope(args.deadline):
+            args.call_func(args)
+
+        assert orders == []
+        assert args.output.getvalue() == ""
+
+        args.deadline = 5.0
+        with deadline_scope(args.deadline):
+            args.call_func(args)
+
+        assert len(orders) == 2